@@ -1,9 +1,16 @@
 import streamlit as st
 import time
-import json
 import requests
 from datetime import datetime
 
+from Front_back_Net.chat_render import ChatHistoryView, style_injection
+from Front_back_Net.prompt_context import build_prompt, render_turn
+from Front_back_Net.render_scheduler import SENTENCE_BOUNDARIES, RenderScheduler
+from Front_back_Net.sse import iter_tokens
+
+# 生成被中断时追加在部分回答之后
+GENERATION_CANCELLED_NOTE = "（已停止生成）"
+
 # 修改后的API类
 class WenHuaAPI:
     def __init__(self):
@@ -41,6 +48,11 @@ def init_session_state():
         st.session_state.is_responding = False
     if "prompt_to_process" not in st.session_state:
         st.session_state.prompt_to_process = None
+    if "history_view" not in st.session_state:
+        st.session_state.history_view = ChatHistoryView()
+    if "context_history" not in st.session_state:
+        # 已渲染的对话历史，只在新消息到达时追加
+        st.session_state.context_history = ""
 
 
 # 添加消息到对话历史
@@ -51,6 +63,7 @@ def add_message(sender, message):
         "message": message,
         "timestamp": timestamp
     })
+    st.session_state.context_history += render_turn(sender, message)
 
 
 # 主应用
@@ -63,9 +76,9 @@ def main():
 
     init_session_state()
 
-    # 自定义CSS样式
-    st.markdown("""
-    <style>
+    # 自定义CSS样式：每个页面会话只在第一次运行时发送，插入 document.head 后不随重新运行移除
+    if "page_style_sent" not in st.session_state:
+        st.html(style_injection("""
     /* 用户消息容器 - 右侧 */
     .user-message-container {
         display: flex;
@@ -154,8 +167,8 @@ def main():
         66% { content: '...'; }
         100% { content: '.'; }
     }
-    </style>
-    """, unsafe_allow_html=True)
+    """), unsafe_allow_javascript=True)
+        st.session_state.page_style_sent = True
 
     st.title("文华财经AI智能客服助手")
     st.caption("基于文华财经大模型的AI智能客服系统")
@@ -175,28 +188,14 @@ def main():
                 </div>
             """.format(datetime.now().strftime('%H:%M:%S')), unsafe_allow_html=True)
 
-        for msg in st.session_state.conversation:
-            if msg["sender"] == "ai":
-                st.markdown(f"""
-                    <div class="ai-message-container">
-                        <div class="avatar ai-avatar">🤖</div>
-                        <div class="ai-message">
-                            <div class="status-title completed">【已深度思考】</div>
-                            {msg["message"]}
-                            <div class="message-timestamp">{msg['timestamp']} | AI助手</div>
-                        </div>
-                    </div>
-                """, unsafe_allow_html=True)
-            elif msg["sender"] == "user":
-                st.markdown(f"""
-                    <div class="user-message-container">
-                        <div class="user-message">
-                            {msg["message"]}
-                            <div class="message-timestamp">{msg['timestamp']} | 您</div>
-                        </div>
-                        <div class="avatar user-avatar">👤</div>
-                    </div>
-                """, unsafe_allow_html=True)
+        # 已完成的消息按块缓存 HTML，只渲染新增的消息，较早的消息点击后才显示
+        history_view = st.session_state.history_view
+        hidden, blocks = history_view.blocks(st.session_state.conversation)
+        if hidden:
+            st.button(f"显示更早的消息（还有 {hidden} 条）", key="show_earlier",
+                      on_click=history_view.show_earlier)
+        for block in blocks:
+            st.markdown(block, unsafe_allow_html=True)
 
         # 插入滚动标记
         st.markdown('<div id="endofchat"></div>', unsafe_allow_html=True)
@@ -220,23 +219,11 @@ def main():
         st.rerun()
 
     if st.session_state.is_responding and st.session_state.prompt_to_process:
-        # 构建上下文内容
-        context_content = ""
-        for msg in st.session_state.conversation:
-            if msg["sender"] == "user":
-                context_content += f"用户: {msg['message']}\n"
-            elif msg["sender"] == "ai":
-                context_content += f"AI: {msg['message']}\n"
-
-        # 添加系统提示
-        system_prompt = (
-            "你是文华财经公司的客服助手小文，请以专业、友好的态度回答用户问题。"
-            "回答要简洁明了，专注于提供市场信息、数据分析和操作指导。"
-            "如果用户咨询购买问题，请明确提供400客服电话方便用户转人工服务。"
-            "保持上下文逻辑关联，确保回答准确、专业。"
-        )
-        context_content = f"系统设定: {system_prompt}\n{context_content}"
+        # 构建上下文内容（固定系统提示前缀 + 增量维护的对话历史）
+        context_content = build_prompt(st.session_state.context_history)
 
+        response_stream = None
+        scheduler = None
         try:
             response_stream = st.session_state.api.generate_response(context_content)
             full_response = ""
@@ -260,39 +247,29 @@ def main():
                     ),
                     unsafe_allow_html=True
                 )
+                # 点击后页面重新运行，正在进行的生成在下一次渲染时被中断
+                st.button("停止生成", key="stop_generation")
 
-                for line in response_stream.iter_lines():
-                    if line:
-                        decoded_line = line.decode("utf-8")
-                        if decoded_line.startswith("data: "):
-                            data = decoded_line[6:]
-                            if data == "[DONE]":
-                                break
-                            try:
-                                chunk = json.loads(data)
-                                if "choices" in chunk and chunk["choices"]:
-                                    delta = chunk["choices"][0].get("delta", {})
-                                    token = delta.get("content", "")
-                                    if token is not None:
-                                        full_response += token
-                                        display_response = full_response
-                                        if not token.endswith(('\n', '。', '！', '？', '；')):
-                                            display_response += "…"
-                                        ai_response_placeholder.markdown(
-                                            response_html.format(
-                                                display_response.replace('\n', '<br>'),
-                                                datetime.now().strftime('%H:%M:%S')
-                                            ),
-                                            unsafe_allow_html=True
-                                        )
-                            except json.JSONDecodeError:
-                                continue
+                def render_bubble(text, final):
+                    if final:
+                        html = response_html.format(
+                            text.replace('\n', '<br>'),
+                            datetime.now().strftime('%H:%M:%S')
+                        ).replace("thinking", "completed").replace("【深度思考中】", "【已深度思考】")
+                    else:
+                        display_response = text if text.endswith(SENTENCE_BOUNDARIES) else text + "…"
+                        html = response_html.format(
+                            display_response.replace('\n', '<br>'),
+                            datetime.now().strftime('%H:%M:%S')
+                        )
+                    ai_response_placeholder.markdown(html, unsafe_allow_html=True)
+                    return html
 
-                final_html = response_html.format(
-                    full_response.replace('\n', '<br>'),
-                    datetime.now().strftime('%H:%M:%S')
-                ).replace("thinking", "completed").replace("【深度思考中】", "【已深度思考】")
-                ai_response_placeholder.markdown(final_html, unsafe_allow_html=True)
+                # 按到达的字节块增量解析 SSE；token 先攒起来，按帧率或句子结束时才重新渲染气泡
+                scheduler = RenderScheduler(render_bubble)
+                for token in iter_tokens(response_stream.iter_content(chunk_size=None)):
+                    scheduler.push(token)
+                full_response = scheduler.close()
 
                 st.markdown('<div id="endofchat_after_response"></div>', unsafe_allow_html=True)
                 st.markdown("""
@@ -305,6 +282,17 @@ def main():
         except Exception as e:
             error_msg = f"抱歉，发生错误: {str(e)}"
             add_message("ai", error_msg)
+        except BaseException:
+            # Streamlit 中断脚本（点击停止、关闭页面）时保存已生成的部分，重新运行后不再从头生成
+            partial = scheduler.received if scheduler is not None else ""
+            add_message("ai", f"{partial}\n{GENERATION_CANCELLED_NOTE}" if partial else GENERATION_CANCELLED_NOTE)
+            st.session_state.is_responding = False
+            st.session_state.prompt_to_process = None
+            raise
+        finally:
+            if response_stream is not None:
+                # 提前结束时立即关闭上游连接，而不是继续读到 [DONE]
+                response_stream.close()
 
         st.session_state.is_responding = False
         st.session_state.prompt_to_process = None
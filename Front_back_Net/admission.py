@@ -0,0 +1,72 @@
+import asyncio
+import math
+import os
+import time
+from typing import Callable, Generic, Optional, TypeVar
+
+# 每个进程的生成 worker 数量（即并发上游生成数量上限），以及排队等待的生成任务数量上限
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "64"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "128"))
+ADMISSION_RETRY_AFTER = float(os.getenv("ADMISSION_RETRY_AFTER", "2"))
+# 单个会话生成租约的有效期，防止 worker 崩溃后会话被永久锁住
+GENERATION_LEASE_SECONDS = float(os.getenv("GENERATION_LEASE_SECONDS", "300"))
+
+T = TypeVar("T")
+
+
+class Overloaded(Exception):
+    """排队已满，调用方应返回 503 并带上 Retry-After。"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("服务繁忙，请稍后重试")
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class JobQueue(Generic[T]):
+    """有界的任务队列；队列满时立即拒绝，而不是堆积到上游超时。"""
+
+    def __init__(self, max_queue: int = ADMISSION_MAX_QUEUE,
+                 retry_after: float = ADMISSION_RETRY_AFTER,
+                 observe_wait: Optional[Callable[[float], None]] = None):
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.observe_wait = observe_wait
+        self.queue: asyncio.Queue = asyncio.Queue(max_queue)
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    @property
+    def waiting(self) -> int:
+        return self.queue.qsize()
+
+    def put(self, item: T):
+        try:
+            self.queue.put_nowait((time.monotonic(), item))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise Overloaded(self.retry_after)
+
+    async def get(self) -> T:
+        enqueued_at, item = await self.queue.get()
+        waited = time.monotonic() - enqueued_at
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        self.admitted += 1
+        if self.observe_wait is not None:
+            self.observe_wait(waited)
+        return item
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_seconds_avg": self.wait_seconds_total / self.admitted if self.admitted else 0.0,
+            "wait_seconds_max": self.wait_seconds_max,
+        }
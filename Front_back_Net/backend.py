@@ -1,15 +1,153 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import hashlib
+import logging
+import time
+import zlib
+from contextlib import asynccontextmanager, suppress
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-import requests
-from datetime import datetime
 import uvicorn
 import json
-from typing import Dict, List
-
-app = FastAPI()
-
-# 内存存储会话数据（生产环境应使用数据库）
-sessions: Dict[str, dict] = {}
+from typing import AsyncIterator, List, Optional
+
+from admission import GENERATION_LEASE_SECONDS, Overloaded
+from coalescer import SingleFlight
+from context_window import ContextSummarizer, build_windowed_prompt
+from faq_index import (
+    FAQ_ANSWER_THRESHOLD, FAQ_CORPUS_PATH, FAQ_GROUNDING_THRESHOLD, FAQ_REFRESH_INTERVAL,
+    FaqIndex, render_grounding
+)
+from jobs import (
+    GENERATION_POLL_INTERVAL, GENERATION_REMOTE_CANCEL_TIMEOUT, GenerationCancelled, GenerationJob, JobManager
+)
+from metrics import CONTENT_TYPE, REGISTRY, RequestMetricsMiddleware
+from messages import Message, Sender, conversation_dicts, render_conversation, serialize_conversation
+from prompt_context import render_turn
+from resilience import CircuitOpen
+from response_cache import RESPONSE_CACHE_ENABLED, ResponseCache, make_cache_key
+from session_eviction import SESSION_ARCHIVE_DIR, SessionArchive, SessionSweeper
+from session_store import (
+    AsyncSessionStore, ContextWindow, JournaledSessionStore, MemorySessionStore, SessionStore, call_store,
+    create_session_store
+)
+from router import ModelRouter, create_router, is_simple_prompt
+from upstream import create_http_client
+from wire import DEFAULT_RESPONSE_CLASS, CompressionMiddleware, negotiated_response, orjson
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 整个应用共享一个上游连接池，避免每次请求重复建立 TCP/TLS 连接
+    http_client = create_http_client()
+    # 按延迟、失败率和成本在配置的上游（MODEL_PROVIDERS）之间选择
+    app.state.router = create_router(http_client)
+    # 上下文超出 token 预算时，在后台把较早的对话折叠成摘要
+    app.state.summarizer = ContextSummarizer(store, app.state.router.complete)
+    # 本地 FAQ 检索索引（配置了 FAQ_CORPUS_PATH 时启用）
+    app.state.faq_index = None
+    refresh_task = None
+    if FAQ_CORPUS_PATH:
+        app.state.faq_index = FaqIndex()
+        await asyncio.to_thread(app.state.faq_index.refresh)
+        refresh_task = asyncio.create_task(refresh_faq_index(app.state.faq_index))
+    # 配置了 SESSION_JOURNAL_DIR 时从快照和日志恢复会话，之后按组提交间隔持久化修改
+    journal_task = None
+    if isinstance(store, JournaledSessionStore):
+        restored = await asyncio.to_thread(store.recover)
+        logger.info("从会话日志恢复了 %d 个会话", restored)
+        journal_task = asyncio.create_task(store.journal.run(store.capture))
+    # 定期淘汰空闲和超出容量的会话
+    sweep_task = asyncio.create_task(sweeper.run())
+    # 生成任务由后台 worker 执行，与提交和订阅它的请求解耦
+    jobs.start()
+    try:
+        yield
+    finally:
+        await jobs.stop()
+        sweep_task.cancel()
+        if journal_task:
+            # 先等正在进行的组提交结束，再写入剩余记录并关闭日志文件
+            journal_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await journal_task
+            await store.journal.close()
+        if refresh_task:
+            refresh_task.cancel()
+        await app.state.summarizer.close()
+        await http_client.aclose()
+        store.close()
+
+
+async def refresh_faq_index(faq_index: FaqIndex):
+    # 语料文件变化后在线程中增量重建索引
+    while True:
+        await asyncio.sleep(FAQ_REFRESH_INTERVAL)
+        try:
+            await asyncio.to_thread(faq_index.refresh)
+        except Exception as e:
+            logger.warning("FAQ 索引重建失败: %s", e)
+
+
+# 安装了 orjson 时接口返回的字典用 orjson 序列化
+app = FastAPI(lifespan=lifespan, default_response_class=DEFAULT_RESPONSE_CLASS)
+# 较大的一次性响应（长对话历史）按 Accept-Encoding 压缩
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(RequestMetricsMiddleware)
+
+# 会话存储（由 SESSION_STORE 环境变量选择 memory / sqlite / redis）
+store: SessionStore = create_session_store()
+# 请求处理函数通过 sessions 访问存储，SQLite / Redis 的调用在线程中执行，不阻塞事件循环
+sessions = AsyncSessionStore(store)
+
+# SQLite / Redis 存储可以被多个 worker 进程共享，生成租约可能由其他进程持有
+SHARED_STORE = not isinstance(store, MemorySessionStore)
+
+# 会话淘汰（空闲超时 + 数量/内存上限），配置了归档目录时先归档再删除
+sweeper = SessionSweeper(store, archive=SessionArchive() if SESSION_ARCHIVE_DIR else None)
+
+# 常见问题的回答缓存（进程内）
+response_cache = ResponseCache()
+
+# 相同问题的并发请求合并为一次上游生成
+coalescer = SingleFlight()
+
+# 生成任务队列和 worker（worker 数量即并发上游生成数量），排队已满时快速返回 503
+jobs = JobManager(lambda job: run_generation_job(job), discard=lambda job: discard_generation_job(job))
+
+# 状态类指标在抓取时读取（/metrics 在线程中渲染，见 metrics()）
+REGISTRY.gauge("chat_active_sessions", "Sessions in the session store", store.count)
+REGISTRY.gauge("chat_session_memory_bytes", "Approximate memory used by in-process sessions",
+               store.memory_bytes)
+REGISTRY.callback_counter("chat_response_cache_hits_total", "Response cache hits",
+                          lambda: response_cache.hits)
+REGISTRY.callback_counter("chat_response_cache_misses_total", "Response cache misses",
+                          lambda: response_cache.misses)
+REGISTRY.gauge("chat_response_cache_hit_ratio", "Response cache hit ratio",
+               lambda: response_cache.stats()["hit_rate"])
+REGISTRY.gauge("chat_response_cache_bytes", "Memory used by cached responses",
+               lambda: response_cache.bytes)
+REGISTRY.callback_counter("chat_coalesced_requests_total",
+                          "Requests that joined an in-flight upstream generation",
+                          lambda: coalescer.joined)
+REGISTRY.gauge("chat_admission_queue_depth", "Generation jobs waiting for a worker",
+               lambda: jobs.queue.waiting)
+REGISTRY.gauge("chat_admission_active", "Generation jobs being run by a worker", lambda: jobs.running)
+REGISTRY.callback_counter("chat_admission_rejected_total", "Requests rejected with 503",
+                          lambda: jobs.queue.rejected)
+
+
+def provider_breaker_states() -> Optional[dict]:
+    router: Optional[ModelRouter] = getattr(app.state, "router", None)
+    if router is None:
+        return None
+    return {(p.name,): p.breaker.state for p in router.providers}
+
+
+REGISTRY.gauge("chat_upstream_breaker_state", "Upstream circuit breaker state (0 closed, 1 half-open, 2 open)",
+               provider_breaker_states, labelnames=("upstream",))
 
 
 class SessionData(BaseModel):
@@ -27,150 +165,566 @@ class InitSessionRequest(BaseModel):
     session_id: str
 
 
-class WenHuaAPI:
-    def __init__(self):
-        self.base_url = "Wenhua API"
-        self.headers = {"Content-Type": "application/json"}
-
-    def generate_response(self, content_text: str) -> requests.Response:
-        payload = {"content": content_text}
-        response = requests.post(
-            self.base_url,
-            headers=self.headers,
-            json=payload,
-            stream=True,
-            timeout=30
-        )
-        if response.status_code != 200:
-            error_msg = f"API错误: {response.status_code}"
-            if response.text:
-                error_msg += f" - {response.text[:200]}"
-            raise Exception(error_msg)
-        return response
-
-
 @app.post("/init_session")
-def init_session(req: InitSessionRequest):
+async def init_session(req: InitSessionRequest):
     session_id = req.session_id
-    if session_id not in sessions:
-        sessions[session_id] = {
-            "conversation": [],
-            "is_responding": False,
-            "prompt_to_process": None
-        }
+    if await sessions.create(session_id):
+        # 新会话可能使数量超出上限，立即按 LRU 淘汰而不是等到下一轮清理
+        await call_store(store, sweeper.enforce_capacity)
     return {"status": "success", "session_id": session_id}
 
 
+def not_modified(request: Request, etag: str) -> bool:
+    tags = request.headers.get("if-none-match", "")
+    return etag in (tag.strip() for tag in tags.split(","))
+
+
+def sync_payload(state: dict, length: int, messages: List[Message], since: int) -> dict:
+    # 会话状态、消息总数和 since 之后的新消息，HTTP 同步接口和 WebSocket 共用
+    return {"state": state, "length": length, "messages": conversation_dicts(messages, since + 1)}
+
+
+def render_sync(state: dict, length: int, messages: List[Message], since: int) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(sync_payload(state, length, messages, since))
+    return (
+        '{"state":' + json.dumps(state, ensure_ascii=False)
+        + ',"length":' + str(length)
+        + ',"messages":' + render_conversation(messages, since + 1)
+        + "}"
+    ).encode("utf-8")
+
+
+def state_etag(length: int, state: dict) -> str:
+    # 消息只追加不修改，消息条数加上会话状态即可标识一个版本
+    prompt = state["prompt_to_process"] or ""
+    return f'W/"{length}-{int(state["is_responding"])}-{zlib.crc32(prompt.encode("utf-8")):x}"'
+
+
 @app.get("/get_conversation/{session_id}")
-def get_conversation(session_id: str):
-    if session_id not in sessions:
+async def get_conversation(request: Request, session_id: str,
+                           since: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1)):
+    """返回序号大于 since 的消息（最多 limit 条），每条消息带有序号 seq。"""
+    length = await sessions.message_count(session_id)
+    if length is None:
         raise HTTPException(status_code=404, detail="Session not found")
-    return sessions[session_id]["conversation"]
+
+    end = length if limit is None else min(length, since + limit)
+    etag = f'W/"{since}-{end}"'
+    if not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    messages = await sessions.get_messages(session_id, since, limit) or []
+    return negotiated_response(request, lambda: serialize_conversation(messages, since + 1),
+                               lambda: conversation_dicts(messages, since + 1), {"ETag": etag})
 
 
 @app.get("/get_session_state/{session_id}")
-def get_session_state(session_id: str):
-    if session_id not in sessions:
+async def get_session_state(session_id: str):
+    state = await sessions.get_state(session_id)
+    if state is None:
         raise HTTPException(status_code=404, detail="Session not found")
-    return {
-        "is_responding": sessions[session_id]["is_responding"],
-        "prompt_to_process": sessions[session_id]["prompt_to_process"]
-    }
+    return state
+
+
+@app.get("/sync_session/{session_id}")
+async def sync_session(request: Request, session_id: str,
+                       since: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1)):
+    """一次请求返回会话状态和序号大于 since 的新消息。
+
+    客户端已拿到全部消息（since 等于消息条数）且状态未变时返回 304。
+    """
+    state = await sessions.get_state(session_id)
+    length = await sessions.message_count(session_id)
+    if state is None or length is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    etag = state_etag(length, state)
+    if since >= length and not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    messages = (await sessions.get_messages(session_id, since, limit) if since < length else None) or []
+    return negotiated_response(request, lambda: render_sync(state, length, messages, since),
+                               lambda: sync_payload(state, length, messages, since), {"ETag": etag})
+
+
+@app.get("/bootstrap/{session_id}")
+async def bootstrap(request: Request, session_id: str,
+                    since: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1)):
+    """前端每次运行页面时调用，与 sync_session 相同，但会话不存在（新页面或已被淘汰）时先创建。
+
+    页面加载只需这一个请求，不再单独调用 init_session。
+    """
+    try:
+        return await sync_session(request, session_id, since, limit)
+    except HTTPException as e:
+        if e.status_code != 404:
+            raise
+    if await sessions.create(session_id):
+        await call_store(store, sweeper.enforce_capacity)
+    return await sync_session(request, session_id, since, limit)
 
 
 @app.post("/add_user_message")
-def add_user_message(req: MessageRequest):
+async def add_user_message(req: MessageRequest):
     session_id = req.session_id
-    if session_id not in sessions:
+    if not await sessions.exists(session_id):
         raise HTTPException(status_code=404, detail="Session not found")
 
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    sessions[session_id]["conversation"].append({
-        "sender": "user",
-        "message": req.content_text,
-        "timestamp": timestamp
-    })
-
-    sessions[session_id]["is_responding"] = True
-    sessions[session_id]["prompt_to_process"] = req.content_text
+    # 新问题取代仍在生成的回答：取消它（包括其他 worker 进程中的生成）并等待部分回答写入会话
+    await stop_generation(session_id, "superseded", req.content_text)
+    # 先提交生成任务，排队已满时不修改会话；问题写入会话后 worker 才会开始执行
+    job = submit_job(session_id, req.content_text, ready=False)
+    try:
+        await add_message(session_id, "user", req.content_text)
+        await sessions.update_state(session_id, is_responding=True, prompt_to_process=req.content_text)
+    finally:
+        job.ready.set()
 
     return {"status": "success"}
 
 
-@app.post("/process_ai_response")
-def process_ai_response(req: InitSessionRequest):
-    session_id = req.session_id
-    if session_id not in sessions:
+class GenerationError(Exception):
+    """上游生成失败，错误提示已写入对话历史。"""
+
+
+# 上游不可用且没有缓存或 FAQ 可用时的兜底回答，以及生成失败时展示给用户的提示
+FALLBACK_ANSWER = "抱歉，小文暂时无法连接到智能问答服务，请稍后再试，或拨打文华财经客服热线咨询。"
+GENERATION_ERROR_MESSAGE = "抱歉，小文这次没能完成回答，请稍后重试。"
+# 生成被取消时追加在部分回答之后
+GENERATION_CANCELLED_NOTE = "（已停止生成）"
+
+
+async def add_message(session_id: str, sender: str, message: str):
+    # 保存消息，并把渲染后的文本追加到会话的提示词缓冲区
+    await sessions.append_message(session_id, Message(sender, message))
+    await sessions.append_context(session_id, render_turn(sender, message))
+
+
+def build_context(session_id: str, window: ContextWindow, grounding: str = "") -> str:
+    # 系统提示前缀固定不变，历史部分只在新消息到达时追加，并限制在 token 预算之内
+    app.state.summarizer.maybe_schedule(session_id, window)
+    return build_windowed_prompt(window, grounding=grounding)
+
+
+def is_context_free(window: ContextWindow) -> bool:
+    # 会话中只有当前这一条用户问题时，回答与上下文无关，可以走缓存
+    return not window.summary and window.folded == 0 and len(window.turns) == 1
+
+
+async def finish_ai_response(session_id: str, message: str):
+    # 添加AI回复并结束本轮响应
+    await add_message(session_id, "ai", message)
+    await sessions.update_state(session_id, is_responding=False, prompt_to_process=None)
+
+
+def cancelled_response(partial: str) -> str:
+    return f"{partial}\n{GENERATION_CANCELLED_NOTE}" if partial else GENERATION_CANCELLED_NOTE
+
+
+async def generate_tokens(session_id: str, prompt: str) -> AsyncIterator[str]:
+    """逐个产出上游返回的 token，生成结束后把完整回复写入会话。"""
+    window = await sessions.get_context_window(session_id)
+
+    cache_key = None
+    if RESPONSE_CACHE_ENABLED and is_context_free(window):
+        cache_key = make_cache_key(prompt)
+    if cache_key is not None:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            # 命中缓存时直接整段返回，走与上游生成相同的输出路径
+            yield cached
+            await finish_ai_response(session_id, cached)
+            return
+
+    # 高置信度的 FAQ 直接回答，中等置信度的作为参考资料注入提示词
+    grounding = ""
+    matches = []
+    faq_index = app.state.faq_index
+    if faq_index is not None:
+        # 检索是 numpy 矩阵运算，放到线程中执行，不阻塞事件循环
+        matches = await asyncio.to_thread(faq_index.search, prompt)
+        if matches and matches[0][0] >= FAQ_ANSWER_THRESHOLD and is_context_free(window):
+            answer = matches[0][1]["answer"]
+            yield answer
+            await finish_ai_response(session_id, answer)
+            return
+        matches = [match for match in matches if match[0] >= FAQ_GROUNDING_THRESHOLD]
+        if matches:
+            grounding = render_grounding(matches)
+
+    context_content = build_context(session_id, window, grounding)
+
+    # 调用API：与上下文无关的问题按缓存 key 合并，其余按完整提示词合并
+    router: ModelRouter = app.state.router
+    simple = is_simple_prompt(prompt, is_context_free(window), bool(grounding))
+    flight_key = cache_key or hashlib.sha1(context_content.encode("utf-8")).hexdigest()
+    tokens: List[str] = []
+    try:
+        async for token in coalescer.stream(flight_key, lambda: router.stream_tokens(context_content, simple)):
+            tokens.append(token)
+            yield token
+    except asyncio.CancelledError:
+        # 生成被取消（主动取消、客户端断开或发送了新问题）：保存已生成的部分，上游连接随订阅结束而关闭
+        await finish_ai_response(session_id, cancelled_response("".join(tokens)))
+        raise
+    except CircuitOpen:
+        # 所有上游都在熔断时不请求上游：优先用过期的缓存回答，其次用最相近的 FAQ，最后用固定话术
+        fallback = (cache_key and response_cache.get_stale(cache_key)) \
+            or (matches and matches[0][1]["answer"]) or FALLBACK_ANSWER
+        yield fallback
+        await finish_ai_response(session_id, fallback)
+        return
+    except Exception as e:
+        # 具体错误只记录在日志中，不直接展示给用户
+        logger.warning("会话 %s 生成失败: %r", session_id, e)
+        await finish_ai_response(session_id, GENERATION_ERROR_MESSAGE)
+        raise GenerationError(GENERATION_ERROR_MESSAGE) from e
+
+    full_response = "".join(tokens)
+    await finish_ai_response(session_id, full_response)
+    if cache_key and full_response:
+        response_cache.put(cache_key, full_response)
+
+
+def sse_event(data: dict, event: str = None) -> str:
+    payload = json.dumps(data, ensure_ascii=False)
+    if event:
+        return f"event: {event}\ndata: {payload}\n\n"
+    return f"data: {payload}\n\n"
+
+
+async def run_generation_job(job: GenerationJob):
+    """在 worker 中执行生成任务：取得会话租约，把 token 发布给订阅者，完整回复由 generate_tokens 写回会话。
+
+    租约由其他 worker 进程持有时跟随它：等它写回回答后把回答发布给本进程的订阅者；
+    租约过期（那个进程已退出）后由本进程接手生成。
+    """
+    session_id = job.session_id
+    followed = False
+    while True:
+        lease = await sessions.begin_generation(session_id, GENERATION_LEASE_SECONDS)
+        if lease is not None:
+            break
+        if await sessions.get_state(session_id) is None:
+            job.finish(GenerationError("Session not found"))
+            return
+        followed = True
+        await asyncio.sleep(GENERATION_POLL_INTERVAL)
+    watcher = asyncio.create_task(watch_remote_cancel(job)) if SHARED_STORE else None
+    try:
+        # 排队期间会话可能已被淘汰，或问题已经回答过
+        state = await sessions.get_state(session_id)
+        if state is None:
+            job.finish(GenerationError("Session not found"))
+            return
+        if state["prompt_to_process"] != job.prompt:
+            answer = await last_answer(session_id) if followed else None
+            if answer:
+                job.publish(answer)
+            job.finish()
+            return
+        async for token in generate_tokens(session_id, job.prompt):
+            job.publish(token)
+        job.finish()
+    except GenerationError as e:
+        job.finish(e)
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        await sessions.end_generation(session_id, lease)
+
+
+async def last_answer(session_id: str) -> Optional[str]:
+    # 会话最后一条消息是 AI 回复时返回它
+    length = await sessions.message_count(session_id)
+    messages = await sessions.get_messages(session_id, length - 1) if length else None
+    if messages and messages[0].sender == Sender.AI:
+        return messages[0].message
+    return None
+
+
+async def watch_remote_cancel(job: GenerationJob):
+    """生成期间轮询共享存储中的会话状态。
+
+    其他 worker 进程收到取消请求时把 prompt_to_process 改为 None，收到新问题时改为新问题（见 stop_generation），
+    据此取消本进程的生成，部分回答照常写回会话。
+    """
+    while True:
+        await asyncio.sleep(GENERATION_POLL_INTERVAL)
+        state = await sessions.get_state(job.session_id)
+        if state is None or state["prompt_to_process"] != job.prompt:
+            break
+    reason = "client" if state is None or state["prompt_to_process"] is None else "superseded"
+    await jobs.cancel(job.session_id, reason)
+
+
+async def generation_leased(session_id: str) -> bool:
+    # 探测会话的生成租约是否被持有：能取得说明没有进程在生成，立即释放
+    lease = await sessions.begin_generation(session_id, GENERATION_LEASE_SECONDS)
+    if lease is not None:
+        await sessions.end_generation(session_id, lease)
+        return False
+    return await sessions.exists(session_id)
+
+
+async def stop_generation(session_id: str, reason: str, prompt: Optional[str] = None) -> bool:
+    """取消会话正在进行的生成并等待部分回答写入会话，返回是否取消了生成。
+
+    先取消本进程的任务；共享存储下生成可能在其他 worker 进程中，通过 prompt_to_process 通知持有租约的进程
+    （主动取消时改为 None，被新问题取代时改为 prompt），等待它释放租约。
+    超过 GENERATION_REMOTE_CANCEL_TIMEOUT 仍未停止时返回 409。
+    """
+    cancelled = await jobs.cancel(session_id, reason) is not None
+    if not SHARED_STORE or not await generation_leased(session_id):
+        return cancelled
+    await sessions.update_state(session_id, prompt_to_process=prompt)
+    deadline = time.monotonic() + GENERATION_REMOTE_CANCEL_TIMEOUT
+    while await generation_leased(session_id):
+        if time.monotonic() >= deadline:
+            raise HTTPException(status_code=409, detail="Generation already in progress")
+        await asyncio.sleep(GENERATION_POLL_INTERVAL)
+    return True
+
+
+async def discard_generation_job(job: GenerationJob):
+    # 排队期间被取消的任务没有开始生成，直接结束本轮对话
+    state = await sessions.get_state(job.session_id)
+    if state is not None and state["prompt_to_process"] == job.prompt:
+        await finish_ai_response(job.session_id, GENERATION_CANCELLED_NOTE)
+
+
+def submit_job(session_id: str, prompt: str, ready: bool = True) -> GenerationJob:
+    """提交生成任务。会话已有任务在生成时返回 409，排队已满时返回 503。"""
+    try:
+        job = jobs.submit(session_id, prompt, ready)
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": e.retry_after_header}
+        )
+    if job is None:
+        raise HTTPException(status_code=409, detail="Generation already in progress")
+    return job
+
+
+async def current_job(session_id: str) -> Optional[GenerationJob]:
+    """会话正在进行或刚完成的生成任务，没有待回答的问题时返回 None。
+
+    有待回答的问题却没有任务时（例如服务重启后，或由旧版客户端发起）重新提交一个任务。
+    """
+    state = await sessions.get_state(session_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    prompt = state["prompt_to_process"]
+    job = jobs.get(session_id)
+    if job is not None and (not job.done or not prompt):
+        return job
+    if not prompt:
+        return None
+    return submit_job(session_id, prompt)
+
+
+@app.post("/cancel/{session_id}")
+async def cancel_generation(session_id: str):
+    """停止会话正在进行的生成，已生成的部分作为本轮回答保存。"""
+    if not await sessions.exists(session_id):
         raise HTTPException(status_code=404, detail="Session not found")
+    if not await stop_generation(session_id, "client"):
+        return {"status": "success", "cancelled": False}
+    return {"status": "success", "cancelled": True, "response": await last_answer(session_id)}
 
-    if not sessions[session_id]["prompt_to_process"]:
+
+async def wait_for_disconnect(request: Request):
+    # 请求体已读完，之后 receive 只会在客户端断开时返回 http.disconnect
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+@app.post("/process_ai_response")
+async def process_ai_response(request: Request, req: InitSessionRequest):
+    """等待会话当前的生成任务完成并返回完整回复；客户端断开时退订，由任务按断开处理。"""
+    job = await current_job(req.session_id)
+    if job is None:
         return {"status": "error", "message": "No prompt to process"}
 
-    # 构建上下文
-    context_content = ""
-    for msg in sessions[session_id]["conversation"]:
-        if msg["sender"] == "user":
-            context_content += f"用户: {msg['message']}\n"
-        elif msg["sender"] == "ai":
-            context_content += f"AI: {msg['message']}\n"
-
-    # 添加系统提示
-    system_prompt = (
-        "你是文华财经公司的客服助手小文，请以专业、友好的态度回答用户问题。"
-        "回答要简洁明了，专注于提供市场信息、数据分析和操作指导。"
-        "如果用户咨询购买问题，请明确提供400客服电话方便用户转人工服务。"
-        "保持上下文逻辑关联，确保回答准确、专业。"
-    )
-    context_content = f"系统设定: {system_prompt}\n{context_content}"
+    async def collect() -> str:
+        return "".join([token async for token in job.subscribe()])
 
-    # 调用API
-    api = WenHuaAPI()
+    collector = asyncio.create_task(collect())
+    disconnect = asyncio.create_task(wait_for_disconnect(request))
     try:
-        response_stream = api.generate_response(context_content)
-        full_response = ""
-
-        for line in response_stream.iter_lines():
-            if line:
-                decoded_line = line.decode("utf-8")
-                if decoded_line.startswith("data: "):
-                    data = decoded_line[6:]
-                    if data == "[DONE]":
-                        break
-                    try:
-                        chunk = json.loads(data)
-                        if "choices" in chunk and chunk["choices"]:
-                            delta = chunk["choices"][0].get("delta", {})
-                            token = delta.get("content", "")
-                            if token is not None:
-                                full_response += token
-                    except json.JSONDecodeError:
-                        continue
-
-        # 添加AI回复
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        sessions[session_id]["conversation"].append({
-            "sender": "ai",
-            "message": full_response,
-            "timestamp": timestamp
-        })
-
-        sessions[session_id]["is_responding"] = False
-        sessions[session_id]["prompt_to_process"] = None
-
-        return {"status": "success", "response": full_response}
+        await asyncio.wait({collector, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnect.cancel()
+        collector.cancel()
+    if not collector.done() or collector.cancelled():
+        return Response(status_code=499)
 
-    except Exception as e:
-        error_msg = f"抱歉，发生错误: {str(e)}"
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        sessions[session_id]["conversation"].append({
-            "sender": "ai",
-            "message": error_msg,
-            "timestamp": timestamp
-        })
-        sessions[session_id]["is_responding"] = False
-        sessions[session_id]["prompt_to_process"] = None
-
-        return {"status": "error", "message": error_msg}
+    try:
+        return {"status": "success", "response": collector.result()}
+    except GenerationCancelled:
+        return {"status": "cancelled", "response": job.result}
+    except GenerationError as e:
+        return {"status": "error", "message": str(e)}
+
+
+@app.get("/stream_ai_response/{session_id}")
+async def stream_ai_response(session_id: str):
+    """以 Server-Sent Events 形式订阅生成任务：先回放已生成的 token，再实时转发。"""
+    job = await current_job(session_id)
+    if job is None:
+        raise HTTPException(status_code=409, detail="No prompt to process")
+
+    async def event_stream():
+        try:
+            async for token in job.subscribe():
+                yield sse_event({"token": token})
+        except GenerationCancelled:
+            yield sse_event({"status": "cancelled"}, event="done")
+            return
+        except GenerationError as e:
+            yield sse_event({"status": "error", "message": str(e)}, event="error")
+            return
+        yield sse_event({"status": "success"}, event="done")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+class ChatChannel:
+    """一个 WebSocket 连接上的会话，记录已推送给客户端的消息序号。"""
+
+    def __init__(self, websocket: WebSocket, session_id: str, since: int = 0):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.sent = since
+
+    async def send_frame(self, frame_type: str, **data):
+        await self.websocket.send_text(json.dumps({"type": frame_type, **data}, ensure_ascii=False))
+
+    async def push_sync(self):
+        # 推送当前状态和客户端尚未收到的消息
+        state = await sessions.get_state(self.session_id)
+        length = await sessions.message_count(self.session_id)
+        if state is None or length is None:
+            await self.send_frame("error", message="Session not found", retry_after=0)
+            return
+        if length < self.sent:
+            # 会话被淘汰后重新创建，从头同步
+            self.sent = 0
+        messages = await sessions.get_messages(self.session_id, self.sent) if self.sent < length else []
+        await self.websocket.send_text('{"type":"sync",' + render_sync(state, length, messages, self.sent)[1:].decode("utf-8"))
+        self.sent = length
+
+    async def send_error(self, e: HTTPException, sync: bool = True):
+        # 生成出错时也先推送最新状态，客户端据此决定是否重试
+        if sync:
+            await self.push_sync()
+        retry_after = float((e.headers or {}).get("Retry-After", 1))
+        await self.send_frame("error", message=e.detail, retry_after=retry_after)
+
+    async def add_user_message(self, content_text: str):
+        if not await sessions.exists(self.session_id):
+            await self.send_frame("error", message="Session not found", retry_after=0)
+            return
+        # 新问题取代仍在生成的回答（例如在另一个标签页中）
+        try:
+            await stop_generation(self.session_id, "superseded", content_text)
+            job = submit_job(self.session_id, content_text, ready=False)
+        except HTTPException as e:
+            # 消息未被接收，客户端收到的第一帧即为错误
+            await self.send_error(e, sync=False)
+            return
+        try:
+            await add_message(self.session_id, "user", content_text)
+            await sessions.update_state(self.session_id, is_responding=True, prompt_to_process=content_text)
+        finally:
+            job.ready.set()
+        await self.push_sync()
+        await self.generate()
+
+    async def generate(self):
+        """订阅会话当前的生成任务，逐个推送 token，结束后推送新消息和 done。"""
+        try:
+            job = await current_job(self.session_id)
+        except HTTPException as e:
+            await self.send_error(e)
+            return
+
+        error = None
+        status = "success"
+        if job is None:
+            error = "No prompt to process"
+        else:
+            try:
+                async for token in job.subscribe():
+                    await self.send_frame("token", token=token)
+            except GenerationCancelled:
+                status = "cancelled"
+            except GenerationError as e:
+                error = str(e)
+
+        await self.push_sync()
+        if error is None:
+            await self.send_frame("done", status=status)
+        else:
+            await self.send_frame("error", message=error, retry_after=0)
+
+
+@app.websocket("/ws/{session_id}")
+async def chat_socket(websocket: WebSocket, session_id: str, since: int = 0):
+    """在一个长连接上发送消息、同步状态并流式接收回复。
+
+    客户端发送 {"type": "message", "content_text": ...}、{"type": "generate"} 或
+    {"type": "sync", "since": ...}；服务端推送 sync（状态和新消息）、token、done 和 error 帧。
+    连接建立时会话不存在则自动创建，并立即推送一次 sync。
+    """
+    await websocket.accept()
+    if await sessions.create(session_id):
+        await call_store(store, sweeper.enforce_capacity)
+    channel = ChatChannel(websocket, session_id, since)
+    try:
+        await channel.push_sync()
+        while True:
+            request = await websocket.receive_json()
+            request_type = request.get("type")
+            if request_type == "message":
+                await channel.add_user_message(request["content_text"])
+            elif request_type == "generate":
+                await channel.generate()
+            elif request_type == "sync":
+                channel.sent = request.get("since", channel.sent)
+                await channel.push_sync()
+            else:
+                await channel.send_frame("error", message=f"Unknown request type: {request_type}",
+                                         retry_after=0)
+    except WebSocketDisconnect:
+        pass
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 文本格式指标。"""
+    # 会话数和内存占用指标会查询会话存储
+    return Response(await call_store(store, REGISTRY.render), media_type=CONTENT_TYPE)
+
+
+@app.get("/stats")
+async def stats():
+    """运行状态统计：会话数与淘汰情况、缓存命中、请求合并、生成任务队列、上游状态和会话日志。"""
+    return {
+        "sessions": await call_store(store, sweeper.stats),
+        "response_cache": response_cache.stats(),
+        "coalescer": coalescer.stats(),
+        "jobs": jobs.stats(),
+        "upstream": app.state.router.stats(),
+        "journal": store.journal.stats() if isinstance(store, JournaledSessionStore) else None,
+    }
 
 
 if __name__ == "__main__":
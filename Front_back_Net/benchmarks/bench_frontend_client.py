@@ -0,0 +1,119 @@
+"""比较前端每次调用都新建连接（requests.get/post）与进程内共享连接池 + bootstrap 接口的页面运行开销。
+
+启动一个后端（不需要上游），用 THREADS 个线程模拟同时打开的 Streamlit 页面（Streamlit 在线程中运行脚本），
+每个页面先加载一次，再重新运行 RERUNS 次，只执行 frontend.py 每次运行都会发出的同步请求：
+- legacy: 首次加载 POST /init_session + GET /sync_session，之后每次 GET /sync_session（If-None-Match），
+  每个请求都用 requests.get/post 新建 TCP 连接
+- pooled: 首次加载和之后每次都只发 GET /bootstrap（If-None-Match），共享一个 requests.Session 连接池
+输出每次运行的同步耗时 p50/p95、每个页面的后端请求数、新建 TCP 连接数和总吞吐。
+
+用法: python benchmarks/bench_frontend_client.py [threads] [reruns]
+"""
+import os
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from loadtest import percentile  # noqa: E402
+
+THREADS = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+RERUNS = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+PORT = 8810
+BACKEND_URL = f"http://127.0.0.1:{PORT}"
+
+
+def legacy_page(latencies: list) -> int:
+    session_id = str(uuid.uuid4())
+    start = time.perf_counter()
+    requests.post(f"{BACKEND_URL}/init_session", json={"session_id": session_id})
+    response = requests.get(f"{BACKEND_URL}/sync_session/{session_id}", params={"since": 0})
+    latencies.append(time.perf_counter() - start)
+    etag = response.headers.get("ETag")
+    for _ in range(RERUNS):
+        start = time.perf_counter()
+        requests.get(f"{BACKEND_URL}/sync_session/{session_id}", params={"since": 0},
+                     headers={"If-None-Match": etag})
+        latencies.append(time.perf_counter() - start)
+    return 2 + RERUNS
+
+
+def pooled_page(client: requests.Session, latencies: list) -> int:
+    session_id = str(uuid.uuid4())
+    etag = None
+    for _ in range(RERUNS + 1):
+        start = time.perf_counter()
+        response = client.get(f"{BACKEND_URL}/bootstrap/{session_id}", params={"since": 0},
+                              headers={"If-None-Match": etag} if etag else {})
+        latencies.append(time.perf_counter() - start)
+        etag = response.headers.get("ETag", etag)
+    return RERUNS + 1
+
+
+def run(label: str, page) -> dict:
+    latencies = [[] for _ in range(THREADS)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(THREADS) as executor:
+        total_requests = sum(executor.map(lambda i: page(latencies[i]), range(THREADS)))
+    elapsed = time.perf_counter() - start
+    samples = [value for values in latencies for value in values]
+    return {
+        "label": label,
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "requests_per_page": total_requests / THREADS,
+        "runs_per_s": THREADS * (RERUNS + 1) / elapsed,
+    }
+
+
+def report(result: dict, connections: int, baseline: dict = None):
+    line = (f"{result['label']:7s} sync p50 {result['p50'] * 1e3:6.2f} ms  p95 {result['p95'] * 1e3:6.2f} ms  "
+            f"{result['requests_per_page']:6.0f} requests/page  {connections:6d} connections  "
+            f"{result['runs_per_s']:7.0f} runs/s")
+    if baseline:
+        line += f"  (p50 {1 - result['p50'] / baseline['p50']:.0%} lower)"
+    print(line)
+
+
+def main():
+    backend = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend:app", "--port", str(PORT), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+    )
+    try:
+        deadline = time.monotonic() + 15
+        while True:
+            try:
+                requests.get(f"{BACKEND_URL}/stats")
+                break
+            except requests.ConnectionError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+        print(f"{THREADS} pages, {RERUNS} reruns each")
+        legacy = run("legacy", legacy_page)
+        # requests.get/post 每次调用都建立新的连接
+        report(legacy, int(legacy["requests_per_page"] * THREADS))
+
+        client = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=THREADS)
+        client.mount("http://", adapter)
+        pooled = run("pooled", lambda latencies: pooled_page(client, latencies))
+        connections = sum(pool.num_connections for pool in adapter.poolmanager.pools._container.values())
+        report(pooled, connections, legacy)
+    finally:
+        backend.terminate()
+        backend.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""比较逐条 st.markdown 历史消息与 ChatHistoryView（缓存 HTML 块 + 只显示最近的消息）的页面重新运行耗时。
+
+用 streamlit.testing 的 AppTest 在不启动浏览器的情况下执行页面脚本：先用给定轮数的历史运行一次，
+再重新运行 RERUNS 次，输出每次重新运行的平均耗时、输出的 markdown 元素数和内容字节数。
+wire 一列估算发送给浏览器的数据量：与上次运行完全相同且不小于 global.minCachedMessageSize（10 KB）的元素
+由 Streamlit 的消息缓存处理，只发送引用。
+
+用法: python benchmarks/bench_history_render.py [reruns]
+"""
+import os
+import sys
+import time
+
+from streamlit.testing.v1 import AppTest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RERUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+TURNS = (5, 50, 500)
+MIN_CACHED_MESSAGE_SIZE = 10_000
+
+
+def legacy_page(backend_dir: str, turns: int):
+    import streamlit as st
+
+    if "conversation" not in st.session_state:
+        answer = "您好，期货交易时间分为日盘和夜盘，日盘上午九点开盘，夜盘时间因品种而异，具体以交易所公告为准。" * 3
+        st.session_state.conversation = [
+            {"sender": sender, "message": f"请问期货交易时间是什么时候？#{n}" if sender == "user" else answer,
+             "timestamp": "10:00:00"}
+            for n in range(turns) for sender in ("user", "ai")
+        ]
+    for msg in st.session_state.conversation:
+        if msg["sender"] == "ai":
+            st.markdown(f"""
+                <div class="ai-message-container">
+                    <div class="avatar ai-avatar">🤖</div>
+                    <div class="ai-message">
+                        <div class="status-title completed">【已深度思考】</div>
+                        {msg["message"]}
+                        <div class="message-timestamp">{msg['timestamp']} | AI助手</div>
+                    </div>
+                </div>
+            """, unsafe_allow_html=True)
+        elif msg["sender"] == "user":
+            st.markdown(f"""
+                <div class="user-message-container">
+                    <div class="user-message">
+                        {msg["message"]}
+                        <div class="message-timestamp">{msg['timestamp']} | 您</div>
+                    </div>
+                    <div class="avatar user-avatar">👤</div>
+                </div>
+            """, unsafe_allow_html=True)
+
+
+def cached_page(backend_dir: str, turns: int):
+    import sys
+
+    import streamlit as st
+
+    sys.path.insert(0, backend_dir)
+    from chat_render import ChatHistoryView
+
+    if "conversation" not in st.session_state:
+        answer = "您好，期货交易时间分为日盘和夜盘，日盘上午九点开盘，夜盘时间因品种而异，具体以交易所公告为准。" * 3
+        st.session_state.conversation = [
+            {"sender": sender, "message": f"请问期货交易时间是什么时候？#{n}" if sender == "user" else answer,
+             "timestamp": "10:00:00"}
+            for n in range(turns) for sender in ("user", "ai")
+        ]
+        st.session_state.history_view = ChatHistoryView()
+    history_view = st.session_state.history_view
+    hidden, blocks = history_view.blocks(st.session_state.conversation)
+    if hidden:
+        st.button(f"显示更早的消息（还有 {hidden} 条）", key="show_earlier", on_click=history_view.show_earlier)
+    for block in blocks:
+        st.markdown(block, unsafe_allow_html=True)
+
+
+def measure(page, turns: int) -> dict:
+    app = AppTest.from_function(page, args=(BACKEND_DIR, turns), default_timeout=60)
+    app.run()
+    previous = {element.value for element in app.markdown}
+    seconds = 0.0
+    wire = 0
+    for _ in range(RERUNS):
+        start = time.perf_counter()
+        app.run()
+        seconds += time.perf_counter() - start
+        values = [element.value for element in app.markdown]
+        wire += sum(len(value.encode("utf-8")) for value in values
+                    if len(value) < MIN_CACHED_MESSAGE_SIZE or value not in previous)
+        previous = set(values)
+    return {
+        "ms": seconds / RERUNS * 1e3,
+        "elements": len(values),
+        "bytes": sum(len(value.encode("utf-8")) for value in values),
+        "wire": wire / RERUNS,
+    }
+
+
+def main():
+    print(f"{RERUNS} reruns per case (AppTest, no browser)")
+    for turns in TURNS:
+        for label, page in (("per message", legacy_page), ("cached view", cached_page)):
+            result = measure(page, turns)
+            print(f"{turns:4d} turns  {label:12s} rerun {result['ms']:8.1f} ms  "
+                  f"{result['elements']:5d} elements  {result['bytes'] / 1024:8.1f} KB  "
+                  f"wire ~{result['wire'] / 1024:8.1f} KB")
+
+
+if __name__ == "__main__":
+    main()
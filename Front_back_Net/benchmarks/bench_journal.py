@@ -0,0 +1,82 @@
+"""比较不持久化的内存存储与写后日志（不同 fsync 策略）下的会话写入吞吐量。
+
+在一个事件循环中模拟 CONCURRENCY 个会话并发对话，每轮对话与后端相同：
+add_user_message（追加消息和上下文、更新状态）和 finish_ai_response（追加回复、更新状态），
+每轮之间让出事件循环，日志的组提交任务与请求处理并发运行。输出每秒完成的对话轮数、
+组提交次数和平均每次提交合并的记录数，以及结束时把全部会话写成快照再恢复的耗时。
+
+用法: python benchmarks/bench_journal.py [turns] [concurrency]
+"""
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from messages import Message  # noqa: E402
+from session_journal import SessionJournal  # noqa: E402
+from session_store import JournaledSessionStore, MemorySessionStore  # noqa: E402
+
+TURNS = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+CONCURRENCY = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+QUESTION = "请问期货交易时间是什么时候？"
+ANSWER = "您好，期货交易时间分为日盘和夜盘，日盘上午九点开盘，夜盘时间因品种而异，具体以交易所公告为准。"
+
+
+async def user(store, session_id: str, turns: int):
+    store.create(session_id)
+    for _ in range(turns):
+        store.append_message(session_id, Message("user", QUESTION))
+        store.append_context(session_id, f"用户: {QUESTION}")
+        store.update_state(session_id, is_responding=True, prompt_to_process=QUESTION)
+        await asyncio.sleep(0)
+        store.append_message(session_id, Message("ai", ANSWER))
+        store.append_context(session_id, f"小文: {ANSWER}")
+        store.update_state(session_id, is_responding=False, prompt_to_process=None)
+        await asyncio.sleep(0)
+
+
+async def run(store, journal=None) -> float:
+    task = asyncio.create_task(journal.run(store.capture)) if journal else None
+    start = time.perf_counter()
+    await asyncio.gather(*(user(store, f"s{i}", TURNS // CONCURRENCY) for i in range(CONCURRENCY)))
+    if journal:
+        task.cancel()
+        await journal.close()
+    return time.perf_counter() - start
+
+
+def main():
+    turns = TURNS // CONCURRENCY * CONCURRENCY
+    print(f"{turns} turns over {CONCURRENCY} concurrent sessions")
+    baseline = asyncio.run(run(MemorySessionStore()))
+    print(f"memory (no journal)   {turns / baseline:9.0f} turns/s")
+    for policy in ("off", "interval", "commit"):
+        directory = tempfile.mkdtemp(prefix="journal-bench-")
+        try:
+            journal = SessionJournal(directory, fsync=policy, snapshot_interval=1e9)
+            store = JournaledSessionStore(journal)
+            seconds = asyncio.run(run(store, journal))
+            records = turns * 6 + CONCURRENCY
+            print(f"journal fsync={policy:8s} {turns / seconds:9.0f} turns/s "
+                  f"({seconds / baseline - 1:+6.1%} time)  commits {journal.commits:5d}  "
+                  f"{records / max(1, journal.commits):7.0f} records/commit  "
+                  f"{journal.journal_bytes / 2**20:6.1f} MB")
+            if policy == "commit":
+                start = time.perf_counter()
+                asyncio.run(journal.snapshot(store.capture))
+                snapshot_seconds = time.perf_counter() - start
+                start = time.perf_counter()
+                restored = JournaledSessionStore(SessionJournal(directory))
+                restored.recover()
+                print(f"snapshot {snapshot_seconds * 1e3:.0f} ms, recover {len(restored.sessions)} sessions "
+                      f"in {(time.perf_counter() - start) * 1e3:.0f} ms")
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""比较旧的字典消息与紧凑的 Message 记录的内存占用和序列化耗时。
+
+- memory: 在内存中保存 SESSIONS 个会话、每个会话 MESSAGES 条消息时的分配量（tracemalloc），
+  消息正文在两种实现中共享同一个字符串，结果只反映每条消息的结构开销
+- serialize: 一次 /get_conversation 响应的序列化耗时，旧实现走 FastAPI 默认的
+  jsonable_encoder + JSONResponse，新实现走 serialize_conversation
+
+用法: python benchmarks/bench_messages.py [sessions] [messages_per_session]
+"""
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from messages import Message, serialize_conversation  # noqa: E402
+
+SESSIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+MESSAGES = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+TEXTS = ["请问期货交易时间是什么时候？", "您好，期货交易时间分为日盘和夜盘，具体以交易所公告为准。"]
+
+
+def legacy_message(i: int) -> dict:
+    # 与旧版 backend.add_message 相同：每条消息一个字典，时间戳为格式化后的字符串
+    return {
+        "sender": "user" if i % 2 == 0 else "ai",
+        "message": TEXTS[i % 2],
+        "timestamp": datetime.now().strftime("%H:%M:%S"),
+    }
+
+
+def compact_message(i: int) -> Message:
+    return Message("user" if i % 2 == 0 else "ai", TEXTS[i % 2])
+
+
+def allocated_bytes(factory) -> int:
+    gc.collect()
+    tracemalloc.start()
+    sessions = [[factory(i) for i in range(MESSAGES)] for _ in range(SESSIONS)]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del sessions
+    return current
+
+
+def per_call_us(fn, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def main():
+    print(f"{SESSIONS} sessions x {MESSAGES} messages")
+    legacy = allocated_bytes(legacy_message)
+    compact = allocated_bytes(compact_message)
+    total = SESSIONS * MESSAGES
+    print(f"memory legacy dict: {legacy / 2**20:8.1f} MB ({legacy / total:6.1f} B/message)")
+    print(f"memory Message:     {compact / 2**20:8.1f} MB ({compact / total:6.1f} B/message)")
+    print(f"reduction:          {(1 - compact / legacy) * 100:8.1f} %")
+
+    for length in (MESSAGES, 100):
+        legacy_conversation = [legacy_message(i) for i in range(length)]
+        compact_conversation = [compact_message(i) for i in range(length)]
+        n = max(200, 200_000 // length)
+        before = per_call_us(lambda: JSONResponse(jsonable_encoder(legacy_conversation)).body, n)
+        after = per_call_us(lambda: serialize_conversation(compact_conversation), n)
+        print(f"serialize {length:4d} messages: legacy {before:8.1f} us, compact {after:8.1f} us "
+              f"({before / after:4.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""测量指标采集在热路径上的开销。
+
+- counter/histogram: 单次 inc/observe 的耗时
+- middleware: 对一个空 ASGI 应用直接调用，比较有无 RequestMetricsMiddleware 的单请求耗时
+- render: 一次 /metrics 抓取的渲染耗时
+
+用法: python benchmarks/bench_metrics.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import REGISTRY, REQUESTS, UPSTREAM_TTFT, RequestMetricsMiddleware  # noqa: E402
+
+N = 200_000
+
+
+class _Route:
+    path = "/get_session_state/{session_id}"
+
+
+async def empty_app(scope, receive, send):
+    scope["route"] = _Route
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def receive():
+    return {"type": "http.request", "body": b""}
+
+
+async def send(message):
+    pass
+
+
+async def per_request_us(app, n=N // 4):
+    scope = {"type": "http", "path": "/get_session_state/x"}
+    start = time.perf_counter()
+    for _ in range(n):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def per_call_ns(fn, n=N):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1e9
+
+
+def main():
+    print(f"counter inc:       {per_call_ns(lambda: REQUESTS.inc('/x', '200')):8.0f} ns")
+    print(f"histogram observe: {per_call_ns(lambda: UPSTREAM_TTFT.observe(0.123)):8.0f} ns")
+
+    baseline = asyncio.run(per_request_us(empty_app))
+    instrumented = asyncio.run(per_request_us(RequestMetricsMiddleware(empty_app)))
+    print(f"ASGI request without middleware: {baseline:6.2f} us")
+    print(f"ASGI request with middleware:    {instrumented:6.2f} us "
+          f"(+{instrumented - baseline:.2f} us per request)")
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        REGISTRY.render()
+    print(f"render /metrics: {(time.perf_counter() - start):8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""对比每轮重新拼接上下文与增量维护上下文的单轮开销。
+
+- legacy:      原实现，每轮遍历全部历史重新格式化拼接
+- append:      新实现中每轮的增量工作（渲染新消息并追加到缓冲区），与历史长度无关
+- materialize: 把全部历史拼成完整提示词。这是整个请求体的一次内存拷贝，耗时随提示词大小线性增长，
+               不是增量的：str 不可变，提示词又要整体序列化发送，只能省掉 legacy 逐条格式化的部分
+- windowed:    后端实际发送的提示词（build_windowed_prompt），只取 CONTEXT_TOKEN_BUDGET 以内的最近消息，
+               耗时和大小都不随历史增长；更早的消息由后台折叠成摘要
+
+用法: python benchmarks/bench_prompt_context.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from context_window import build_windowed_prompt  # noqa: E402
+from prompt_context import SYSTEM_PROMPT, build_prompt, render_turn  # noqa: E402
+from session_store import ContextWindow  # noqa: E402
+
+MESSAGE = "请问文华财经的期货交易时间是什么时候？手续费怎么收取？" * 3
+CHECKPOINTS = (10, 100, 1000, 5000)
+REPEAT = 200
+
+
+def legacy_build(conversation):
+    context_content = ""
+    for msg in conversation:
+        if msg["sender"] == "user":
+            context_content += f"用户: {msg['message']}\n"
+        elif msg["sender"] == "ai":
+            context_content += f"AI: {msg['message']}\n"
+    return f"系统设定: {SYSTEM_PROMPT}\n{context_content}"
+
+
+def per_turn_us(fn, repeat=REPEAT):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    conversation = []
+    parts = []
+    print(f"{'turns':>6} {'prompt KB':>10} {'legacy us':>10} {'append us':>10} {'materialize us':>15} "
+          f"{'windowed KB':>12} {'windowed us':>12}")
+    for n in range(1, max(CHECKPOINTS) + 1):
+        sender = "user" if n % 2 else "ai"
+        conversation.append({"sender": sender, "message": MESSAGE, "timestamp": "00:00:00"})
+        parts.append(render_turn(sender, MESSAGE))
+        if n in CHECKPOINTS:
+            legacy = per_turn_us(lambda: legacy_build(conversation), repeat=max(1, REPEAT * 10 // n))
+            scratch = []
+            append = per_turn_us(lambda: scratch.append(render_turn(sender, MESSAGE)))
+            materialize = per_turn_us(lambda: build_prompt("".join(parts)), repeat=max(1, REPEAT * 10 // n))
+            size = len(build_prompt("".join(parts)).encode("utf-8")) / 1024
+            window = ContextWindow(turns=parts)
+            windowed = per_turn_us(lambda: build_windowed_prompt(window))
+            windowed_size = len(build_windowed_prompt(window).encode("utf-8")) / 1024
+            print(f"{n:>6} {size:>10.1f} {legacy:>10.1f} {append:>10.2f} {materialize:>15.1f} "
+                  f"{windowed_size:>12.1f} {windowed:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""比较逐 token 重新渲染与 RenderScheduler 节流渲染发送给浏览器的数据量和渲染耗时。
+
+用虚拟时钟模拟上游按 RATE tokens/s 输出一个 TOKENS 个 token 的长回答（不实际等待），
+渲染函数与 frontend.py 相同：格式化整段气泡 HTML 后交给 placeholder.markdown，这里用一个
+只做 UTF-8 编码的假 placeholder 代替。输出：
+- frames / sent: 渲染次数和发送给浏览器的 HTML 总量（每次 markdown 都会发送整段 HTML）
+- render: 渲染路径上的 CPU 时间（格式化 + 编码）
+- staleness: token 到达后到它被渲染出来的平均 / 最大延迟
+
+用法: python benchmarks/bench_render.py [tokens] [tokens_per_second]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from render_scheduler import RenderScheduler  # noqa: E402
+
+TOKENS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+RATE = float(sys.argv[2]) if len(sys.argv) > 2 else 40.0
+TEXT = ("您好，文华财经的期货交易时间分为日盘和夜盘两个部分，其中日盘在上午九点开盘并于下午三点收盘。"
+        "夜盘的交易时间因品种而异，部分品种在晚上九点开盘，凌晨一点或两点半收盘，具体以交易所公告为准！"
+        "如果您在使用文华财经软件查看行情或下单交易时遇到问题，可以随时咨询我们的在线客服人员；\n")
+RESPONSE_HTML = """
+    <div class="ai-message-container">
+        <div class="avatar ai-avatar">🤖</div>
+        <div class="ai-message">
+            <div class="status-title thinking">【深度思考中】</div>
+            <div class="message-content">{}</div>
+            <div class="message-timestamp">{} | AI助手</div>
+        </div>
+    </div>
+"""
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class Browser:
+    """假的 placeholder：记录每次发送的数据量和渲染时刻。"""
+
+    def __init__(self, clock: VirtualClock):
+        self.clock = clock
+        self.frames = 0
+        self.bytes = 0
+        self.rendered_chars = []
+
+    def markdown(self, html: str, rendered_chars: int):
+        self.frames += 1
+        self.bytes += len(html.encode("utf-8"))
+        self.rendered_chars.append((self.clock.now, rendered_chars))
+
+
+def make_tokens(count: int) -> list:
+    # 每个 token 1~3 个字符，与中文大模型的常见切分相近
+    tokens, i = [], 0
+    for n in range(count):
+        size = 1 + n % 3
+        tokens.append("".join(TEXT[(i + k) % len(TEXT)] for k in range(size)))
+        i += size
+    return tokens
+
+
+def render_html(text: str, final: bool) -> str:
+    html = RESPONSE_HTML.format(text.replace("\n", "<br>"), "10:00:00")
+    if final:
+        html = html.replace("thinking", "completed").replace("【深度思考中】", "【已深度思考】")
+    return html
+
+
+def staleness(arrivals: list, browser: Browser) -> tuple:
+    # 每个 token 到达后，第一次包含它的渲染时刻与到达时刻之差
+    delays, frame = [], 0
+    frames = browser.rendered_chars
+    for at, chars in arrivals:
+        while frames[frame][1] < chars:
+            frame += 1
+        delays.append(frames[frame][0] - at)
+    return sum(delays) / len(delays), max(delays)
+
+
+def run_legacy(tokens: list):
+    clock = VirtualClock()
+    browser = Browser(clock)
+    arrivals, message = [], ""
+    start = time.perf_counter()
+    for n, token in enumerate(tokens):
+        clock.now = n / RATE
+        message += token
+        arrivals.append((clock.now, len(message)))
+        browser.markdown(render_html(message, False), len(message))
+    browser.markdown(render_html(message, True), len(message))
+    return browser, arrivals, time.perf_counter() - start
+
+
+def run_scheduled(tokens: list, fps: float):
+    clock = VirtualClock()
+    browser = Browser(clock)
+
+    def render(text: str, final: bool) -> str:
+        html = render_html(text, final)
+        browser.markdown(html, len(text))
+        return html
+
+    scheduler = RenderScheduler(render, fps=fps, clock=clock)
+    arrivals, length = [], 0
+    start = time.perf_counter()
+    for n, token in enumerate(tokens):
+        clock.now = n / RATE
+        length += len(token)
+        arrivals.append((clock.now, length))
+        scheduler.push(token)
+    scheduler.close()
+    return browser, arrivals, time.perf_counter() - start
+
+
+def report(label: str, browser: Browser, arrivals: list, seconds: float, baseline: Browser):
+    mean, worst = staleness(arrivals, browser)
+    print(f"{label:14s} frames {browser.frames:6d}  sent {browser.bytes / 2**20:8.2f} MB "
+          f"({baseline.bytes / browser.bytes:6.1f}x less)  render {seconds * 1e3:7.1f} ms  "
+          f"staleness avg {mean * 1e3:5.0f} ms max {worst * 1e3:5.0f} ms")
+
+
+def main():
+    tokens = make_tokens(TOKENS)
+    chars = sum(map(len, tokens))
+    print(f"{TOKENS} tokens ({chars} chars) at {RATE:g} tokens/s, {TOKENS / RATE:.0f} s of streaming")
+    legacy = run_legacy(tokens)
+    report("per token", *legacy, legacy[0])
+    for fps in (20, 10, 5):
+        report(f"scheduler {fps:g}fps", *run_scheduled(tokens, fps), legacy[0])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""比较共享的增量 SSE 解析器（sse.py）与原来逐行解析循环的耗时。
+
+合成一个 TOKENS 个 token 的上游响应（每个事件一个 OpenAI 风格的 delta），分别按
+每个事件一个网络块、固定 4 KB 块，以及事件之间只有一个换行（没有空行）、每行一个网络块三种方式输入：
+- legacy: 原 AI_Chat_Server_Xiaowen.py 的循环，requests.iter_lines 切行、逐行 decode、
+  json.loads，并用 += 拼接完整回复
+- sse/json: sse.iter_tokens 使用标准库 json，列表收集后一次 join
+- sse/orjson: 同上，使用 orjson（已安装时）
+
+各实现按轮交替运行，取每个实现 ROUNDS 轮中最快的一次，减少机器负载波动的影响。
+first token 一列是产出第一个 token 之前读入的网络块数。结果和机器、Python 及 orjson 版本有关，
+不同机器上的加速比可能相差很大。
+
+用法: python benchmarks/bench_sse.py [tokens]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sse  # noqa: E402
+
+TOKENS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+TEXT = "您好，文华财经的期货交易时间分为日盘和夜盘，具体以交易所公告为准。"
+ROUNDS = 7
+
+
+def build_events(tokens: int, separator: str = "\n\n") -> list:
+    events = []
+    for i in range(tokens):
+        payload = {"id": "chatcmpl-bench", "object": "chat.completion.chunk",
+                   "choices": [{"index": 0, "delta": {"content": TEXT[i % len(TEXT)]}, "finish_reason": None}]}
+        events.append(f"data: {json.dumps(payload, ensure_ascii=False)}{separator}".encode("utf-8"))
+    events.append(f"data: [DONE]{separator}".encode("utf-8"))
+    return events
+
+
+def fixed_chunks(events: list, size: int) -> list:
+    # 固定大小切块，多字节字符和事件都可能被拆开
+    body = b"".join(events)
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+def iter_lines(chunks):
+    # 与 requests.Response.iter_lines 相同的切行逻辑
+    pending = None
+    for chunk in chunks:
+        if pending is not None:
+            chunk = pending + chunk
+        lines = chunk.splitlines()
+        if lines and lines[-1] and chunk and lines[-1][-1] == chunk[-1]:
+            pending = lines.pop()
+        else:
+            pending = None
+        yield from lines
+    if pending is not None:
+        yield pending
+
+
+def legacy_tokens(chunks):
+    for line in iter_lines(chunks):
+        if line:
+            decoded_line = line.decode("utf-8")
+            if decoded_line.startswith("data: "):
+                data = decoded_line[6:]
+                if data == "[DONE]":
+                    return
+                try:
+                    chunk = json.loads(data)
+                    if "choices" in chunk and chunk["choices"]:
+                        delta = chunk["choices"][0].get("delta", {})
+                        token = delta.get("content", "")
+                        if token is not None:
+                            yield token
+                except json.JSONDecodeError:
+                    continue
+
+
+def legacy(chunks) -> str:
+    full_response = ""
+    for token in legacy_tokens(chunks):
+        full_response += token
+    return full_response
+
+
+def shared(chunks) -> str:
+    tokens = []
+    for token in sse.iter_tokens(chunks):
+        tokens.append(token)
+    return "".join(tokens)
+
+
+def stdlib_json():
+    sse.loads = sse.stdlib_loads
+    sse.JSON_ERRORS = (json.JSONDecodeError, UnicodeDecodeError)
+
+
+def fast_json(loads=sse.loads, errors=sse.JSON_ERRORS):
+    sse.loads = loads
+    sse.JSON_ERRORS = errors
+
+
+def first_token_chunk(tokens, chunks) -> int:
+    # 产出第一个 token 时已经读入的网络块数
+    read = [0]
+
+    def counted():
+        for chunk in chunks:
+            read[0] += 1
+            yield chunk
+
+    next(iter(tokens(counted())))
+    return read[0]
+
+
+def main():
+    events = build_events(TOKENS)
+    expected = legacy(events)
+    implementations = [("legacy", legacy, None), ("sse/json", shared, stdlib_json)]
+    if sse.orjson is not None:
+        implementations.append(("sse/orjson", shared, fast_json))
+    print(f"{TOKENS} tokens, {sum(map(len, events)) / 2**20:.1f} MB, best of {ROUNDS} interleaved rounds")
+    for name, chunks in (("one event per chunk", events),
+                         ("4 KB chunks", fixed_chunks(events, 4096)),
+                         ("no blank lines, one line per chunk", build_events(TOKENS, "\n"))):
+        best = {label: float("inf") for label, _, _ in implementations}
+        for _ in range(ROUNDS):
+            for label, fn, setup in implementations:
+                if setup is not None:
+                    setup()
+                start = time.perf_counter()
+                result = fn(chunks)
+                best[label] = min(best[label], time.perf_counter() - start)
+                assert result == expected, label
+        fast_json()
+        first = {"legacy": first_token_chunk(legacy_tokens, chunks),
+                 "sse": first_token_chunk(sse.iter_tokens, chunks)}
+        print(f"{name} (first token after chunk: legacy {first['legacy']}, sse {first['sse']})")
+        for label, seconds in best.items():
+            print(f"  {label:11s} {seconds * 1e3:8.1f} ms  {TOKENS / seconds / 1e3:7.0f} k tokens/s  "
+                  f"({best['legacy'] / seconds:4.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""比较长对话历史在不同响应编码下的序列化 CPU、传输字节数和并发吞吐。
+
+- encode: 单次编码 MESSAGES 条消息的耗时和体积：逐条拼接 JSON（未安装 orjson 时的实现）、orjson、
+  MessagePack，以及按后端配置（RESPONSE_GZIP_LEVEL、RESPONSE_BROTLI_QUALITY）压缩的耗时和压缩后体积
+- load: 启动一个后端进程，预先写入一个 MESSAGES 条消息的会话，THREADS 个线程并发全量拉取
+  GET /sync_session（since=0，相当于新页面或换设备打开长对话），统计每个请求消耗的后端 CPU
+  （/proc/<pid>/stat，仅支持 Linux）、每个响应的传输字节数、延迟和吞吐
+
+msgpack、brotli 未安装时跳过对应的场景。
+
+用法: python benchmarks/bench_wire_format.py [messages] [threads] [requests_per_thread]
+"""
+import gzip
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+from loadtest import percentile  # noqa: E402
+from messages import Message, conversation_dicts, render_conversation  # noqa: E402
+from wire import compress  # noqa: E402
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 后端子进程以 --serve <mode> <messages> 启动
+SERVE = len(sys.argv) > 1 and sys.argv[1] == "--serve"
+ARGS = sys.argv[3:] if SERVE else sys.argv[1:]
+MESSAGES = int(ARGS[0]) if len(ARGS) > 0 else 1000
+THREADS = int(ARGS[1]) if len(ARGS) > 1 else 8
+REQUESTS = int(ARGS[2]) if len(ARGS) > 2 else 50
+PORT = 8811
+BACKEND_URL = f"http://127.0.0.1:{PORT}"
+SESSION_ID = "bench-wire"
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def sample_messages(n: int):
+    # 问题和回答交替，回答带编号避免整段重复，压缩率接近真实对话
+    return [
+        Message("user", f"请问第 {i // 2} 个合约的期货交易时间是什么时候？", 1_700_000_000 + i)
+        if i % 2 == 0 else
+        Message("ai", f"您好，第 {i // 2} 个合约的交易时间分为日盘和夜盘，日盘上午九点开盘，"
+                      f"夜盘时间因品种而异，保证金比例为 {i % 17 + 5}%，具体以交易所公告为准。", 1_700_000_000 + i)
+        for i in range(n)
+    ]
+
+
+def serve(mode: str):
+    """后端子进程入口：写入测试会话后启动 uvicorn。legacy 模式关闭 orjson，退回逐条拼接的 JSON。"""
+    import uvicorn
+
+    import backend
+    import messages
+
+    if mode == "legacy":
+        backend.orjson = messages.orjson = None
+    backend.store.create(SESSION_ID)
+    for message in sample_messages(MESSAGES):
+        backend.store.append_message(SESSION_ID, message)
+    uvicorn.run(backend.app, port=PORT, log_level="warning")
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime、stime 为第 14、15 个字段，去掉 pid 和 comm 后下标为 11、12
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def per_call_ms(fn, number: int = 50) -> float:
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best * 1e3
+
+
+def bench_encode():
+    conversation = sample_messages(MESSAGES)
+    print(f"encode {MESSAGES} messages")
+    bodies = {"json (concat)": lambda: render_conversation(conversation).encode("utf-8")}
+    if orjson is not None:
+        bodies["orjson"] = lambda: orjson.dumps(conversation_dicts(conversation))
+    if msgpack is not None:
+        bodies["msgpack"] = lambda: msgpack.packb(conversation_dicts(conversation))
+    for label, fn in bodies.items():
+        body = fn()
+        line = f"  {label:14s} {per_call_ms(fn):6.2f} ms  {len(body) / 1024:7.1f} KB"
+        for encoding in ("gzip", "br") if brotli is not None else ("gzip",):
+            line += f"  | {encoding} {per_call_ms(lambda: compress(body, encoding), 20):5.2f} ms " \
+                    f"{len(compress(body, encoding)) / 1024:6.1f} KB"
+        print(line)
+
+
+def fetch(client: requests.Session, headers: dict, latencies: list, sizes: list):
+    for _ in range(REQUESTS):
+        start = time.perf_counter()
+        response = client.get(f"{BACKEND_URL}/sync_session/{SESSION_ID}", params={"since": 0},
+                              headers=headers, stream=True)
+        # 读取未解压的原始字节，统计实际传输量，再按客户端的方式解码
+        raw = response.raw.read(decode_content=False)
+        if response.headers.get("Content-Encoding") == "gzip":
+            raw_body = gzip.decompress(raw)
+        elif response.headers.get("Content-Encoding") == "br":
+            raw_body = brotli.decompress(raw)
+        else:
+            raw_body = raw
+        if response.headers["Content-Type"].startswith("application/msgpack"):
+            data = msgpack.unpackb(raw_body)
+        else:
+            data = orjson.loads(raw_body) if orjson is not None else json.loads(raw_body)
+        assert len(data["messages"]) == MESSAGES
+        latencies.append(time.perf_counter() - start)
+        sizes.append(len(raw))
+
+
+def bench_load(label: str, mode: str, compression: bool, headers: dict) -> dict:
+    env = {**os.environ, "RESPONSE_COMPRESSION": "1" if compression else "0"}
+    backend = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", mode,
+                                str(MESSAGES)], cwd=BACKEND_DIR, env=env)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                requests.get(f"{BACKEND_URL}/stats")
+                break
+            except requests.ConnectionError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+        client = requests.Session()
+        client.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=THREADS))
+        latencies = [[] for _ in range(THREADS)]
+        sizes = [[] for _ in range(THREADS)]
+        cpu_start = cpu_seconds(backend.pid)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(THREADS) as executor:
+            list(executor.map(lambda i: fetch(client, headers, latencies[i], sizes[i]), range(THREADS)))
+        elapsed = time.perf_counter() - start
+        cpu = cpu_seconds(backend.pid) - cpu_start
+    finally:
+        backend.terminate()
+        backend.wait()
+
+    total = THREADS * REQUESTS
+    samples = [value for values in latencies for value in values]
+    return {
+        "label": label,
+        "cpu_ms": cpu / total * 1e3,
+        "kb": sum(sum(values) for values in sizes) / total / 1024,
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "rps": total / elapsed,
+    }
+
+
+def main():
+    bench_encode()
+
+    cases = [("json, identity", "legacy", False, {"Accept-Encoding": "identity"})]
+    if orjson is not None:
+        cases.append(("orjson, identity", "default", True, {"Accept-Encoding": "identity"}))
+        cases.append(("orjson + gzip", "default", True, {"Accept-Encoding": "gzip"}))
+        if brotli is not None:
+            cases.append(("orjson + br", "default", True, {"Accept-Encoding": "br, gzip"}))
+    if msgpack is not None:
+        encoding = "br, gzip" if brotli is not None else "gzip"
+        cases.append((f"msgpack + {encoding.split(',')[0]}", "default", True,
+                      {"Accept": "application/msgpack", "Accept-Encoding": encoding}))
+
+    print(f"\nload: {THREADS} threads x {REQUESTS} full syncs of {MESSAGES} messages")
+    baseline = None
+    for label, mode, compression, headers in cases:
+        result = bench_load(label, mode, compression, headers)
+        baseline = baseline or result
+        print(f"  {result['label']:17s} backend CPU {result['cpu_ms']:6.2f} ms/req  "
+              f"wire {result['kb']:7.1f} KB/req  p50 {result['p50'] * 1e3:6.1f} ms  "
+              f"p95 {result['p95'] * 1e3:6.1f} ms  {result['rps']:6.0f} req/s  "
+              f"(CPU {result['cpu_ms'] / baseline['cpu_ms'] - 1:+.0%}, "
+              f"bytes {result['kb'] / baseline['kb'] - 1:+.0%})")
+
+
+if __name__ == "__main__":
+    if SERVE:
+        serve(sys.argv[2])
+    else:
+        main()
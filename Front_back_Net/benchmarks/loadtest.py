@@ -0,0 +1,236 @@
+"""后端端到端压测：每个虚拟用户依次调用 init_session → add_user_message → 生成接口。
+
+默认会在本地启动 mock_upstream.py 和 backend.py（uvicorn），压测结束后自动关闭；
+传入 --backend-url 时改为压测已经在运行的后端。
+
+用法:
+    python benchmarks/loadtest.py --requests 500 --concurrency 50 --mode stream
+    python benchmarks/loadtest.py --backend-url http://127.0.0.1:8000 --backend-pid 12345
+
+输出端到端延迟与首 token 延迟的 p50/p95/p99、吞吐量和后端进程 RSS。
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def read_rss_mb(pid):
+    # 仅支持 Linux，其他平台返回 None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+async def wait_until_ready(url, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} 未能在 {timeout} 秒内启动")
+
+
+class Result:
+    def __init__(self):
+        self.latencies = []
+        self.ttfts = []
+        self.tokens = 0
+        self.errors = 0
+        self.status_counts = {}
+
+
+async def run_user(client, args, result, index):
+    session_id = str(uuid.uuid4())
+    if args.distinct_questions:
+        question = f"请问期货交易时间是什么时候？#{index % args.distinct_questions}"
+    else:
+        question = f"请问期货交易时间是什么时候？#{session_id}"
+
+    start = time.perf_counter()
+    try:
+        await client.post("/init_session", json={"session_id": session_id})
+        response = await client.post("/add_user_message",
+                                     json={"session_id": session_id, "content_text": question})
+
+        if response.status_code != 200:
+            # 生成队列已满时在提交消息这一步就被拒绝
+            status = response.status_code
+            ok = False
+        elif args.mode == "stream":
+            async with client.stream("GET", f"/stream_ai_response/{session_id}") as response:
+                status = response.status_code
+                first = None
+                ok = status == 200
+                async for line in response.aiter_lines():
+                    if line.startswith("data: ") and first is None:
+                        first = time.perf_counter()
+                    if line.startswith("data: ") and '"token"' in line:
+                        result.tokens += 1
+                    if line == "event: error":
+                        ok = False
+                if first is not None:
+                    result.ttfts.append(first - start)
+        else:
+            response = await client.post("/process_ai_response", json={"session_id": session_id})
+            status = response.status_code
+            ok = status == 200 and response.json().get("status") == "success"
+            if ok:
+                result.tokens += len(response.json()["response"])
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+        ok = False
+
+    result.status_counts[status] = result.status_counts.get(status, 0) + 1
+    if ok:
+        result.latencies.append(time.perf_counter() - start)
+    else:
+        result.errors += 1
+
+
+async def run_load(args, backend_pid=None):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    result = Result()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    peak_rss = None
+
+    async def worker(i):
+        async with semaphore:
+            await run_user(client, args, result, i)
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while True:
+            rss = read_rss_mb(backend_pid)
+            if rss is not None:
+                peak_rss = max(peak_rss or 0, rss)
+            await asyncio.sleep(0.2)
+
+    async with httpx.AsyncClient(base_url=args.backend_url, limits=limits, timeout=args.timeout) as client:
+        sampler = asyncio.create_task(sample_rss()) if backend_pid else None
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(args.requests)))
+        elapsed = time.perf_counter() - start
+        if sampler:
+            sampler.cancel()
+
+    return result, elapsed, peak_rss
+
+
+def report(args, result, elapsed, peak_rss):
+    def ms(values, p):
+        return percentile(values, p) * 1000
+
+    summary = {
+        "mode": args.mode,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "errors": result.errors,
+        "status_counts": {str(k): v for k, v in result.status_counts.items()},
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(result.latencies) / elapsed, 2),
+        "tokens_per_s": round(result.tokens / elapsed, 1),
+        "latency_ms": {f"p{p}": round(ms(result.latencies, p), 1) for p in (50, 95, 99)},
+        "ttft_ms": {f"p{p}": round(ms(result.ttfts, p), 1) for p in (50, 95, 99)} if result.ttfts else None,
+        "backend_peak_rss_mb": round(peak_rss, 1) if peak_rss else None,
+    }
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False))
+        return
+    print(f"mode={args.mode} requests={args.requests} concurrency={args.concurrency} errors={result.errors}")
+    print(f"status codes: {summary['status_counts']}")
+    print(f"elapsed {summary['elapsed_s']} s, {summary['throughput_rps']} req/s, {summary['tokens_per_s']} tokens/s")
+    print("latency ms: " + ", ".join(f"{k}={v}" for k, v in summary["latency_ms"].items()))
+    if summary["ttft_ms"]:
+        print("ttft ms:    " + ", ".join(f"{k}={v}" for k, v in summary["ttft_ms"].items()))
+    if summary["backend_peak_rss_mb"]:
+        print(f"backend peak RSS: {summary['backend_peak_rss_mb']} MB")
+
+
+def spawn_servers(args):
+    """启动 mock 上游和后端，返回进程列表。"""
+    upstream = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, "mock_upstream.py"),
+        "--port", str(args.upstream_port),
+        "--tokens", str(args.tokens),
+        "--token-rate", str(args.token_rate),
+        "--first-token-delay", str(args.first_token_delay),
+        "--error-rate", str(args.error_rate),
+    ])
+    env = dict(os.environ, WENHUA_API_URL=f"http://127.0.0.1:{args.upstream_port}/")
+    backend = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend:app",
+         "--port", str(args.backend_port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+    return upstream, backend
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end load test for backend.py")
+    parser.add_argument("--backend-url", help="test an already running backend instead of spawning one")
+    parser.add_argument("--backend-pid", type=int, help="pid of the backend for RSS sampling")
+    parser.add_argument("--mode", choices=("stream", "process"), default="stream")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--distinct-questions", type=int, default=0,
+                        help="number of distinct questions (0 = every question unique)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--json", action="store_true", help="print a single JSON summary line")
+    # 以下参数仅在自动启动 mock 上游时生效
+    parser.add_argument("--backend-port", type=int, default=8800)
+    parser.add_argument("--upstream-port", type=int, default=9000)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--token-rate", type=float, default=50.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    processes = []
+    backend_pid = args.backend_pid
+    if not args.backend_url:
+        processes = spawn_servers(args)
+        backend_pid = processes[1].pid
+        args.backend_url = f"http://127.0.0.1:{args.backend_port}"
+    try:
+        if processes:
+            asyncio.run(wait_until_ready(f"{args.backend_url}/stats"))
+        result, elapsed, peak_rss = asyncio.run(run_load(args, backend_pid))
+        report(args, result, elapsed, peak_rss)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
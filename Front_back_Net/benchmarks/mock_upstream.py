@@ -0,0 +1,70 @@
+"""模拟文华财经大模型接口的本地服务，协议与上游一致（SSE `data:` 行，以 `data: [DONE]` 结束）。
+
+用法:
+    python benchmarks/mock_upstream.py --port 9000 --tokens 200 --token-rate 50 --first-token-delay 0.5
+
+然后以 WENHUA_API_URL=http://127.0.0.1:9000/ 启动后端即可在本地压测；
+也可以作为 DEEPSEEK_API_URL=http://127.0.0.1:9000 测试多上游路由。
+"""
+import argparse
+import asyncio
+import json
+import random
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+TOKEN_TEXT = "您好，文华财经的期货交易时间分为日盘和夜盘，具体以交易所公告为准。"
+
+
+def create_app(tokens: int = 200, token_rate: float = 50.0, first_token_delay: float = 0.5,
+               error_rate: float = 0.0, jitter: float = 0.0) -> FastAPI:
+    app = FastAPI()
+
+    def chunk(token: str) -> str:
+        payload = {"choices": [{"delta": {"content": token}}]}
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    # 同时模拟 OpenAI 兼容的 /chat/completions，可作为 DEEPSEEK_API_URL 使用
+    @app.post("/")
+    @app.post("/chat/completions")
+    async def generate(request: Request):
+        await request.body()
+        if random.random() < error_rate:
+            return JSONResponse({"error": "mock upstream error"}, status_code=500)
+
+        async def stream():
+            await asyncio.sleep(first_token_delay * (1 + random.uniform(-jitter, jitter)))
+            interval = 1.0 / token_rate if token_rate > 0 else 0
+            for i in range(tokens):
+                yield chunk(TOKEN_TEXT[i % len(TOKEN_TEXT)])
+                if interval:
+                    await asyncio.sleep(interval)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Mock Wenhua SSE upstream")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--tokens", type=int, default=200, help="tokens per response")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="tokens per second, 0 = unthrottled")
+    parser.add_argument("--first-token-delay", type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with HTTP 500")
+    parser.add_argument("--jitter", type=float, default=0.0, help="relative jitter of the first-token delay")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    app = create_app(args.tokens, args.token_rate, args.first_token_delay, args.error_rate, args.jitter)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""聊天历史的增量渲染，Streamlit 前端和独立版 Xiaowen 共用。
+
+Streamlit 每次重新运行都会重新执行整个页面，逐条 st.markdown 历史消息时，运行耗时和发送给浏览器的元素数
+随对话长度线性增长。ChatHistoryView 按消息位置和内容哈希缓存每条已完成消息的 HTML 片段，
+并把按固定边界划分的每 CHAT_HISTORY_BLOCK 条消息合并成一个块：已写满的块每次运行都字节相同，
+只拼接一次，Streamlit 对较大的相同元素也只发送缓存引用。默认只渲染最近 CHAT_HISTORY_WINDOW 条消息，
+更早的消息在用户点击后才按批显示。style_injection 把页面样式包装成插入 document.head 的脚本，
+每个页面会话只需发送一次。
+本模块不依赖 streamlit 和同目录下的其他模块，可以作为 Front_back_Net.chat_render 导入。
+"""
+import hashlib
+import json
+import os
+from functools import lru_cache
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# 默认显示的最近消息条数，以及每次点击“显示更早的消息”增加的条数
+CHAT_HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "40"))
+# 合并为一个 st.markdown 元素的消息条数
+CHAT_HISTORY_BLOCK = int(os.getenv("CHAT_HISTORY_BLOCK", "20"))
+
+AI_MESSAGE_HTML = """
+    <div class="ai-message-container">
+        <div class="avatar ai-avatar">🤖</div>
+        <div class="ai-message">
+            <div class="status-title completed">【已深度思考】</div>
+            {message}
+            <div class="message-timestamp">{timestamp} | AI助手</div>
+        </div>
+    </div>
+"""
+USER_MESSAGE_HTML = """
+    <div class="user-message-container">
+        <div class="user-message">
+            {message}
+            <div class="message-timestamp">{timestamp} | 您</div>
+        </div>
+        <div class="avatar user-avatar">👤</div>
+    </div>
+"""
+
+
+def render_message(msg: dict) -> str:
+    """一条已完成消息的 HTML 片段。"""
+    if msg["sender"] == "ai":
+        return AI_MESSAGE_HTML.format(message=msg["message"], timestamp=msg["timestamp"])
+    if msg["sender"] == "user":
+        return USER_MESSAGE_HTML.format(message=msg["message"], timestamp=msg["timestamp"])
+    return ""
+
+
+@lru_cache(maxsize=None)
+def style_injection(css: str) -> str:
+    """把样式表包装成一段脚本，用 st.html(..., unsafe_allow_javascript=True) 输出。
+
+    脚本把 <style> 插入 document.head：重新运行时 Streamlit 移除的只是脚本所在的元素，样式留在页面上。
+    按内容哈希去重，同一样式表不会插入两次。
+    """
+    style_id = json.dumps("chat-style-" + hashlib.sha1(css.encode("utf-8")).hexdigest()[:12])
+    return (
+        "<script>(function () {"
+        f"if (document.getElementById({style_id})) return;"
+        "var style = document.createElement('style');"
+        f"style.id = {style_id};"
+        f"style.textContent = {json.dumps(css, ensure_ascii=False)};"
+        "document.head.appendChild(style);"
+        "})();</script>"
+    )
+
+
+class ChatHistoryView:
+    """缓存历史消息的 HTML，只渲染新增或内容变化的消息；保存在 st.session_state 中跨运行复用。"""
+
+    def __init__(self, render: Callable[[dict], str] = render_message,
+                 window: int = CHAT_HISTORY_WINDOW,
+                 block_size: int = CHAT_HISTORY_BLOCK):
+        self.render = render
+        self.window = window
+        self.block_size = block_size
+        self.visible = window
+        self._fragments: Dict[tuple, str] = {}
+        self._blocks: Dict[tuple, str] = {}
+        # 统计：累计渲染的消息片段数
+        self.rendered = 0
+
+    def show_earlier(self):
+        """多显示一批更早的消息（按钮回调）。"""
+        self.visible += self.window
+
+    def blocks(self, messages: Sequence[dict]) -> Tuple[int, List[str]]:
+        """返回 (未显示的更早消息条数, 需要输出的 HTML 块列表)。"""
+        size = self.block_size
+        # 起点向下对齐到块边界，窗口随新消息移动时已写满的块保持不变
+        start = max(0, len(messages) - self.visible) // size * size
+        fragments: Dict[tuple, str] = {}
+        blocks: Dict[tuple, str] = {}
+        result = []
+        for lo in range(start, len(messages), size):
+            keys = []
+            for index in range(lo, min(lo + size, len(messages))):
+                msg = messages[index]
+                key = (index, msg["sender"], msg["timestamp"], hash(msg["message"]))
+                fragment = fragments.get(key) or self._fragments.get(key)
+                if fragment is None:
+                    fragment = self.render(msg)
+                    self.rendered += 1
+                fragments[key] = fragment
+                keys.append(key)
+            block_key = tuple(keys)
+            html = self._blocks.get(block_key)
+            if html is None:
+                html = "".join(fragments[key] for key in keys)
+            blocks[block_key] = html
+            result.append(html)
+        # 只保留本次用到的缓存，超出窗口或已被替换的片段随之释放
+        self._fragments = fragments
+        self._blocks = blocks
+        return start, result
@@ -0,0 +1,131 @@
+import asyncio
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+from metrics import CANCEL_SAVED_TOKENS
+
+# 估算平均回答长度（token 数）的指数滑动平均系数
+FLIGHT_TOKENS_EWMA_ALPHA = 0.1
+
+
+class Flight:
+    """一次正在进行的上游生成，保存已产出的 token 并通知所有订阅者。"""
+
+    def __init__(self):
+        self.tokens: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        # 最后一个订阅者在生成结束前离开时调用
+        self.on_abandoned: Optional[Callable[[], None]] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        # 唤醒当前等待的订阅者，并为下一次更新换一个新的 Event
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def publish(self, token: str):
+        self.tokens.append(token)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        """先回放已产出的 token，再跟随实时产出，直到生成结束。"""
+        self.subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(self.tokens):
+                    yield self.tokens[index]
+                    index += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done and self.on_abandoned is not None:
+                self.on_abandoned()
+
+
+class SingleFlight:
+    """相同 key 的并发请求共享同一个上游生成，token 流扇出给所有订阅者。
+
+    所有订阅者都离开（取消或断开）后立即取消上游生成，关闭上游连接。
+    """
+
+    def __init__(self):
+        self.flights: Dict[str, Flight] = {}
+        self.tasks = set()
+        self.started = 0
+        self.joined = 0
+        self.cancelled = 0
+        # 已完成生成的平均 token 数，用于估算取消节省的 token
+        self.tokens_ewma: Optional[float] = None
+        self.tokens_saved = 0.0
+
+    def stream(self, key: str, factory: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = Flight()
+            self.flights[key] = flight
+            self.started += 1
+            # 上游在独立任务中运行，某个订阅者断开不会影响其他订阅者
+            task = asyncio.create_task(self._run(key, flight, factory))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+            flight.on_abandoned = lambda: self._abandon(key, flight, task)
+        else:
+            self.joined += 1
+        return flight.subscribe()
+
+    async def _run(self, key: str, flight: Flight, factory: Callable[[], AsyncIterator[str]]):
+        try:
+            async for token in factory():
+                flight.publish(token)
+        except asyncio.CancelledError:
+            self._record_cancelled(flight)
+            raise
+        except Exception as e:
+            flight.finish(e)
+        else:
+            flight.finish()
+            count = len(flight.tokens)
+            if self.tokens_ewma is None:
+                self.tokens_ewma = float(count)
+            else:
+                self.tokens_ewma += FLIGHT_TOKENS_EWMA_ALPHA * (count - self.tokens_ewma)
+        finally:
+            if not flight.done:
+                flight.finish(RuntimeError("上游生成已取消"))
+            # 生成结束后不再接受新的订阅者，之后的相同请求由缓存或新的生成处理
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+
+    def _abandon(self, key: str, flight: Flight, task: asyncio.Task):
+        # 先移出，取消期间到达的相同请求会发起新的生成，而不是加入一个正在取消的生成
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+        task.cancel()
+
+    def _record_cancelled(self, flight: Flight):
+        # 无法得知被取消的回答原本有多长，按已完成回答的平均长度估算少生成的 token 数
+        self.cancelled += 1
+        if self.tokens_ewma is not None:
+            saved = max(0.0, self.tokens_ewma - len(flight.tokens))
+            self.tokens_saved += saved
+            CANCEL_SAVED_TOKENS.inc(amount=saved)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self.flights),
+            "started": self.started,
+            "joined": self.joined,
+            "cancelled": self.cancelled,
+            "tokens_saved": round(self.tokens_saved),
+        }
@@ -0,0 +1,117 @@
+"""按 token 预算裁剪上下文，并在后台把较早的对话折叠成滚动摘要。
+
+请求路径上只做两件事：估算 token 数、从最近的消息往前取到预算用完为止，开销与会话总长度无关。
+窗口超出预算时，在后台调用上游生成摘要，完成后原子地写回会话（摘要 + 丢弃已折叠的消息），
+摘要完成之前的请求仍然只发送预算内的最近消息。
+"""
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, List, Set
+
+from prompt_context import SYSTEM_PREFIX, build_prompt
+from session_store import ContextWindow, call_store
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "400"))
+# 触发折叠后，窗口内保留的 token 数占预算的比例；留出余量可以减少折叠次数，让前缀更稳定
+CONTEXT_KEEP_RATIO = float(os.getenv("CONTEXT_KEEP_RATIO", "0.5"))
+
+SUMMARY_INSTRUCTION = (
+    "请将以下客服对话压缩为简洁的摘要，保留用户的身份信息、诉求、已给出的结论和未解决的问题，"
+    f"不超过{SUMMARY_MAX_TOKENS}字。"
+)
+
+
+def estimate_tokens(text: str) -> int:
+    # 粗略估算：中文等非 ASCII 字符约 1 token/字，ASCII 约 4 字符/token
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return len(text) - ascii_chars + (ascii_chars + 3) // 4
+
+
+def render_summary(summary: str) -> str:
+    return f"对话摘要: {summary}\n" if summary else ""
+
+
+def build_windowed_prompt(window: ContextWindow, budget: int = CONTEXT_TOKEN_BUDGET,
+                          grounding: str = "") -> str:
+    """固定前缀 + 摘要 + 预算内最近的消息 + 参考资料。最新一条消息总会保留。
+
+    参考资料放在末尾，不影响前面可被上游缓存的前缀。
+    """
+    summary_block = render_summary(window.summary)
+    remaining = (budget - estimate_tokens(SYSTEM_PREFIX) - estimate_tokens(summary_block)
+                 - estimate_tokens(grounding))
+    start = len(window.turns)
+    while start > 0:
+        cost = estimate_tokens(window.turns[start - 1])
+        if cost > remaining and start < len(window.turns):
+            break
+        remaining -= cost
+        start -= 1
+    return build_prompt(summary_block + "".join(window.turns[start:]) + grounding)
+
+
+def plan_fold(window: ContextWindow, budget: int = CONTEXT_TOKEN_BUDGET,
+              keep_ratio: float = CONTEXT_KEEP_RATIO) -> int:
+    """返回需要折叠进摘要的最早消息条数，窗口未超预算时返回 0。"""
+    costs = [estimate_tokens(turn) for turn in window.turns]
+    total = sum(costs) + estimate_tokens(render_summary(window.summary))
+    if total <= budget:
+        return 0
+
+    target = budget * keep_ratio
+    count = 0
+    # 至少保留最新一条消息
+    while count < len(costs) - 1 and total > target:
+        total -= costs[count]
+        count += 1
+    return count
+
+
+def build_summary_request(summary: str, turns: List[str]) -> str:
+    previous = f"已有摘要: {summary}\n" if summary else ""
+    return f"{SUMMARY_INSTRUCTION}\n{previous}新增对话:\n{''.join(turns)}"
+
+
+class ContextSummarizer:
+    """在请求路径之外折叠会话的旧消息，同一会话同一时间只运行一个折叠任务。"""
+
+    def __init__(self, store, summarize: Callable[[str], Awaitable[str]],
+                 budget: int = CONTEXT_TOKEN_BUDGET):
+        self.store = store
+        self.summarize = summarize
+        self.budget = budget
+        self.pending: Set[str] = set()
+        self.tasks: Set[asyncio.Task] = set()
+
+    def maybe_schedule(self, session_id: str, window: ContextWindow):
+        if session_id in self.pending:
+            return
+        count = plan_fold(window, self.budget)
+        if count == 0:
+            return
+        self.pending.add(session_id)
+        task = asyncio.create_task(self._fold(session_id, window, count))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _fold(self, session_id: str, window: ContextWindow, count: int):
+        try:
+            summary = await self.summarize(build_summary_request(window.summary, window.turns[:count]))
+            summary = summary.strip()
+            if summary:
+                # 以折叠前的 folded 作为版本号，其他 worker 抢先折叠时放弃本次结果
+                await call_store(self.store, self.store.fold_context, session_id, window.folded, count, summary)
+        except Exception as e:
+            # 摘要失败不影响对话，下一轮会重新尝试
+            logger.warning("会话 %s 摘要失败: %s", session_id, e)
+        finally:
+            self.pending.discard(session_id)
+
+    async def close(self):
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
@@ -0,0 +1,220 @@
+"""本地 FAQ 检索索引。
+
+对 FAQ 语料（JSONL，每行一个问答）的问题文本提取字符 n-gram，哈希到固定维度后计算 TF-IDF，
+相似度用 NumPy 矩阵乘法一次算完，不需要 GPU 和网络。索引文件用 np.save 保存、以内存映射方式加载，
+多个 worker 共享同一份页缓存，启动时无需重新计算。语料变化后只对新增或修改的条目重新分词。
+重建在后台线程中进行，条目、向量和 IDF 构建完成后一次性替换，检索总是看到同一版本的三者。
+
+语料每行支持以下字段（括号内为兼容的别名）：
+    id (request_id)、question (title)、answer (body)
+"""
+import hashlib
+import json
+import os
+import tempfile
+import zlib
+from typing import BinaryIO, Callable, List, Optional, Tuple
+
+import numpy as np
+
+from response_cache import normalize_question
+
+FAQ_CORPUS_PATH = os.getenv("FAQ_CORPUS_PATH", "")
+FAQ_INDEX_DIR = os.getenv("FAQ_INDEX_DIR", "faq_index")
+FAQ_INDEX_DIM = int(os.getenv("FAQ_INDEX_DIM", "4096"))
+FAQ_REFRESH_INTERVAL = float(os.getenv("FAQ_REFRESH_INTERVAL", "60"))
+# 相似度不低于该值时直接用 FAQ 答案回复，不调用模型
+FAQ_ANSWER_THRESHOLD = float(os.getenv("FAQ_ANSWER_THRESHOLD", "0.8"))
+# 相似度不低于该值时把 FAQ 作为参考资料注入提示词
+FAQ_GROUNDING_THRESHOLD = float(os.getenv("FAQ_GROUNDING_THRESHOLD", "0.3"))
+
+NGRAM_SIZES = (1, 2, 3)
+
+
+def read_corpus(path: str) -> List[dict]:
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            question = item.get("question") or item.get("title") or ""
+            answer = item.get("answer") or item.get("body") or ""
+            if not question and not answer:
+                continue
+            entries.append({
+                "id": str(item.get("id") or item.get("request_id") or len(entries)),
+                "question": question,
+                "answer": answer,
+            })
+    return entries
+
+
+def entry_hash(entry: dict) -> str:
+    # 按实际参与分词的规范化文本取哈希，规范化规则变化后旧的词频行不会被误用
+    text = normalize_question(entry["question"] or entry["answer"])
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def term_frequencies(text: str, dim: int = FAQ_INDEX_DIM) -> np.ndarray:
+    """字符 n-gram 哈希特征，返回次线性缩放后的词频向量。"""
+    text = normalize_question(text)
+    buckets = [
+        zlib.crc32(text[i:i + n].encode("utf-8")) % dim
+        for n in NGRAM_SIZES
+        for i in range(len(text) - n + 1)
+    ]
+    tf = np.bincount(np.asarray(buckets, dtype=np.int64), minlength=dim).astype(np.float32)
+    nonzero = tf > 0
+    tf[nonzero] = 1.0 + np.log(tf[nonzero])
+    return tf
+
+
+def _replace_file(path: str, write: Callable[[BinaryIO], None]):
+    # 先写临时文件再原子替换，正在读取旧索引的 worker 不受影响。
+    # 临时文件名由 mkstemp 在同一目录下生成，多个 worker 同时重建时不会写到同一个临时文件
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _save_array(path: str, array: np.ndarray):
+    _replace_file(path, lambda f: np.save(f, array))
+
+
+def _save_arrays(path: str, **arrays: np.ndarray):
+    # 多个数组保存在同一个 .npz 中，一次原子替换，读取方不会拿到不配套的两个文件
+    _replace_file(path, lambda f: np.savez(f, **arrays))
+
+
+class FaqIndex:
+    def __init__(self, corpus_path: str = FAQ_CORPUS_PATH, index_dir: str = FAQ_INDEX_DIR,
+                 dim: int = FAQ_INDEX_DIM):
+        self.corpus_path = corpus_path
+        self.index_dir = index_dir
+        self.dim = dim
+        # (entries, vectors, idf)，由 load / build 整体替换
+        self._state: Optional[Tuple[List[dict], np.ndarray, np.ndarray]] = None
+        self.signature = None
+
+    @property
+    def entries(self) -> List[dict]:
+        return self._state[0] if self._state is not None else []
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+    def _corpus_signature(self) -> list:
+        stat = os.stat(self.corpus_path)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def load(self) -> bool:
+        """加载已有索引文件，索引不存在或与语料不一致时返回 False。"""
+        try:
+            with open(self._path("entries.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["dim"] != self.dim:
+                return False
+            # 向量文件按版本命名，entries.json 最后写入并指向与之配套的版本
+            version = meta["version"]
+            vectors = np.load(self._path(f"vectors-{version}.npy"), mmap_mode="r")
+            idf = np.load(self._path(f"idf-{version}.npy"))
+        except (OSError, ValueError, KeyError):
+            return False
+        if vectors.shape != (len(meta["entries"]), self.dim):
+            return False
+        self._state = (meta["entries"], vectors, idf)
+        self.signature = meta["signature"]
+        return self.signature == self._corpus_signature()
+
+    def refresh(self) -> bool:
+        """语料变化时增量重建索引，返回是否发生了重建。"""
+        if self._state is None and self.load():
+            return False
+        if self.signature == self._corpus_signature():
+            return False
+        self.build()
+        return True
+
+    def build(self):
+        signature = self._corpus_signature()
+        entries = read_corpus(self.corpus_path)
+        os.makedirs(self.index_dir, exist_ok=True)
+
+        # 复用未变化条目的词频行，只对新增或修改的问题重新分词。
+        # 行与条目哈希保存在同一个文件中，其他 worker 重写过该文件时也能按哈希对上
+        previous = {}
+        try:
+            with np.load(self._path("tf.npz")) as saved:
+                old_tf, hashes = saved["tf"], saved["hashes"]
+            if old_tf.shape[1] == self.dim and len(hashes) == len(old_tf):
+                previous = {str(digest): old_tf[i] for i, digest in enumerate(hashes)}
+        except (OSError, ValueError, KeyError):
+            pass
+
+        tf = np.zeros((len(entries), self.dim), dtype=np.float32)
+        for i, entry in enumerate(entries):
+            entry["hash"] = entry_hash(entry)
+            row = previous.get(entry["hash"])
+            tf[i] = row if row is not None else term_frequencies(entry["question"] or entry["answer"], self.dim)
+
+        document_frequency = np.count_nonzero(tf, axis=0)
+        idf = (np.log((1 + len(entries)) / (1 + document_frequency)) + 1).astype(np.float32)
+        vectors = tf * idf
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.maximum(norms, 1e-12)
+
+        hashes = np.array([entry["hash"] for entry in entries], dtype="U40")
+        _save_arrays(self._path("tf.npz"), tf=tf, hashes=hashes)
+        version = f"{signature[0]:x}-{signature[1]:x}"
+        _save_array(self._path(f"vectors-{version}.npy"), vectors)
+        _save_array(self._path(f"idf-{version}.npy"), idf)
+        meta = {"dim": self.dim, "signature": signature, "version": version, "entries": entries}
+        _replace_file(self._path("entries.json"),
+                      lambda f: f.write(json.dumps(meta, ensure_ascii=False).encode("utf-8")))
+        self._remove_old_versions(version)
+
+        # 三者一起替换，正在检索的线程仍使用旧的一组
+        self._state = (entries, np.load(self._path(f"vectors-{version}.npy"), mmap_mode="r"), idf)
+        self.signature = signature
+
+    def _remove_old_versions(self, version: str):
+        # 已映射旧文件的 worker 不受删除影响；刚读到旧 entries.json 的 worker 加载失败后会自行重建
+        current = {f"vectors-{version}.npy", f"idf-{version}.npy"}
+        for name in os.listdir(self.index_dir):
+            if name.startswith(("vectors-", "idf-")) and name.endswith(".npy") and name not in current:
+                try:
+                    os.remove(self._path(name))
+                except OSError:
+                    pass
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[float, dict]]:
+        """返回相似度最高的 k 条 (score, entry)，按相似度降序排列。"""
+        state = self._state
+        if state is None or not state[0]:
+            return []
+        entries, vectors, idf = state
+        vector = term_frequencies(query, self.dim) * idf
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return []
+        scores = vectors @ (vector / norm)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), entries[i]) for i in top]
+
+
+def render_grounding(matches: List[Tuple[float, dict]]) -> str:
+    """把中等置信度的检索结果渲染成注入提示词的参考资料。"""
+    lines = [f"问: {entry['question']}\n答: {entry['answer']}\n" for _, entry in matches]
+    return "参考资料（来自常见问题库，仅在相关时使用）:\n" + "".join(lines)
@@ -1,15 +1,48 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import uuid
+import json
+import os
 import time
 from datetime import datetime
 
+from chat_render import ChatHistoryView, style_injection
+from render_scheduler import RenderScheduler
+from sse import iter_events
+
+try:
+    import websocket  # websocket-client
+except ImportError:
+    websocket = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 # 后端API地址
 BACKEND_URL = "http://localhost:8000"
-
-# 自定义CSS样式（完全保留原始样式）
-st.markdown("""
-<style>
+WS_URL = BACKEND_URL.replace("http", "ws", 1)
+# 安装了 websocket-client 时默认通过一个 WebSocket 长连接收发消息，设为 http 则使用 HTTP 接口
+FRONTEND_TRANSPORT = os.getenv("FRONTEND_TRANSPORT", "websocket")
+USE_WEBSOCKET = websocket is not None and FRONTEND_TRANSPORT == "websocket"
+# 到后端的 HTTP 连接池大小，同一进程内的所有页面共享
+FRONTEND_POOL_SIZE = int(os.getenv("FRONTEND_POOL_SIZE", "32"))
+# 同步接口的响应格式：json（默认，安装了 orjson 时用它解码）或 msgpack（需要 pip install msgpack）
+FRONTEND_WIRE_FORMAT = os.getenv("FRONTEND_WIRE_FORMAT", "json")
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+USE_MSGPACK = msgpack is not None and FRONTEND_WIRE_FORMAT == "msgpack"
+SYNC_ACCEPT = f"{MSGPACK_MEDIA_TYPE}, application/json;q=0.9" if USE_MSGPACK else "application/json"
+
+# 自定义CSS样式（完全保留原始样式）：每个页面会话只在第一次运行时发送，插入 document.head 后不随重新运行移除
+if "page_style_sent" not in st.session_state:
+    st.html(style_injection("""
 /* 用户消息容器 - 右侧 */
 .user-message-container {
     display: flex;
@@ -93,8 +126,27 @@ st.markdown("""
     66% { content: '...'; }
     100% { content: '.'; }
 }
-</style>
-""", unsafe_allow_html=True)
+"""), unsafe_allow_javascript=True)
+    st.session_state.page_style_sent = True
+
+
+@st.cache_resource
+def backend_client():
+    """进程内共享的后端 HTTP 客户端，保持 Keep-Alive，所有页面和每次重新运行复用同一个连接池。"""
+    client = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=FRONTEND_POOL_SIZE)
+    client.mount("http://", adapter)
+    client.mount("https://", adapter)
+    return client
+
+
+def response_data(response):
+    # 后端按 Accept 协商格式，以响应的 Content-Type 为准解码
+    if msgpack is not None and response.headers.get("Content-Type", "").startswith(MSGPACK_MEDIA_TYPE):
+        return msgpack.unpackb(response.content)
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
 
 
 # 初始化会话
@@ -103,54 +155,197 @@ def init_session():
         session_id = str(uuid.uuid4())
         st.session_state.session_id = session_id
 
-        # 初始化后端会话
-        response = requests.post(
-            f"{BACKEND_URL}/init_session",
-            json={"session_id": session_id}
-        )
+        if USE_WEBSOCKET:
+            # 建立连接时后端自动创建会话
+            get_socket()
+            return
 
-        if response.status_code == 200:
-            st.toast('会话已初始化', icon='✅')
-        else:
-            st.error("会话初始化失败")
+        # 后端会话由第一次 bootstrap 请求创建
+        st.toast('会话已初始化', icon='✅')
 
 
-# 获取对话历史
-def get_conversation():
-    session_id = st.session_state.session_id
-    response = requests.get(f"{BACKEND_URL}/get_conversation/{session_id}")
-    if response.status_code == 200:
-        return response.json()
-    return []
+def new_conversation_cache():
+    return {
+        "messages": [],
+        "state": {"is_responding": False, "prompt_to_process": None},
+        "etag": None
+    }
 
 
-# 获取会话状态
-def get_session_state():
+# 同步对话历史和会话状态：本地缓存已有的消息，每次只拉取新增部分；
+# 会话不存在（首次加载或长时间空闲后被后端淘汰）时 bootstrap 接口会以同一个 session_id 创建
+def sync_session():
     session_id = st.session_state.session_id
-    response = requests.get(f"{BACKEND_URL}/get_session_state/{session_id}")
+    if "conversation_cache" not in st.session_state:
+        st.session_state.conversation_cache = new_conversation_cache()
+    cache = st.session_state.conversation_cache
+
+    headers = {"Accept": SYNC_ACCEPT}
+    if cache["etag"]:
+        headers["If-None-Match"] = cache["etag"]
+    response = backend_client().get(
+        f"{BACKEND_URL}/bootstrap/{session_id}",
+        params={"since": len(cache["messages"])},
+        headers=headers
+    )
     if response.status_code == 200:
-        return response.json()
-    return {"is_responding": False, "prompt_to_process": None}
+        data = response_data(response)
+        if data["length"] < len(cache["messages"]):
+            # 后端的会话比本地缓存短（会话被重新创建），丢弃缓存重新同步
+            st.session_state.conversation_cache = new_conversation_cache()
+            return sync_session()
+        cache["messages"].extend(data["messages"])
+        cache["state"] = data["state"]
+        cache["etag"] = response.headers.get("ETag")
+    elif response.status_code != 304:
+        st.error("会话同步失败")
+    # 304 时直接使用本地缓存
+    return cache["messages"], cache["state"]
+
+
+def apply_messages(cache, messages):
+    # 按序号合并新消息，序号不连续（会话被重新创建）时丢弃重叠部分
+    if messages:
+        del cache["messages"][messages[0]["seq"] - 1:]
+        cache["messages"].extend(messages)
+
+
+# WebSocket 连接保存在 st.session_state 中，页面重新运行时复用同一个连接
+def get_socket():
+    if "conversation_cache" not in st.session_state:
+        st.session_state.conversation_cache = new_conversation_cache()
+    socket = st.session_state.get("chat_socket")
+    if socket is not None and socket.connected:
+        return socket
+
+    cache = st.session_state.conversation_cache
+    socket = websocket.create_connection(
+        f"{WS_URL}/ws/{st.session_state.session_id}?since={len(cache['messages'])}",
+        timeout=300
+    )
+    st.session_state.chat_socket = socket
+    st.session_state.ws_generating = False
+    # 建立连接后后端立即推送一次状态和缺失的消息
+    receive_frame(socket)
+    return socket
+
+
+def close_socket():
+    socket = st.session_state.pop("chat_socket", None)
+    if socket is not None:
+        socket.close()
+
+
+def receive_frame(socket):
+    frame = json.loads(socket.recv())
+    if frame["type"] == "sync":
+        cache = st.session_state.conversation_cache
+        apply_messages(cache, frame["messages"])
+        cache["state"] = frame["state"]
+    return frame
+
+
+def send_request(payload):
+    # 连接可能已被后端因空闲关闭，失败时重连一次
+    try:
+        socket = get_socket()
+        socket.send(json.dumps(payload, ensure_ascii=False))
+        return socket
+    except (websocket.WebSocketException, OSError):
+        close_socket()
+    socket = get_socket()
+    socket.send(json.dumps(payload, ensure_ascii=False))
+    return socket
+
+
+def ws_sync_session():
+    # 状态变化都由后端通过连接推送，无需轮询
+    get_socket()
+    cache = st.session_state.conversation_cache
+    return cache["messages"], cache["state"]
+
+
+def ws_add_user_message(prompt):
+    """发送用户消息，后端收到后立即开始生成，直到收到包含该消息的同步帧。"""
+    try:
+        socket = send_request({"type": "message", "content_text": prompt})
+        while True:
+            frame = receive_frame(socket)
+            if frame["type"] == "sync":
+                st.session_state.ws_generating = True
+                return True
+            if frame["type"] == "error":
+                st.error(frame["message"])
+                return False
+    except (websocket.WebSocketException, OSError):
+        close_socket()
+        return False
+
+
+def ws_stream_ai_response():
+    """与 stream_ai_response 相同，逐个产出 (event, data)。"""
+    try:
+        if st.session_state.get("ws_generating"):
+            socket = get_socket()
+        else:
+            # 连接是新建立的，请求后端处理会话中待回答的问题
+            socket = send_request({"type": "generate"})
+        st.session_state.ws_generating = False
+        while True:
+            frame = receive_frame(socket)
+            if frame["type"] == "token":
+                yield None, {"token": frame["token"]}
+            elif frame["type"] in ("done", "error"):
+                yield frame["type"], frame
+                return
+    except (websocket.WebSocketException, OSError):
+        close_socket()
+        yield "error", {"message": "与服务器的连接已断开，正在重连...", "retry_after": 1}
 
 
 # 添加用户消息
 def add_user_message(prompt):
     session_id = st.session_state.session_id
-    response = requests.post(
+    response = backend_client().post(
         f"{BACKEND_URL}/add_user_message",
         json={"session_id": session_id, "content_text": prompt}
     )
+    if response.status_code == 503:
+        # 后端生成队列已满，消息未被接收
+        st.warning("当前咨询人数较多，请稍后再发送...")
     return response.status_code == 200
 
 
-# 处理AI响应
-def process_ai_response():
+# 停止当前回答（按钮回调，在页面重新运行之前执行），已生成的部分由后端保存
+def cancel_generation():
+    backend_client().post(f"{BACKEND_URL}/cancel/{st.session_state.session_id}")
+    if USE_WEBSOCKET:
+        # 丢弃连接上尚未读取的帧，重新运行时建立新连接
+        close_socket()
+
+
+# 流式获取AI响应（Server-Sent Events）
+def stream_ai_response():
+    """逐个产出 (event, data)，event 为 None 时 data 中包含新的 token。"""
     session_id = st.session_state.session_id
-    response = requests.post(
-        f"{BACKEND_URL}/process_ai_response",
-        json={"session_id": session_id}
-    )
-    return response
+    with backend_client().get(
+        f"{BACKEND_URL}/stream_ai_response/{session_id}",
+        stream=True,
+        headers={"Accept": "text/event-stream"}
+    ) as response:
+        if response.status_code == 503:
+            # 后端排队已满，按 Retry-After 稍后重试
+            yield "error", {
+                "message": "当前咨询人数较多，请稍候...",
+                "retry_after": float(response.headers.get("Retry-After", 1))
+            }
+            return
+        if response.status_code != 200:
+            yield "error", {"message": "处理AI响应时出错", "retry_after": 1}
+            return
+
+        for event in iter_events(response.iter_content(chunk_size=None)):
+            yield (None if event.event == "message" else event.event), event.json()
 
 
 # 主应用
@@ -169,9 +364,11 @@ def main():
     # 创建对话区域容器
     chat_container = st.container(border=True)
 
+    # 拉取新消息和会话状态（HTTP 没有变化时后端返回 304，WebSocket 由后端推送）
+    conversation, session_state = ws_sync_session() if USE_WEBSOCKET else sync_session()
+
     # 显示对话历史
     with chat_container:
-        conversation = get_conversation()
 
         # 初始问候语
         if not conversation:
@@ -185,29 +382,16 @@ def main():
                 </div>
             """.format(datetime.now().strftime('%H:%M:%S')), unsafe_allow_html=True)
 
-        # 显示对话历史
-        for msg in conversation:
-            if msg["sender"] == "ai":
-                st.markdown(f"""
-                    <div class="ai-message-container">
-                        <div class="avatar ai-avatar">🤖</div>
-                        <div class="ai-message">
-                            <div class="status-title completed">【已深度思考】</div>
-                            {msg["message"]}
-                            <div class="message-timestamp">{msg['timestamp']} | AI助手</div>
-                        </div>
-                    </div>
-                """, unsafe_allow_html=True)
-            elif msg["sender"] == "user":
-                st.markdown(f"""
-                    <div class="user-message-container">
-                        <div class="user-message">
-                            {msg["message"]}
-                            <div class="message-timestamp">{msg['timestamp']} | 您</div>
-                        </div>
-                        <div class="avatar user-avatar">👤</div>
-                    </div>
-                """, unsafe_allow_html=True)
+        # 显示对话历史：已完成的消息按块缓存 HTML，只渲染新增的消息，较早的消息点击后才显示
+        if "history_view" not in st.session_state:
+            st.session_state.history_view = ChatHistoryView()
+        history_view = st.session_state.history_view
+        hidden, blocks = history_view.blocks(conversation)
+        if hidden:
+            st.button(f"显示更早的消息（还有 {hidden} 条）", key="show_earlier",
+                      on_click=history_view.show_earlier)
+        for block in blocks:
+            st.markdown(block, unsafe_allow_html=True)
 
         # 滚动到底部
         st.markdown('<div id="endofchat"></div>', unsafe_allow_html=True)
@@ -219,9 +403,6 @@ def main():
 
     st.divider()
 
-    # 获取会话状态
-    session_state = get_session_state()
-
     # 用户输入区域
     prompt = st.chat_input(
         "请输入您的问题...",
@@ -231,7 +412,7 @@ def main():
 
     if prompt and not session_state["is_responding"]:
         # 添加用户消息到后端
-        if add_user_message(prompt):
+        if ws_add_user_message(prompt) if USE_WEBSOCKET else add_user_message(prompt):
             st.rerun()
 
     # 处理AI响应
@@ -257,50 +438,49 @@ def main():
                 ),
                 unsafe_allow_html=True
             )
-
-        # 处理AI响应
-        response = process_ai_response()
-
-        # 获取并显示AI回复
-        if response.status_code == 200:
-            result = response.json()
-            if result["status"] == "success":
-                # 获取完整的对话历史（包含新回复）
-                conversation = get_conversation()
-                ai_message = conversation[-1]["message"]
-
-                # 模拟流式输出效果
-                display_message = ""
-                for char in ai_message:
-                    display_message += char
-                    time.sleep(0.02)  # 控制输出速度
-                    ai_response_placeholder.markdown(
-                        response_html.format(
-                            display_message.replace('\n', '<br>'),
-                            timestamp
-                        ),
-                        unsafe_allow_html=True
-                    )
-
-                # 更新为最终状态
-                final_html = response_html.format(
-                    ai_message.replace('\n', '<br>'),
-                    timestamp
-                ).replace("thinking", "completed").replace("【深度思考中】", "【已深度思考】")
-                ai_response_placeholder.markdown(final_html, unsafe_allow_html=True)
-
-                # 滚动到底部
-                st.markdown('<div id="endofchat_after_response"></div>', unsafe_allow_html=True)
-                st.markdown("""
-                    <script>
-                        document.getElementById("endofchat_after_response").scrollIntoView({ behavior: "smooth" });
-                    </script>
-                """, unsafe_allow_html=True)
-
-                # 显示完成提示
+            st.button("停止生成", key="stop_generation", on_click=cancel_generation)
+
+        def render_bubble(text, final):
+            html = response_html.format(text.replace('\n', '<br>'), timestamp)
+            if final:
+                html = html.replace("thinking", "completed").replace("【深度思考中】", "【已深度思考】")
+            ai_response_placeholder.markdown(html, unsafe_allow_html=True)
+            return html
+
+        # 实时显示上游返回的 token：按帧率或句子结束时合并渲染，而不是每个 token 重发整段 HTML
+        scheduler = RenderScheduler(render_bubble)
+        status = None
+        result = {}
+        events = ws_stream_ai_response() if USE_WEBSOCKET else stream_ai_response()
+        for event, data in events:
+            if event is None:
+                scheduler.push(data["token"])
+            else:
+                status = event
+                result = data
+                break
+
+        if status == "done":
+            # 更新为最终状态（包括最后一批尚未渲染的 token）
+            scheduler.close()
+
+            # 滚动到底部
+            st.markdown('<div id="endofchat_after_response"></div>', unsafe_allow_html=True)
+            st.markdown("""
+                <script>
+                    document.getElementById("endofchat_after_response").scrollIntoView({ behavior: "smooth" });
+                </script>
+            """, unsafe_allow_html=True)
+
+            # 显示完成提示
+            if result.get("status") == "cancelled":
+                st.toast('已停止生成', icon='🤖')
+            else:
                 st.toast('小文思考完成啦！希望您满意！', icon='🤖')
         else:
-            st.error("处理AI响应时出错")
+            st.error(result.get("message", "处理AI响应时出错"))
+            # 避免在后端繁忙时立即重试
+            time.sleep(result.get("retry_after", 0))
 
         st.rerun()
 
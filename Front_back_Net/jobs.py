@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+from admission import ADMISSION_MAX_CONCURRENT, JobQueue
+from coalescer import Flight
+from metrics import ADMISSION_WAIT, GENERATIONS_CANCELLED
+
+logger = logging.getLogger(__name__)
+
+# 任务完成后保留结果的秒数，期间重新连接的客户端可以回放完整的 token 流
+GENERATION_JOB_RETENTION = float(os.getenv("GENERATION_JOB_RETENTION", "60"))
+# 所有订阅者断开后等待重新订阅的秒数（Streamlit 重新运行页面时会短暂断开），超时则取消生成
+GENERATION_ABANDON_GRACE = float(os.getenv("GENERATION_ABANDON_GRACE", "2"))
+# 多个 worker 进程共享会话存储时，跟随其他进程的生成、传递取消请求时轮询会话状态的间隔
+GENERATION_POLL_INTERVAL = float(os.getenv("GENERATION_POLL_INTERVAL", "0.2"))
+# 等待其他进程停止生成并写回部分回答的上限
+GENERATION_REMOTE_CANCEL_TIMEOUT = float(os.getenv("GENERATION_REMOTE_CANCEL_TIMEOUT", "10"))
+
+
+class GenerationCancelled(Exception):
+    """生成任务被取消，reason 为 client（主动取消）、disconnect（客户端断开）或 superseded（发送了新问题）。"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"生成已取消: {reason}")
+        self.reason = reason
+
+
+class GenerationJob(Flight):
+    """一个会话待回答问题的生成任务，worker 把 token 发布给任意数量的订阅者。"""
+
+    def __init__(self, session_id: str, prompt: str):
+        super().__init__()
+        self.session_id = session_id
+        self.prompt = prompt
+        self.finished_at: Optional[float] = None
+        # worker 开始执行后才有 task；排队期间被取消时为 discard 的 task
+        self.task: Optional[asyncio.Task] = None
+        self.cancel_reason: Optional[str] = None
+        # 提交者把问题写入会话后置位，worker 等到置位后才执行，避免读到写入之前的会话状态
+        self.ready = asyncio.Event()
+
+    def finish(self, error: Optional[BaseException] = None):
+        super().finish(error)
+        self.finished_at = time.monotonic()
+
+    @property
+    def result(self) -> str:
+        return "".join(self.tokens)
+
+
+class JobManager:
+    """生成任务与 HTTP 请求解耦：提交到有界队列，由固定数量的 worker 协程执行。
+
+    每个会话同时最多一个未完成的任务。run(job) 负责生成并把结果写回会话，被取消时保存已生成的部分；
+    还在排队时被取消的任务不会执行，改为在新的 task 中执行 discard(job) 结束本轮对话，cancel 会等待它完成；
+    客户端短暂断开不会中断任务，之后可以重新订阅，或通过 get_session_state / sync_session 读取结果。
+    订阅过的客户端全部断开并超过 abandon_grace 秒没有重新订阅时取消任务。
+    """
+
+    def __init__(self, run: Callable[[GenerationJob], Awaitable[None]],
+                 discard: Optional[Callable[[GenerationJob], Awaitable[None]]] = None,
+                 workers: int = ADMISSION_MAX_CONCURRENT,
+                 queue: Optional[JobQueue] = None,
+                 retention: float = GENERATION_JOB_RETENTION,
+                 abandon_grace: float = GENERATION_ABANDON_GRACE):
+        self.run = run
+        self.discard = discard
+        self.workers = workers
+        self.queue: JobQueue = queue or JobQueue(observe_wait=ADMISSION_WAIT.observe)
+        self.retention = retention
+        self.abandon_grace = abandon_grace
+        self.jobs: Dict[str, GenerationJob] = {}
+        self._finished: Deque[GenerationJob] = deque()
+        self._tasks: List[asyncio.Task] = []
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled: Dict[str, int] = {}
+
+    def get(self, session_id: str) -> Optional[GenerationJob]:
+        """会话未完成的任务，或在保留期内刚完成的任务。"""
+        self._prune()
+        return self.jobs.get(session_id)
+
+    def submit(self, session_id: str, prompt: str, ready: bool = True) -> Optional[GenerationJob]:
+        """提交新任务；会话已有未完成的任务时返回 None，队列已满时抛出 Overloaded。
+
+        ready 为 False 时提交者写入问题后需要调用 job.ready.set()，worker 才会开始执行。
+        """
+        job = self.get(session_id)
+        if job is not None and not job.done:
+            return None
+        job = GenerationJob(session_id, prompt)
+        if ready:
+            job.ready.set()
+        self.queue.put(job)
+        job.on_abandoned = lambda: self._abandoned(job)
+        self.jobs[session_id] = job
+        return job
+
+    def _cancel(self, job: GenerationJob, reason: str) -> bool:
+        if job.done or (job.task is not None and job.task.done()):
+            return False
+        job.cancel_reason = reason
+        self.cancelled[reason] = self.cancelled.get(reason, 0) + 1
+        GENERATIONS_CANCELLED.inc(reason)
+        if job.task is None:
+            # 还在排队，worker 取出后直接跳过
+            job.finish(GenerationCancelled(reason))
+            job.ready.set()
+            self._finished.append(job)
+            if self.discard is not None:
+                job.task = asyncio.create_task(self.discard(job))
+        else:
+            job.task.cancel()
+        return True
+
+    async def cancel(self, session_id: str, reason: str = "client") -> Optional[GenerationJob]:
+        """取消会话未完成的任务并等待它保存部分回答，没有未完成的任务时返回 None。"""
+        job = self.get(session_id)
+        if job is None or not self._cancel(job, reason):
+            return None
+        if job.task is not None:
+            await asyncio.wait({job.task})
+            self._settle(job)
+        return job
+
+    def _abandoned(self, job: GenerationJob):
+        asyncio.get_running_loop().call_later(self.abandon_grace, self._reap, job)
+
+    def _reap(self, job: GenerationJob):
+        if job.subscribers == 0 and not job.done:
+            self._cancel(job, "disconnect")
+
+    def _prune(self):
+        # 按完成顺序清理超出保留期的任务
+        deadline = time.monotonic() - self.retention
+        while self._finished and self._finished[0].finished_at <= deadline:
+            job = self._finished.popleft()
+            if self.jobs.get(job.session_id) is job:
+                del self.jobs[job.session_id]
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        # 停止时取消正在执行的任务，等它们保存部分回答后再返回
+        running = [job.task for job in self.jobs.values() if job.task is not None and not job.task.done()]
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, *running, return_exceptions=True)
+        self._tasks = []
+
+    def _settle(self, job: GenerationJob):
+        # run 正常结束时已经 finish，这里处理异常退出和被取消的任务
+        if job.done:
+            return
+        task = job.task
+        if task.done() and not task.cancelled() and task.exception() is not None:
+            logger.error("会话 %s 的生成任务失败", job.session_id, exc_info=task.exception())
+            job.finish(task.exception())
+        else:
+            job.finish(GenerationCancelled(job.cancel_reason or "shutdown"))
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            await job.ready.wait()
+            if job.done:
+                # 排队期间已被取消
+                continue
+            # 每个任务在独立的 task 中执行，取消任务不会取消 worker
+            job.task = asyncio.create_task(self.run(job))
+            self.running += 1
+            try:
+                await asyncio.wait({job.task})
+            finally:
+                self.running -= 1
+                if not job.task.done():
+                    # worker 本身被停止
+                    job.task.cancel()
+                self._settle(job)
+                if job.error is None:
+                    self.completed += 1
+                elif not isinstance(job.error, GenerationCancelled):
+                    self.failed += 1
+                self._finished.append(job)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "jobs": len(self.jobs),
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": dict(self.cancelled),
+            **self.queue.stats(),
+        }
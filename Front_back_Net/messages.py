@@ -0,0 +1,125 @@
+import json
+import sys
+import time
+from enum import IntEnum
+from functools import lru_cache
+from typing import Iterable, List, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_dumps = json.JSONEncoder(ensure_ascii=False).encode
+
+
+class Sender(IntEnum):
+    USER = 0
+    AI = 1
+
+    @property
+    def label(self) -> str:
+        return _LABELS[self]
+
+    @classmethod
+    def parse(cls, value: Union["Sender", int, str]) -> "Sender":
+        if isinstance(value, str):
+            return _BY_LABEL[value]
+        return cls(value)
+
+
+# 对外接口中使用的角色字符串，全部驻留，所有消息共享同一个对象
+_LABELS = {Sender.USER: sys.intern("user"), Sender.AI: sys.intern("ai")}
+_BY_LABEL = {label: sender for sender, label in _LABELS.items()}
+_SENDER_JSON = {sender: _dumps(label) for sender, label in _LABELS.items()}
+
+
+@lru_cache(maxsize=4096)
+def format_timestamp(timestamp: int) -> str:
+    # 同一秒内的消息很多，格式化结果按秒缓存
+    return time.strftime("%H:%M:%S", time.localtime(timestamp))
+
+
+def parse_timestamp(value: Union[int, str]) -> int:
+    """兼容旧数据中的 "HH:MM:SS" 字符串，按当天日期换算成时间戳。"""
+    if isinstance(value, int):
+        return value
+    if value.isdigit():
+        return int(value)
+    hours, minutes, seconds = (int(part) for part in value.split(":"))
+    today = time.localtime()
+    return int(time.mktime((today.tm_year, today.tm_mon, today.tm_mday,
+                            hours, minutes, seconds, 0, 0, -1)))
+
+
+class Message:
+    """一条对话消息。sender 为枚举，timestamp 为整数秒，只在序列化时格式化。"""
+
+    __slots__ = ("sender", "message", "timestamp")
+
+    def __init__(self, sender: Union[Sender, str], message: str, timestamp: int = None):
+        self.sender = Sender.parse(sender)
+        self.message = message
+        self.timestamp = int(time.time()) if timestamp is None else timestamp
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Message):
+            return NotImplemented
+        return (self.sender, self.message, self.timestamp) == (other.sender, other.message, other.timestamp)
+
+    def __repr__(self) -> str:
+        return f"Message({self.sender.label!r}, {self.message!r}, {self.timestamp})"
+
+    def to_dict(self) -> dict:
+        """接口返回的格式：{"sender": "user" | "ai", "message": str, "timestamp": "HH:MM:SS"}。"""
+        return {
+            "sender": self.sender.label,
+            "message": self.message,
+            "timestamp": format_timestamp(self.timestamp),
+        }
+
+    def to_json(self) -> str:
+        return _dumps([int(self.sender), self.timestamp, self.message])
+
+    @classmethod
+    def from_json(cls, data: str) -> "Message":
+        """解析 to_json 的紧凑格式，也兼容旧版本写入的完整字典。"""
+        value = json.loads(data)
+        if isinstance(value, dict):
+            return cls(value["sender"], value["message"], parse_timestamp(value["timestamp"]))
+        sender, timestamp, message = value
+        return cls(sender, message, timestamp)
+
+    def size(self) -> int:
+        """近似内存占用，枚举和驻留的角色字符串为共享对象，不计入。"""
+        return sys.getsizeof(self) + sys.getsizeof(self.message) + sys.getsizeof(self.timestamp)
+
+
+def render_conversation(messages: Iterable[Message], first_seq: int = 1) -> str:
+    """直接拼接 JSON 数组，跳过逐条构造字典和通用编码器的开销。
+
+    每条消息附带序号 seq，first_seq 为第一条消息的序号。
+    """
+    parts: List[str] = [
+        '{"seq":' + str(seq)
+        + ',"sender":' + _SENDER_JSON[m.sender]
+        + ',"message":' + _dumps(m.message)
+        + ',"timestamp":"' + format_timestamp(m.timestamp) + '"}'
+        for seq, m in enumerate(messages, first_seq)
+    ]
+    return "[" + ",".join(parts) + "]"
+
+
+def conversation_dicts(messages: Iterable[Message], first_seq: int = 1) -> List[dict]:
+    """带序号 seq 的消息字典列表，用于 orjson 和 MessagePack 编码。"""
+    return [
+        {"seq": seq, "sender": m.sender.label, "message": m.message, "timestamp": format_timestamp(m.timestamp)}
+        for seq, m in enumerate(messages, first_seq)
+    ]
+
+
+def serialize_conversation(messages: Iterable[Message], first_seq: int = 1) -> bytes:
+    # orjson 构造字典再编码也比逐条拼接快，没有安装时退回 render_conversation
+    if orjson is not None:
+        return orjson.dumps(conversation_dicts(messages, first_seq))
+    return render_conversation(messages, first_seq).encode("utf-8")
@@ -0,0 +1,227 @@
+"""轻量的 Prometheus 文本格式指标。
+
+热路径上只做字典/列表的加法，不加锁（所有更新都在事件循环线程中进行）；
+会话数、缓存命中等状态类指标在抓取时通过回调读取，平时没有任何开销。
+每个 worker 进程各自维护一份指标，多 worker 部署时请分别抓取或在前面聚合。
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 秒级延迟的默认分桶，覆盖从缓存命中到长回答生成的范围
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RATE_BUCKETS = (1, 5, 10, 20, 40, 80, 160, 320)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values: Dict[Tuple[str, ...], float] = defaultdict(float)
+        if not labelnames:
+            self.values[()] = 0.0
+
+    def inc(self, *labelvalues: str, amount: float = 1.0):
+        self.values[labelvalues] += amount
+
+    def collect(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labelvalues, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"
+
+
+class Gauge:
+    """抓取时调用 callback 取值；callback 返回 None 时不输出该指标。
+
+    指定 labelnames 时 callback 返回 {标签值元组: 值} 字典。
+    """
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], Optional[float]],
+                 labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelnames = labelnames
+
+    def collect(self) -> Iterable[str]:
+        value = self.callback()
+        if value is None:
+            return
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        if not self.labelnames:
+            yield f"{self.name} {_format_value(value)}"
+            return
+        for labelvalues, labeled in value.items():
+            if labeled is not None:
+                yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(labeled)}"
+
+
+class CallbackCounter(Gauge):
+    """由其他组件自行累加的计数器，在抓取时读取。"""
+
+    def collect(self) -> Iterable[str]:
+        value = self.callback()
+        if value is None:
+            return
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        yield f"{self.name} {_format_value(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        # 最后一个位置对应 +Inf
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def collect(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            yield f'{self.name}_bucket{{le="{_format_value(bound)}"}} {cumulative}'
+        yield f"{self.name}_sum {_format_value(self.sum)}"
+        yield f"{self.name}_count {self.count}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str, callback: Callable[[], Optional[float]],
+              labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, callback, labelnames))
+
+    def callback_counter(self, name: str, documentation: str,
+                         callback: Callable[[], Optional[float]]) -> CallbackCounter:
+        return self.register(CallbackCounter(name, documentation, callback))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    "chat_requests_total", "HTTP requests by endpoint and status code", ("endpoint", "status")
+))
+UPSTREAM_TTFT = REGISTRY.register(Histogram(
+    "chat_upstream_time_to_first_token_seconds", "Time from upstream request to first token"
+))
+UPSTREAM_DURATION = REGISTRY.register(Histogram(
+    "chat_upstream_generation_seconds", "Total upstream generation time"
+))
+UPSTREAM_TOKEN_RATE = REGISTRY.register(Histogram(
+    "chat_upstream_tokens_per_second", "Upstream streaming rate after the first token", RATE_BUCKETS
+))
+UPSTREAM_ERRORS = REGISTRY.register(Counter(
+    "chat_upstream_errors_total", "Failed upstream generations"
+))
+SSE_PARSE_ERRORS = REGISTRY.register(Counter(
+    "chat_sse_parse_errors_total", "Upstream SSE data lines skipped because they were not valid JSON"
+))
+ADMISSION_WAIT = REGISTRY.register(Histogram(
+    "chat_admission_wait_seconds", "Time generation jobs wait in the queue for a worker"
+))
+UPSTREAM_RETRIES = REGISTRY.register(Counter(
+    "chat_upstream_retries_total", "Upstream requests retried before the first token"
+))
+UPSTREAM_HEDGES = REGISTRY.register(Counter(
+    "chat_upstream_hedges_total", "Hedged upstream requests started after the p95 first-token delay"
+))
+UPSTREAM_HEDGE_WINS = REGISTRY.register(Counter(
+    "chat_upstream_hedge_wins_total", "Hedged upstream requests that produced the first token first"
+))
+BREAKER_TRANSITIONS = REGISTRY.register(Counter(
+    "chat_upstream_breaker_transitions_total", "Circuit breaker state changes", ("upstream", "state")
+))
+BREAKER_REJECTED = REGISTRY.register(Counter(
+    "chat_upstream_breaker_rejected_total", "Requests failed fast by an open circuit breaker", ("upstream",)
+))
+ROUTER_SELECTIONS = REGISTRY.register(Counter(
+    "chat_router_selections_total", "Generations routed to each provider", ("provider", "kind")
+))
+ROUTER_FAILOVERS = REGISTRY.register(Counter(
+    "chat_router_failovers_total", "Generations moved to another provider before the first token", ("provider",)
+))
+SESSIONS_EVICTED = REGISTRY.register(Counter(
+    "chat_sessions_evicted_total", "Sessions removed from the session store by reason", ("reason",)
+))
+GENERATIONS_CANCELLED = REGISTRY.register(Counter(
+    "chat_generations_cancelled_total", "Generations cancelled by reason (client, disconnect, superseded)", ("reason",)
+))
+CANCEL_SAVED_TOKENS = REGISTRY.register(Counter(
+    "chat_cancel_saved_tokens_total",
+    "Estimated upstream tokens not generated because a generation was cancelled"
+))
+RESPONSE_BYTES = REGISTRY.register(Counter(
+    "chat_response_body_bytes_total",
+    "Bytes of non-streaming response bodies sent, by content encoding (identity, gzip, br)", ("encoding",)
+))
+COMPRESSION_SAVED_BYTES = REGISTRY.register(Counter(
+    "chat_response_compression_saved_bytes_total", "Response body bytes saved by compression"
+))
+JOURNAL_COMMIT_SECONDS = REGISTRY.register(Histogram(
+    "chat_session_journal_commit_seconds", "Time to write (and fsync) one session journal group commit"
+))
+JOURNAL_RECORDS = REGISTRY.register(Counter(
+    "chat_session_journal_records_total", "Session changes written to the journal"
+))
+
+
+class RequestMetricsMiddleware:
+    """纯 ASGI 中间件，按路由模板和状态码统计请求数。"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = ["500"]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            REQUESTS.inc(route.path if route is not None else "unmatched", status[0])
@@ -0,0 +1,31 @@
+"""提示词上下文构建。
+
+每个会话只保存一份已渲染的对话历史文本，新消息到达时追加一行，
+发送给上游时再拼上固定不变的系统提示前缀。这样每轮的构建开销与历史长度无关，
+并且每次请求都以完全相同的前缀开头，支持前缀缓存的上游（如 DeepSeek 上下文缓存）可以直接命中。
+"""
+
+SYSTEM_PROMPT = (
+    "你是文华财经公司的客服助手小文，请以专业、友好的态度回答用户问题。"
+    "回答要简洁明了，专注于提供市场信息、数据分析和操作指导。"
+    "如果用户咨询购买问题，请明确提供400客服电话方便用户转人工服务。"
+    "保持上下文逻辑关联，确保回答准确、专业。"
+)
+
+# 固定的系统提示前缀，任何情况下都不要在其中插入时间戳等会变化的内容
+SYSTEM_PREFIX = f"系统设定: {SYSTEM_PROMPT}\n"
+
+ROLE_LABELS = {"user": "用户", "ai": "AI"}
+
+
+def render_turn(sender: str, message: str) -> str:
+    """渲染一条消息，未知角色返回空字符串。"""
+    label = ROLE_LABELS.get(sender)
+    if label is None:
+        return ""
+    return f"{label}: {message}\n"
+
+
+def build_prompt(history: str) -> str:
+    """把已渲染的对话历史拼接到系统提示前缀之后。"""
+    return SYSTEM_PREFIX + history
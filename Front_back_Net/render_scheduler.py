@@ -0,0 +1,75 @@
+"""流式回答的节流渲染，Streamlit 前端和独立版 Xiaowen 共用。
+
+每次 placeholder.markdown 都会把整段 HTML 重新发送给浏览器，逐 token 渲染时发送量与回答长度成平方关系。
+RenderScheduler 先把 token 攒起来，按固定帧率或在句子结束时刷新一次，结束时保证最后一次刷新。
+本模块不依赖 streamlit 和同目录下的其他模块，可以作为 Front_back_Net.render_scheduler 导入。
+"""
+import os
+import time
+from typing import Callable, List, Optional
+
+# 每秒最多刷新的次数
+STREAM_RENDER_FPS = float(os.getenv("STREAM_RENDER_FPS", "10"))
+# 句子结束时提前刷新，但两次刷新之间至少间隔这么久（秒）
+STREAM_RENDER_BOUNDARY_INTERVAL = float(os.getenv("STREAM_RENDER_BOUNDARY_INTERVAL", "0.05"))
+SENTENCE_BOUNDARIES = ("\n", "。", "！", "？", "；")
+
+
+class RenderScheduler:
+    """合并增量 token，按帧率或句子边界调用 render(完整文本, 是否最终)。
+
+    render 返回实际发送的内容（用于统计发送量），可以返回 None。
+    生成结束后调用 close()，无论最后是否还有未刷新的 token 都会以 final=True 渲染一次。
+    """
+
+    def __init__(self, render: Callable[[str, bool], Optional[str]],
+                 fps: float = STREAM_RENDER_FPS,
+                 boundary_interval: float = STREAM_RENDER_BOUNDARY_INTERVAL,
+                 clock: Callable[[], float] = time.monotonic):
+        self.render = render
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.boundary_interval = boundary_interval
+        self.clock = clock
+        self.text = ""
+        self._pending: List[str] = []
+        self._last_flush = clock()
+        self.closed = False
+        # 统计：刷新次数、累计发送字节数、渲染耗时
+        self.frames = 0
+        self.bytes_sent = 0
+        self.render_seconds = 0.0
+
+    @property
+    def received(self) -> str:
+        """已收到的全部文本（包括尚未渲染的 token），不触发渲染。"""
+        return self.text + "".join(self._pending)
+
+    def push(self, delta: str):
+        if not delta:
+            return
+        self._pending.append(delta)
+        elapsed = self.clock() - self._last_flush
+        if elapsed >= self.interval or (
+                elapsed >= self.boundary_interval and delta.endswith(SENTENCE_BOUNDARIES)):
+            self.flush()
+
+    def flush(self, final: bool = False):
+        if self._pending:
+            self.text += "".join(self._pending)
+            self._pending.clear()
+        elif not final:
+            return
+        start = time.perf_counter()
+        sent = self.render(self.text, final)
+        self.render_seconds += time.perf_counter() - start
+        self.frames += 1
+        if sent:
+            self.bytes_sent += len(sent.encode("utf-8"))
+        self._last_flush = self.clock()
+
+    def close(self) -> str:
+        """最终刷新并返回完整文本，重复调用不会再次渲染。"""
+        if not self.closed:
+            self.closed = True
+            self.flush(final=True)
+        return self.text
@@ -0,0 +1,277 @@
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+import httpx
+
+from metrics import (
+    BREAKER_REJECTED, BREAKER_TRANSITIONS, UPSTREAM_HEDGE_WINS, UPSTREAM_HEDGES, UPSTREAM_RETRIES
+)
+
+# 首个 token 的等待上限（包括建立连接和上游排队），超时后按可重试错误处理
+UPSTREAM_FIRST_TOKEN_TIMEOUT = float(os.getenv("UPSTREAM_FIRST_TOKEN_TIMEOUT", "15"))
+# 首个 token 之前失败时的最大重试次数，以及指数退避的基础间隔（加随机抖动）
+UPSTREAM_RETRIES_MAX = int(os.getenv("UPSTREAM_RETRIES", "2"))
+UPSTREAM_RETRY_BASE_DELAY = float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", "0.2"))
+UPSTREAM_RETRY_MAX_DELAY = float(os.getenv("UPSTREAM_RETRY_MAX_DELAY", "2"))
+# 对冲请求：首个 token 超过近期 p95 仍未到达时并发再发一次，先产出 token 的请求胜出
+UPSTREAM_HEDGE_ENABLED = os.getenv("UPSTREAM_HEDGE_ENABLED", "0") == "1"
+UPSTREAM_HEDGE_MIN_DELAY = float(os.getenv("UPSTREAM_HEDGE_MIN_DELAY", "0.5"))
+UPSTREAM_HEDGE_MIN_SAMPLES = int(os.getenv("UPSTREAM_HEDGE_MIN_SAMPLES", "20"))
+# 读取上游后等待消费的 token 上限；消费方跟不上时暂停读取，由 TCP 流控把背压传给上游
+UPSTREAM_STREAM_BUFFER = int(os.getenv("UPSTREAM_STREAM_BUFFER", "256"))
+# 熔断器：连续失败达到阈值后熔断，经过 reset 秒后放行一个探测请求
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+
+class UpstreamError(Exception):
+    """上游返回了非 200 状态码。"""
+
+    def __init__(self, status_code: int, text: str = ""):
+        message = f"API错误: {status_code}"
+        if text:
+            message += f" - {text[:200]}"
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class FirstTokenTimeout(Exception):
+    def __init__(self, timeout: float):
+        super().__init__(f"上游在 {timeout:g} 秒内没有返回内容")
+
+
+class CircuitOpen(Exception):
+    """熔断器处于打开状态，请求未发往上游。"""
+
+    def __init__(self, name: str):
+        super().__init__(f"上游 {name} 暂时不可用")
+        self.name = name
+
+
+def is_retryable(error: BaseException) -> bool:
+    # 连接失败、超时、5xx 和 429 可以重试，其余 4xx 重试也不会成功
+    if isinstance(error, (FirstTokenTimeout, httpx.TransportError)):
+        return True
+    if isinstance(error, UpstreamError):
+        return error.status_code >= 500 or error.status_code == 429
+    return False
+
+
+def backoff_delay(attempt: int, base: float = UPSTREAM_RETRY_BASE_DELAY,
+                  cap: float = UPSTREAM_RETRY_MAX_DELAY) -> float:
+    # full jitter，避免大量请求在同一时刻集中重试
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+    STATE_NAMES = {CLOSED: "closed", HALF_OPEN: "half_open", OPEN: "open"}
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def _transition(self, state: int):
+        if state != self.state:
+            self.state = state
+            BREAKER_TRANSITIONS.inc(self.name, self.STATE_NAMES[state])
+
+    def before_call(self):
+        """请求上游前调用，熔断中抛出 CircuitOpen；半开状态同一时间只放行一个探测请求。"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                BREAKER_REJECTED.inc(self.name)
+                raise CircuitOpen(self.name)
+            self._transition(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self.probing:
+                BREAKER_REJECTED.inc(self.name)
+                raise CircuitOpen(self.name)
+            self.probing = True
+
+    def record_success(self):
+        self.failures = 0
+        self.probing = False
+        self._transition(self.CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._transition(self.OPEN)
+
+    def release(self):
+        # 请求在得出结果前被取消，或失败原因与上游可用性无关，不计入成功或失败
+        self.probing = False
+
+
+class LatencyTracker:
+    """记录最近的首 token 延迟，用于计算对冲请求的触发阈值。"""
+
+    def __init__(self, size: int = 256):
+        self.samples = deque(maxlen=size)
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def hedge_delay(self, min_samples: int = UPSTREAM_HEDGE_MIN_SAMPLES,
+                    min_delay: float = UPSTREAM_HEDGE_MIN_DELAY) -> Optional[float]:
+        if len(self.samples) < min_samples:
+            return None
+        return max(min_delay, self.quantile(0.95))
+
+
+class _Attempt:
+    """在独立任务中运行一次上游请求，首个结果放在 first，之后的 token 进入有界队列。"""
+
+    def __init__(self, open_stream: Callable[[], AsyncIterator[str]], buffer: int = UPSTREAM_STREAM_BUFFER):
+        self.first = asyncio.get_running_loop().create_future()
+        self.queue: asyncio.Queue = asyncio.Queue(buffer)
+        self.task = asyncio.create_task(self._run(open_stream))
+
+    async def _emit(self, item: Tuple[Optional[str], Optional[BaseException]]):
+        if not self.first.done():
+            self.first.set_result(item)
+        else:
+            # 队列满时在这里等待，期间不再读取上游
+            await self.queue.put(item)
+
+    async def _run(self, open_stream: Callable[[], AsyncIterator[str]]):
+        try:
+            async for token in open_stream():
+                await self._emit((token, None))
+        except Exception as e:
+            await self._emit((None, e))
+        else:
+            await self._emit((None, None))
+
+    def cancel(self):
+        self.task.cancel()
+
+    async def rest(self) -> AsyncIterator[str]:
+        while True:
+            token, error = await self.queue.get()
+            if error is not None:
+                raise error
+            if token is None:
+                return
+            yield token
+
+
+async def _first_token(open_stream: Callable[[], AsyncIterator[str]], timeout: float,
+                       hedge_delay: Optional[float]) -> Tuple[_Attempt, Optional[str]]:
+    """等待首个 token，超过 hedge_delay 时再发起一个对冲请求，返回胜出的请求和首个 token。"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    hedge_at = loop.time() + hedge_delay if hedge_delay is not None else None
+    attempts: List[_Attempt] = [_Attempt(open_stream)]
+    winner = None
+    try:
+        while True:
+            wake = deadline if hedge_at is None else min(deadline, hedge_at)
+            pending = [attempt.first for attempt in attempts if not attempt.first.done()]
+            if pending:
+                await asyncio.wait(pending, timeout=max(0.0, wake - loop.time()),
+                                   return_when=asyncio.FIRST_COMPLETED)
+
+            error = None
+            for attempt in attempts:
+                if attempt.first.done():
+                    token, error = attempt.first.result()
+                    if error is None:
+                        winner = attempt
+                        if attempt is not attempts[0]:
+                            UPSTREAM_HEDGE_WINS.inc()
+                        return attempt, token
+            # 所有请求都已失败时抛出最后一个错误，仍有请求在进行时继续等待
+            if all(attempt.first.done() for attempt in attempts):
+                raise error
+
+            now = loop.time()
+            if now >= deadline:
+                raise FirstTokenTimeout(timeout)
+            if hedge_at is not None and now >= hedge_at:
+                hedge_at = None
+                UPSTREAM_HEDGES.inc()
+                attempts.append(_Attempt(open_stream))
+    finally:
+        for attempt in attempts:
+            if attempt is not winner:
+                attempt.cancel()
+
+
+async def resilient_stream(open_stream: Callable[[], AsyncIterator[str]],
+                           breaker: CircuitBreaker,
+                           latency: LatencyTracker,
+                           retries: int = UPSTREAM_RETRIES_MAX,
+                           first_token_timeout: float = UPSTREAM_FIRST_TOKEN_TIMEOUT,
+                           hedge: bool = UPSTREAM_HEDGE_ENABLED) -> AsyncIterator[str]:
+    """带熔断、首 token 超时、重试和对冲的 token 流。
+
+    只在首个 token 之前重试或对冲，已经开始输出后出错直接抛出，避免重复输出。
+    熔断器只统计可重试的（上游侧的）失败，一次调用无论重试几次最多计一次失败。
+    """
+    failure_recorded = False
+
+    def on_failure(error: Exception):
+        nonlocal failure_recorded
+        if is_retryable(error) and not failure_recorded:
+            breaker.record_failure()
+            failure_recorded = True
+        else:
+            # 4xx 等请求本身的问题不说明上游不可用，只释放半开状态的探测名额
+            breaker.release()
+
+    attempt_number = 0
+    while True:
+        breaker.before_call()
+        start = time.perf_counter()
+        try:
+            winner, first = await _first_token(
+                open_stream, first_token_timeout, latency.hedge_delay() if hedge else None
+            )
+            break
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as e:
+            on_failure(e)
+            if attempt_number >= retries or not is_retryable(e):
+                raise
+            attempt_number += 1
+            UPSTREAM_RETRIES.inc()
+            await asyncio.sleep(backoff_delay(attempt_number))
+
+    latency.observe(time.perf_counter() - start)
+    try:
+        if first is not None:
+            yield first
+            async for token in winner.rest():
+                yield token
+    except (GeneratorExit, asyncio.CancelledError):
+        breaker.release()
+        raise
+    except Exception as e:
+        on_failure(e)
+        raise
+    else:
+        breaker.record_success()
+    finally:
+        winner.cancel()
@@ -0,0 +1,105 @@
+import hashlib
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+from prompt_context import SYSTEM_PROMPT
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+
+# 去掉空白和句末标点，"交易时间是？" 与 "交易时间是 ?" 视为同一个问题；
+# 句中的符号保留，"1+1" 与 "1-1"、"5%" 与 "5" 不会被合并
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[.?!。？！…~～]+$")
+
+
+def normalize_question(question: str) -> str:
+    text = unicodedata.normalize("NFKC", question).lower()
+    return _TRAILING_PUNCTUATION.sub("", _WHITESPACE.sub("", text))
+
+
+def prompt_fingerprint(system_prompt: str = SYSTEM_PROMPT) -> str:
+    return hashlib.sha1(system_prompt.encode("utf-8")).hexdigest()[:12]
+
+
+def make_cache_key(question: str, system_prompt: str = SYSTEM_PROMPT) -> Optional[str]:
+    """规范化后为空的问题（只有空白或标点）返回 None，不走缓存。"""
+    normalized = normalize_question(question)
+    if not normalized:
+        return None
+    # 系统提示变化后旧答案自动失效
+    return f"{prompt_fingerprint(system_prompt)}:{normalized}"
+
+
+class ResponseCache:
+    """按规范化问题缓存完整回答，LRU + TTL 淘汰，并限制条目数和总字节数。"""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+                 ttl: float = RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (answer, expires_at, size)
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        answer, expires_at, _ = entry
+        if expires_at < time.monotonic():
+            # 过期条目保留到被 LRU 淘汰为止，上游不可用时仍可作为兜底回答
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return answer
+
+    def get_stale(self, key: str) -> Optional[str]:
+        """忽略 TTL 返回缓存的回答，不计入命中统计。"""
+        entry = self.entries.get(key)
+        return None if entry is None else entry[0]
+
+    def put(self, key: str, answer: str):
+        size = len(key) + len(answer.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (answer, time.monotonic() + self.ttl, size)
+        self.bytes += size
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        _, _, size = self.entries.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
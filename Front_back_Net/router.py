@@ -0,0 +1,107 @@
+import logging
+import os
+import random
+from typing import AsyncIterator, List
+
+import httpx
+
+from metrics import ROUTER_FAILOVERS, ROUTER_SELECTIONS
+from resilience import CircuitBreaker, CircuitOpen
+from upstream import DeepSeekAPI, Provider, WenHuaAPI
+
+logger = logging.getLogger(__name__)
+
+# 启用的上游，按优先级排列，例如 "wenhua,deepseek"
+MODEL_PROVIDERS = os.getenv("MODEL_PROVIDERS", "wenhua")
+# 打分权重：首 token 延迟（秒）、失败率（0~1）和相对成本，分数越低越优先
+ROUTER_LATENCY_WEIGHT = float(os.getenv("ROUTER_LATENCY_WEIGHT", "1.0"))
+ROUTER_ERROR_WEIGHT = float(os.getenv("ROUTER_ERROR_WEIGHT", "5.0"))
+ROUTER_COST_WEIGHT = float(os.getenv("ROUTER_COST_WEIGHT", "0.5"))
+# 简单问题（常见问题类、无上下文的短问题）更看重成本和速度
+ROUTER_SIMPLE_COST_WEIGHT = float(os.getenv("ROUTER_SIMPLE_COST_WEIGHT", "2.0"))
+ROUTER_SIMPLE_MAX_CHARS = int(os.getenv("ROUTER_SIMPLE_MAX_CHARS", "60"))
+# 以一定概率随机选择，保持各上游的统计数据不过时
+ROUTER_EXPLORE_RATE = float(os.getenv("ROUTER_EXPLORE_RATE", "0.05"))
+# 还没有延迟样本时假定的首 token 延迟
+ROUTER_DEFAULT_TTFT = 1.0
+
+
+def create_provider(name: str, client: httpx.AsyncClient) -> Provider:
+    if name == "wenhua":
+        return WenHuaAPI(client)
+    if name == "deepseek":
+        return DeepSeekAPI(client)
+    raise ValueError(f"未知的模型上游: {name}")
+
+
+class ModelRouter:
+    """按近期首 token 延迟、失败率和成本为每个请求选择上游，首个 token 之前失败时切换到下一个。
+
+    对外提供与单个上游相同的 stream_tokens / complete 接口。
+    """
+
+    def __init__(self, providers: List[Provider]):
+        if not providers:
+            raise ValueError("至少需要一个模型上游")
+        self.providers = providers
+
+    def score(self, provider: Provider, simple: bool = False) -> float:
+        ttft = provider.ttft_ewma if provider.ttft_ewma is not None else ROUTER_DEFAULT_TTFT
+        cost_weight = ROUTER_SIMPLE_COST_WEIGHT if simple else ROUTER_COST_WEIGHT
+        return (ROUTER_LATENCY_WEIGHT * ttft
+                + ROUTER_ERROR_WEIGHT * provider.error_ewma
+                + cost_weight * provider.cost)
+
+    def rank(self, simple: bool = False) -> List[Provider]:
+        """返回候选顺序：熔断中的上游排在最后，其余按分数排序。"""
+        ranked = sorted(
+            self.providers,
+            key=lambda p: (p.breaker.state == CircuitBreaker.OPEN, self.score(p, simple))
+        )
+        # 只在未熔断的上游之间探索，熔断中的上游由熔断器自己的半开探测恢复
+        available = sum(p.breaker.state != CircuitBreaker.OPEN for p in ranked)
+        if available > 1 and random.random() < ROUTER_EXPLORE_RATE:
+            ranked.insert(0, ranked.pop(random.randrange(1, available)))
+        return ranked
+
+    async def stream_tokens(self, content_text: str, simple: bool = False) -> AsyncIterator[str]:
+        kind = "simple" if simple else "full"
+        error = None
+        for provider in self.rank(simple):
+            if error is not None:
+                ROUTER_FAILOVERS.inc(provider.name)
+            ROUTER_SELECTIONS.inc(provider.name, kind)
+            started = False
+            try:
+                async for token in provider.stream_tokens(content_text):
+                    started = True
+                    yield token
+                return
+            except Exception as e:
+                # 已经输出过 token 时不能再切换上游，否则用户会看到两段拼接的回答
+                if started:
+                    raise
+                logger.info("上游 %s 失败，尝试下一个: %r", provider.name, e)
+                # 优先保留真实的上游错误：只有所有上游都熔断时才抛出 CircuitOpen，走兜底回答
+                if error is None or isinstance(error, CircuitOpen):
+                    error = e
+        raise error
+
+    async def complete(self, content_text: str, simple: bool = True) -> str:
+        """非流式调用（用于生成摘要等后台任务，默认按简单请求路由）。"""
+        return "".join([token async for token in self.stream_tokens(content_text, simple)])
+
+    def is_open(self) -> bool:
+        return all(p.breaker.state == CircuitBreaker.OPEN for p in self.providers)
+
+    def stats(self) -> dict:
+        return {provider.name: provider.stats() for provider in self.providers}
+
+
+def create_router(client: httpx.AsyncClient, names: str = MODEL_PROVIDERS) -> ModelRouter:
+    return ModelRouter([create_provider(name.strip(), client) for name in names.split(",") if name.strip()])
+
+
+def is_simple_prompt(prompt: str, context_free: bool, grounded: bool) -> bool:
+    # 会话的第一个问题且较短，或者命中了 FAQ 参考资料，视为常见问题类的简单请求
+    return context_free and (grounded or len(prompt) <= ROUTER_SIMPLE_MAX_CHARS)
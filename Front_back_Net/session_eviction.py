@@ -0,0 +1,145 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Optional
+
+from metrics import SESSIONS_EVICTED
+from session_store import SessionStore, call_store
+
+logger = logging.getLogger(__name__)
+
+# 会话空闲超过该秒数后被淘汰，0 表示不按空闲时间淘汰
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "7200"))
+# 会话数量和进程内会话内存的上限，超出时淘汰最近最少使用的会话，0 表示不限制
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "0"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", "0"))
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+# 被淘汰会话的归档目录（JSONL，每天一个文件），为空时直接丢弃
+SESSION_ARCHIVE_DIR = os.getenv("SESSION_ARCHIVE_DIR", "")
+
+# 单次查询的会话数量，避免一次扫描占用事件循环过久
+SWEEP_BATCH = 500
+# 淘汰时短暂持有会话租约，防止同时有新的生成开始
+EVICTION_LEASE_SECONDS = 30
+
+
+class SessionArchive:
+    """把被淘汰的会话追加写入 {directory}/sessions-YYYYMMDD.jsonl。"""
+
+    def __init__(self, directory: str = SESSION_ARCHIVE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, record: dict):
+        path = os.path.join(self.directory, f"sessions-{datetime.now():%Y%m%d}.jsonl")
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+class SessionSweeper:
+    """定期淘汰空闲会话，并在会话数量或内存超出上限时按 LRU 淘汰。
+
+    正在生成回复的会话（持有生成租约）不会被淘汰，留到下一轮再检查。
+    """
+
+    def __init__(self, store: SessionStore,
+                 idle_ttl: float = SESSION_IDLE_TTL,
+                 max_sessions: int = SESSION_MAX_COUNT,
+                 max_bytes: int = SESSION_MAX_BYTES,
+                 archive: Optional[SessionArchive] = None):
+        self.store = store
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.archive = archive
+        self.evicted_idle = 0
+        self.evicted_capacity = 0
+        self.archived = 0
+
+    def evict(self, session_id: str, reason: str) -> bool:
+        if self.store.begin_generation(session_id, EVICTION_LEASE_SECONDS) is None:
+            return False
+        if self.archive is not None:
+            conversation = self.store.get_conversation(session_id)
+            window = self.store.get_context_window(session_id)
+            if conversation:
+                try:
+                    self.archive.write({
+                        "session_id": session_id,
+                        "evicted_at": time.time(),
+                        "reason": reason,
+                        "conversation": [message.to_dict() for message in conversation],
+                        "summary": window.summary if window else "",
+                    })
+                    self.archived += 1
+                except OSError as e:
+                    logger.warning("会话 %s 归档失败: %s", session_id, e)
+        self.store.delete(session_id)
+        if reason == "idle":
+            self.evicted_idle += 1
+        else:
+            self.evicted_capacity += 1
+        SESSIONS_EVICTED.inc(reason)
+        return True
+
+    def _over_capacity(self) -> bool:
+        if self.max_sessions and self.store.count() > self.max_sessions:
+            return True
+        if self.max_bytes:
+            used = self.store.memory_bytes()
+            return used is not None and used > self.max_bytes
+        return False
+
+    def enforce_capacity(self) -> int:
+        """淘汰最近最少使用的会话，直到数量和内存都回到上限以内。"""
+        evicted = 0
+        skip = 0
+        while self._over_capacity():
+            candidates = self.store.oldest_sessions(skip + SWEEP_BATCH)[skip:]
+            if not candidates:
+                break
+            for session_id in candidates:
+                if self.evict(session_id, "capacity"):
+                    evicted += 1
+                    if not self._over_capacity():
+                        return evicted
+                else:
+                    skip += 1
+        return evicted
+
+    def expire_idle(self, now: Optional[float] = None) -> int:
+        if self.idle_ttl <= 0:
+            return 0
+        before = (now if now is not None else time.time()) - self.idle_ttl
+        evicted = 0
+        while True:
+            candidates = self.store.idle_sessions(before, SWEEP_BATCH)
+            evicted_batch = sum(self.evict(session_id, "idle") for session_id in candidates)
+            evicted += evicted_batch
+            # 整批都在生成中时不再重复查询，等下一轮
+            if len(candidates) < SWEEP_BATCH or evicted_batch == 0:
+                return evicted
+
+    def sweep(self) -> int:
+        return self.expire_idle() + self.enforce_capacity()
+
+    async def run(self, interval: float = SESSION_SWEEP_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                evicted = await call_store(self.store, self.sweep)
+                if evicted:
+                    logger.info("淘汰会话 %d 个，剩余 %d 个", evicted, await call_store(self.store, self.store.count))
+            except Exception as e:
+                logger.warning("会话淘汰失败: %s", e)
+
+    def stats(self) -> dict:
+        return {
+            "live": self.store.count(),
+            "evicted_idle": self.evicted_idle,
+            "evicted_capacity": self.evicted_capacity,
+            "archived": self.archived,
+        }
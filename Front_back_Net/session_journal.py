@@ -0,0 +1,250 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+import time
+from typing import Callable, Iterable, Iterator, List
+
+from metrics import JOURNAL_COMMIT_SECONDS, JOURNAL_RECORDS
+
+logger = logging.getLogger(__name__)
+
+# 进程内会话的持久化日志目录，为空时不持久化（仅对 memory 存储生效）
+SESSION_JOURNAL_DIR = os.getenv("SESSION_JOURNAL_DIR", "")
+# 组提交间隔：这段时间内的所有修改合并为一次写入
+SESSION_JOURNAL_COMMIT_INTERVAL = float(os.getenv("SESSION_JOURNAL_COMMIT_INTERVAL", "0.05"))
+# fsync 策略：commit 每次组提交后 fsync；interval 最多每 SESSION_JOURNAL_FSYNC_INTERVAL 秒一次；
+# off 只写入操作系统缓存（进程崩溃不丢数据，断电可能丢失最近的修改）
+SESSION_JOURNAL_FSYNC = os.getenv("SESSION_JOURNAL_FSYNC", "commit")
+SESSION_JOURNAL_FSYNC_INTERVAL = float(os.getenv("SESSION_JOURNAL_FSYNC_INTERVAL", "1"))
+# 距上次快照超过该秒数、或日志累计超过该字节数时，把全部会话压缩成一个快照并删除旧日志
+SESSION_JOURNAL_SNAPSHOT_INTERVAL = float(os.getenv("SESSION_JOURNAL_SNAPSHOT_INTERVAL", "300"))
+SESSION_JOURNAL_SNAPSHOT_BYTES = int(os.getenv("SESSION_JOURNAL_SNAPSHOT_BYTES", str(64 * 1024 * 1024)))
+
+FSYNC_POLICIES = ("commit", "interval", "off")
+SNAPSHOT_FILE = "snapshot.jsonl"
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+else:
+    _encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+    def _dumps(value) -> bytes:
+        return _encode(value).encode("utf-8")
+
+    _loads = json.loads
+
+
+class SessionJournal:
+    """会话修改的追加日志，按分段文件 journal-N.jsonl 组织，每行一条 JSON 数组记录。
+
+    record 只把记录元组放进内存缓冲区（请求路径上不做序列化），run 任务按固定间隔
+    在线程中把缓冲区编码后一次写入当前分段（组提交），并按 fsync 策略落盘。快照 snapshot.jsonl 的第一行记录它覆盖到的分段号，
+    启动时先加载快照，再按顺序重放之后的分段。
+    所有方法都在事件循环线程中调用，文件读写放到线程中执行。
+    """
+
+    def __init__(self, directory: str = SESSION_JOURNAL_DIR,
+                 fsync: str = SESSION_JOURNAL_FSYNC,
+                 commit_interval: float = SESSION_JOURNAL_COMMIT_INTERVAL,
+                 fsync_interval: float = SESSION_JOURNAL_FSYNC_INTERVAL,
+                 snapshot_interval: float = SESSION_JOURNAL_SNAPSHOT_INTERVAL,
+                 snapshot_bytes: int = SESSION_JOURNAL_SNAPSHOT_BYTES):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"未知的 fsync 策略: {fsync}")
+        self.directory = directory
+        self.fsync = fsync
+        self.commit_interval = commit_interval
+        self.fsync_interval = fsync_interval
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_bytes = snapshot_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.segment = 0
+        self._buffer: List[tuple] = []
+        self._file = None
+        self._last_fsync = 0.0
+        self._last_snapshot = time.monotonic()
+        # 上次快照之后写入日志的字节数
+        self.journal_bytes = 0
+        self.commits = 0
+        self.snapshots = 0
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"journal-{segment:08d}.jsonl")
+
+    def _segments(self) -> List[int]:
+        paths = glob.glob(os.path.join(self.directory, "journal-*.jsonl"))
+        return sorted(int(os.path.basename(path)[8:-6]) for path in paths)
+
+    def record(self, entry: tuple):
+        # 记录中只能包含之后不会被修改的对象
+        self._buffer.append(entry)
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    # ---- 启动时恢复 ----
+
+    def replay(self) -> Iterator[list]:
+        """按顺序产出快照和之后各分段中的记录，结束后新的修改写入一个新分段。
+
+        分段末尾因崩溃而只写了一半的行会被跳过。
+        """
+        covered = -1
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                covered = _loads(f.readline())["segment"]
+                for line in f:
+                    yield _loads(line)
+        segments = self._segments()
+        for segment in segments:
+            if segment > covered:
+                yield from self._read_segment(segment)
+        self.segment = max(segments + [covered]) + 1
+
+    def _read_segment(self, segment: int) -> Iterator[list]:
+        with open(self._segment_path(segment), "rb") as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    entry = _loads(line)
+                except ValueError:
+                    logger.warning("跳过会话日志 %d 第 %d 行（未写完整）", segment, number)
+                    continue
+                yield entry
+
+    # ---- 组提交 ----
+
+    def _write(self, entries: List[tuple], sync: bool):
+        if self._file is None:
+            self._file = open(self._segment_path(self.segment), "ab")
+        if entries:
+            data = b"\n".join(map(_dumps, entries)) + b"\n"
+            self._file.write(data)
+            self._file.flush()
+            self.journal_bytes += len(data)
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def _should_fsync(self) -> bool:
+        if self.fsync == "commit":
+            return True
+        if self.fsync == "interval":
+            return time.monotonic() - self._last_fsync >= self.fsync_interval
+        return False
+
+    async def commit(self):
+        if not self._buffer:
+            return
+        lines, self._buffer = self._buffer, []
+        sync = self._should_fsync()
+        start = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._write, lines, sync)
+        except Exception:
+            # 写入失败时放回缓冲区，下次提交重试
+            self._buffer[:0] = lines
+            raise
+        JOURNAL_COMMIT_SECONDS.observe(time.perf_counter() - start)
+        JOURNAL_RECORDS.inc(len(lines))
+        if sync:
+            self._last_fsync = time.monotonic()
+        self.commits += 1
+
+    # ---- 快照 ----
+
+    def snapshot_due(self) -> bool:
+        if self.journal_bytes == 0:
+            return False
+        return (self.journal_bytes >= self.snapshot_bytes
+                or time.monotonic() - self._last_snapshot >= self.snapshot_interval)
+
+    def _close_segment(self, lines: List[tuple]):
+        self._write(lines, sync=True)
+        self._file.close()
+        self._file = None
+
+    def _write_snapshot(self, covered: int, entries: Iterable[tuple]):
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_dumps({"segment": covered}) + b"\n")
+            for entry in entries:
+                f.write(_dumps(entry) + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        # 快照已覆盖的分段不再需要
+        for segment in self._segments():
+            if segment <= covered:
+                os.remove(self._segment_path(segment))
+
+    async def snapshot(self, capture: Callable[[], Callable[[], Iterable[tuple]]]):
+        """压缩日志：capture 在事件循环中同步复制当前状态，返回的函数在线程中产出快照记录。
+
+        取出缓冲区和复制状态之间没有 await，快照恰好包含当前分段及之前的所有修改；
+        之后的修改留在缓冲区中，在切换到新分段后才写入。
+        """
+        lines, self._buffer = self._buffer, []
+        entries = capture()
+        covered = self.segment
+        try:
+            await asyncio.to_thread(self._close_segment, lines)
+        except Exception:
+            # 与 commit 相同，写入失败时放回缓冲区，下次提交或快照时重试
+            self._buffer[:0] = lines
+            raise
+        self.segment = covered + 1
+        JOURNAL_RECORDS.inc(len(lines))
+        await asyncio.to_thread(self._write_snapshot, covered, entries())
+        self.journal_bytes = 0
+        self._last_snapshot = time.monotonic()
+        self.snapshots += 1
+
+    async def _flush(self, capture: Callable[[], Callable[[], Iterable[tuple]]]):
+        try:
+            if self.snapshot_due():
+                await self.snapshot(capture)
+            else:
+                await self.commit()
+        except Exception as e:
+            logger.warning("会话日志写入失败: %s", e)
+
+    async def run(self, capture: Callable[[], Callable[[], Iterable[tuple]]]):
+        """按组提交间隔循环写入。取消只在两次提交之间生效。
+
+        线程中的写入无法中途停止，被取消时先等本轮提交结束再传播取消，
+        调用方 await 本任务之后再调用 close，不会与仍在进行的写入并发。
+        """
+        while True:
+            await asyncio.sleep(self.commit_interval)
+            flush = asyncio.ensure_future(self._flush(capture))
+            try:
+                await asyncio.shield(flush)
+            except asyncio.CancelledError:
+                await asyncio.wait([flush])
+                raise
+
+    async def close(self):
+        """停止前把缓冲区中剩余的记录写入并 fsync。"""
+        lines, self._buffer = self._buffer, []
+        if lines or self._file is not None:
+            await asyncio.to_thread(self._close_segment, lines)
+
+    def stats(self) -> dict:
+        return {
+            "fsync": self.fsync,
+            "segment": self.segment,
+            "pending": self.pending,
+            "commits": self.commits,
+            "journal_bytes": self.journal_bytes,
+            "snapshots": self.snapshots,
+        }
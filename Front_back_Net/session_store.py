@@ -0,0 +1,794 @@
+import asyncio
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Callable, Iterator, List, Optional
+
+from messages import Message, parse_timestamp
+from session_journal import SESSION_JOURNAL_DIR, SessionJournal
+
+# 会话存储配置：memory（单进程）、sqlite（单机多 worker）、redis（多机多 worker）
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_PREFIX = os.getenv("REDIS_PREFIX", "wenhua:")
+
+
+def new_state() -> dict:
+    return {"is_responding": False, "prompt_to_process": None}
+
+
+@dataclass
+class ContextWindow:
+    """会话的上下文窗口：滚动摘要、已折叠进摘要的消息条数，以及之后的已渲染消息。"""
+    summary: str = ""
+    folded: int = 0
+    turns: List[str] = field(default_factory=list)
+
+
+class SessionStore(ABC):
+    """会话存储接口。所有接口都以 session_id 为键，会话不存在时读接口返回 None。"""
+
+    @abstractmethod
+    def create(self, session_id: str) -> bool:
+        """创建会话，已存在时不做修改并返回 False。"""
+
+    @abstractmethod
+    def exists(self, session_id: str) -> bool:
+        pass
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        pass
+
+    @abstractmethod
+    def get_conversation(self, session_id: str) -> Optional[List[Message]]:
+        pass
+
+    @abstractmethod
+    def get_messages(self, session_id: str, since: int = 0,
+                     limit: Optional[int] = None) -> Optional[List[Message]]:
+        """返回序号大于 since 的消息，最多 limit 条。
+
+        消息序号从 1 开始按追加顺序递增，第 n 条消息的序号为 n。
+        """
+
+    @abstractmethod
+    def message_count(self, session_id: str) -> Optional[int]:
+        """会话的消息条数，即最新一条消息的序号。"""
+
+    @abstractmethod
+    def append_message(self, session_id: str, message: Message):
+        pass
+
+    @abstractmethod
+    def get_context_window(self, session_id: str) -> Optional[ContextWindow]:
+        """返回摘要和尚未折叠的已渲染消息（见 prompt_context.render_turn）。"""
+
+    @abstractmethod
+    def append_context(self, session_id: str, text: str):
+        """在上下文窗口末尾追加一条已渲染的消息。"""
+
+    @abstractmethod
+    def fold_context(self, session_id: str, expected_folded: int, count: int, summary: str) -> bool:
+        """用新摘要替换窗口最早的 count 条消息。
+
+        仅当当前 folded 等于 expected_folded 时生效，避免并发折叠重复丢弃消息。
+        """
+
+    @abstractmethod
+    def get_state(self, session_id: str) -> Optional[dict]:
+        """返回 {"is_responding": bool, "prompt_to_process": str | None}。"""
+
+    @abstractmethod
+    def update_state(self, session_id: str, **fields):
+        pass
+
+    @abstractmethod
+    def begin_generation(self, session_id: str, lease_seconds: float) -> Optional[str]:
+        """原子地为会话取得生成租约，返回租约令牌；会话不存在或已有未过期的租约时返回 None。"""
+
+    @abstractmethod
+    def end_generation(self, session_id: str, token: str):
+        """释放租约。只有 token 与当前租约一致时才释放，租约过期后已被其他 worker 取得时不受影响。"""
+
+    @abstractmethod
+    def count(self) -> int:
+        pass
+
+    @abstractmethod
+    def idle_sessions(self, before: float, limit: int) -> List[str]:
+        """返回最后活跃时间早于 before 的会话，按最久未活跃排序。"""
+
+    @abstractmethod
+    def oldest_sessions(self, limit: int) -> List[str]:
+        """按最近最少使用的顺序返回会话，用于容量淘汰。"""
+
+    def memory_bytes(self) -> Optional[int]:
+        """进程内会话数据占用的近似字节数，外部存储返回 None。"""
+        return None
+
+    def close(self):
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """进程内存储，仅适用于单个 worker。
+
+    sessions 按最近活跃排序，每次访问把会话移到末尾，淘汰时从头部开始。
+    """
+
+    def __init__(self):
+        self.sessions: "OrderedDict[str, dict]" = OrderedDict()
+        # 增量维护的近似内存占用，抓取指标时无需遍历所有会话
+        self.bytes = 0
+
+    def create(self, session_id: str) -> bool:
+        if session_id in self.sessions:
+            return False
+        self.sessions[session_id] = {
+            "conversation": [],
+            "context": ContextWindow(),
+            "generating_until": 0.0,
+            "generation_token": None,
+            "bytes": 0,
+            "last_active": time.time(),
+            **new_state()
+        }
+        return True
+
+    def exists(self, session_id: str) -> bool:
+        return session_id in self.sessions
+
+    def delete(self, session_id: str):
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            self.bytes -= session["bytes"]
+
+    def _account(self, session: dict, delta: int):
+        session["bytes"] += delta
+        self.bytes += delta
+
+    def _touch(self, session_id: str) -> Optional[dict]:
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session["last_active"] = time.time()
+            self.sessions.move_to_end(session_id)
+        return session
+
+    def get_conversation(self, session_id: str) -> Optional[List[Message]]:
+        session = self._touch(session_id)
+        return None if session is None else session["conversation"]
+
+    def get_messages(self, session_id: str, since: int = 0,
+                     limit: Optional[int] = None) -> Optional[List[Message]]:
+        session = self._touch(session_id)
+        if session is None:
+            return None
+        end = None if limit is None else since + limit
+        return session["conversation"][since:end]
+
+    def message_count(self, session_id: str) -> Optional[int]:
+        session = self.sessions.get(session_id)
+        return None if session is None else len(session["conversation"])
+
+    def append_message(self, session_id: str, message: Message):
+        session = self._touch(session_id)
+        if session is None:
+            return
+        session["conversation"].append(message)
+        self._account(session, message.size())
+
+    def get_context_window(self, session_id: str) -> Optional[ContextWindow]:
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        window = session["context"]
+        return ContextWindow(window.summary, window.folded, list(window.turns))
+
+    def append_context(self, session_id: str, text: str):
+        session = self.sessions[session_id]
+        session["context"].turns.append(text)
+        self._account(session, sys.getsizeof(text))
+
+    def fold_context(self, session_id: str, expected_folded: int, count: int, summary: str) -> bool:
+        session = self.sessions.get(session_id)
+        if session is None or session["context"].folded != expected_folded:
+            return False
+        window = session["context"]
+        released = sum(sys.getsizeof(turn) for turn in window.turns[:count])
+        self._account(session, sys.getsizeof(summary) - sys.getsizeof(window.summary) - released)
+        del window.turns[:count]
+        window.folded += count
+        window.summary = summary
+        return True
+
+    def get_state(self, session_id: str) -> Optional[dict]:
+        session = self._touch(session_id)
+        if session is None:
+            return None
+        return {
+            "is_responding": session["is_responding"],
+            "prompt_to_process": session["prompt_to_process"]
+        }
+
+    def update_state(self, session_id: str, **fields):
+        session = self._touch(session_id)
+        if session is not None:
+            session.update(fields)
+
+    def begin_generation(self, session_id: str, lease_seconds: float) -> Optional[str]:
+        token = uuid.uuid4().hex
+        session = self.sessions.get(session_id)
+        now = time.time()
+        if session is None or session["generating_until"] > now:
+            return None
+        session["generating_until"] = now + lease_seconds
+        session["generation_token"] = token
+        return token
+
+    def end_generation(self, session_id: str, token: str):
+        session = self.sessions.get(session_id)
+        if session is not None and session["generation_token"] == token:
+            session["generating_until"] = 0.0
+            session["generation_token"] = None
+
+    def count(self) -> int:
+        return len(self.sessions)
+
+    def idle_sessions(self, before: float, limit: int) -> List[str]:
+        idle = []
+        for session_id, session in self.sessions.items():
+            if session["last_active"] >= before or len(idle) >= limit:
+                break
+            idle.append(session_id)
+        return idle
+
+    def oldest_sessions(self, limit: int) -> List[str]:
+        return list(islice(self.sessions, limit))
+
+    def memory_bytes(self) -> Optional[int]:
+        return self.bytes
+
+
+class JournaledSessionStore(MemorySessionStore):
+    """进程内存储加写后日志：修改先在内存中生效，再由 SessionJournal 批量写入磁盘。
+
+    启动时调用 recover() 从快照和日志重放恢复会话。生成租约不写日志，
+    重启时正在生成的会话保留 is_responding 和待处理的问题，前端会重新发起生成。
+    """
+
+    def __init__(self, journal: SessionJournal):
+        super().__init__()
+        self.journal = journal
+
+    def create(self, session_id: str) -> bool:
+        created = super().create(session_id)
+        if created:
+            self.journal.record(("c", session_id, self.sessions[session_id]["last_active"]))
+        return created
+
+    def delete(self, session_id: str):
+        if session_id in self.sessions:
+            self.journal.record(("d", session_id))
+        super().delete(session_id)
+
+    def append_message(self, session_id: str, message: Message):
+        if session_id not in self.sessions:
+            return
+        super().append_message(session_id, message)
+        self.journal.record(("m", session_id, int(message.sender), message.timestamp, message.message))
+
+    def append_context(self, session_id: str, text: str):
+        super().append_context(session_id, text)
+        self.journal.record(("x", session_id, text))
+
+    def fold_context(self, session_id: str, expected_folded: int, count: int, summary: str) -> bool:
+        folded = super().fold_context(session_id, expected_folded, count, summary)
+        if folded:
+            self.journal.record(("f", session_id, count, summary))
+        return folded
+
+    def update_state(self, session_id: str, **fields):
+        if session_id not in self.sessions:
+            return
+        super().update_state(session_id, **fields)
+        self.journal.record(("s", session_id, fields))
+
+    def apply(self, entry: list):
+        """重放一条日志记录，不再写入日志。"""
+        op, session_id = entry[0], entry[1]
+        if op == "c":
+            MemorySessionStore.create(self, session_id)
+            self.sessions[session_id]["last_active"] = entry[2]
+            return
+        session = self.sessions.get(session_id)
+        if session is None:
+            return
+        if op == "d":
+            MemorySessionStore.delete(self, session_id)
+        elif op == "m":
+            MemorySessionStore.append_message(self, session_id, Message(entry[2], entry[4], entry[3]))
+            session["last_active"] = entry[3]
+        elif op == "x":
+            MemorySessionStore.append_context(self, session_id, entry[2])
+        elif op == "f":
+            MemorySessionStore.fold_context(self, session_id, session["context"].folded, entry[2], entry[3])
+        elif op == "w":
+            # 快照中的摘要和已折叠条数
+            self._account(session, sys.getsizeof(entry[2]) - sys.getsizeof(session["context"].summary))
+            session["context"] = ContextWindow(entry[2], entry[3])
+        elif op == "s":
+            session.update(entry[2])
+
+    def recover(self) -> int:
+        for entry in self.journal.replay():
+            self.apply(entry)
+        return len(self.sessions)
+
+    def capture(self) -> Callable[[], Iterator[tuple]]:
+        """复制当前所有会话（列表浅拷贝，消息对象不会被修改），返回生成快照记录的函数。"""
+        sessions = [
+            (session_id, session["last_active"], list(session["conversation"]),
+             session["context"].summary, session["context"].folded, list(session["context"].turns),
+             {"is_responding": session["is_responding"], "prompt_to_process": session["prompt_to_process"]})
+            for session_id, session in self.sessions.items()
+        ]
+
+        def entries() -> Iterator[tuple]:
+            for session_id, last_active, conversation, summary, folded, turns, state in sessions:
+                yield "c", session_id, last_active
+                for m in conversation:
+                    yield "m", session_id, int(m.sender), m.timestamp, m.message
+                yield "w", session_id, summary, folded
+                for turn in turns:
+                    yield "x", session_id, turn
+                yield "s", session_id, state
+
+        return entries
+
+
+class SQLiteSessionStore(SessionStore):
+    """SQLite 存储（WAL 模式），同一台机器上的多个 worker 可共享同一个数据库文件。"""
+
+    def __init__(self, path: str = SESSION_DB_PATH):
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                is_responding INTEGER NOT NULL DEFAULT 0,
+                prompt_to_process TEXT,
+                summary TEXT NOT NULL DEFAULT '',
+                folded INTEGER NOT NULL DEFAULT 0,
+                generating_until REAL NOT NULL DEFAULT 0,
+                generation_token TEXT,
+                last_active REAL NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                sender TEXT NOT NULL,
+                message TEXT NOT NULL,
+                timestamp TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id);
+            CREATE TABLE IF NOT EXISTS context_turns (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                text TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_context_turns_session ON context_turns (session_id, id);
+        """)
+        self._add_column("sessions", "summary", "TEXT NOT NULL DEFAULT ''")
+        self._add_column("sessions", "folded", "INTEGER NOT NULL DEFAULT 0")
+        self._add_column("sessions", "generating_until", "REAL NOT NULL DEFAULT 0")
+        self._add_column("sessions", "generation_token", "TEXT")
+        self._add_column("sessions", "last_active", "REAL NOT NULL DEFAULT 0")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_last_active ON sessions (last_active)")
+
+    def _add_column(self, table: str, column: str, definition: str):
+        # 兼容旧版本创建的数据库文件
+        columns = [row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def _execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        with self.lock:
+            return self.conn.execute(sql, params)
+
+    def create(self, session_id: str) -> bool:
+        cursor = self._execute(
+            "INSERT OR IGNORE INTO sessions (session_id, last_active) VALUES (?, ?)",
+            (session_id, time.time())
+        )
+        return cursor.rowcount == 1
+
+    def exists(self, session_id: str) -> bool:
+        row = self._execute(
+            "SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return row is not None
+
+    def delete(self, session_id: str):
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self.conn.execute("DELETE FROM context_turns WHERE session_id = ?", (session_id,))
+            self.conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self.conn.execute("COMMIT")
+
+    def get_conversation(self, session_id: str) -> Optional[List[Message]]:
+        if not self.exists(session_id):
+            return None
+        rows = self._execute(
+            "SELECT sender, message, timestamp FROM messages WHERE session_id = ? ORDER BY id",
+            (session_id,)
+        ).fetchall()
+        return [Message(s, m, parse_timestamp(t)) for s, m, t in rows]
+
+    def get_messages(self, session_id: str, since: int = 0,
+                     limit: Optional[int] = None) -> Optional[List[Message]]:
+        if not self.exists(session_id):
+            return None
+        # 序号即会话内的位置，借助 (session_id, id) 索引跳过前 since 条
+        rows = self._execute(
+            "SELECT sender, message, timestamp FROM messages WHERE session_id = ? "
+            "ORDER BY id LIMIT ? OFFSET ?",
+            (session_id, -1 if limit is None else limit, since)
+        ).fetchall()
+        return [Message(s, m, parse_timestamp(t)) for s, m, t in rows]
+
+    def message_count(self, session_id: str) -> Optional[int]:
+        if not self.exists(session_id):
+            return None
+        return self._execute(
+            "SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)
+        ).fetchone()[0]
+
+    def append_message(self, session_id: str, message: Message):
+        # 外部存储只在写入时刷新活跃时间，避免每次轮询都产生一次写操作
+        with self.lock:
+            self.conn.execute("BEGIN")
+            # 会话已被删除时不写入，避免留下没有会话的消息
+            self.conn.execute(
+                "INSERT INTO messages (session_id, sender, message, timestamp) "
+                "SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM sessions WHERE session_id = ?)",
+                (session_id, message.sender.label, message.message, message.timestamp, session_id)
+            )
+            self.conn.execute(
+                "UPDATE sessions SET last_active = ? WHERE session_id = ?", (time.time(), session_id)
+            )
+            self.conn.execute("COMMIT")
+
+    def get_context_window(self, session_id: str) -> Optional[ContextWindow]:
+        row = self._execute(
+            "SELECT summary, folded FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        turns = self._execute(
+            "SELECT text FROM context_turns WHERE session_id = ? ORDER BY id", (session_id,)
+        ).fetchall()
+        return ContextWindow(row[0], row[1], [text for (text,) in turns])
+
+    def append_context(self, session_id: str, text: str):
+        self._execute(
+            "INSERT INTO context_turns (session_id, text) VALUES (?, ?)", (session_id, text)
+        )
+
+    def fold_context(self, session_id: str, expected_folded: int, count: int, summary: str) -> bool:
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self.conn.execute(
+                    "UPDATE sessions SET summary = ?, folded = folded + ? "
+                    "WHERE session_id = ? AND folded = ?",
+                    (summary, count, session_id, expected_folded)
+                )
+                applied = cursor.rowcount == 1
+                if applied:
+                    self.conn.execute(
+                        "DELETE FROM context_turns WHERE id IN ("
+                        "SELECT id FROM context_turns WHERE session_id = ? ORDER BY id LIMIT ?)",
+                        (session_id, count)
+                    )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return applied
+
+    def get_state(self, session_id: str) -> Optional[dict]:
+        row = self._execute(
+            "SELECT is_responding, prompt_to_process FROM sessions WHERE session_id = ?",
+            (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"is_responding": bool(row[0]), "prompt_to_process": row[1]}
+
+    def update_state(self, session_id: str, **fields):
+        fields["last_active"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        self._execute(
+            f"UPDATE sessions SET {columns} WHERE session_id = ?",
+            (*fields.values(), session_id)
+        )
+
+    def begin_generation(self, session_id: str, lease_seconds: float) -> Optional[str]:
+        now = time.time()
+        token = uuid.uuid4().hex
+        cursor = self._execute(
+            "UPDATE sessions SET generating_until = ?, generation_token = ? "
+            "WHERE session_id = ? AND generating_until <= ?",
+            (now + lease_seconds, token, session_id, now)
+        )
+        return token if cursor.rowcount == 1 else None
+
+    def end_generation(self, session_id: str, token: str):
+        self._execute(
+            "UPDATE sessions SET generating_until = 0, generation_token = NULL "
+            "WHERE session_id = ? AND generation_token = ?",
+            (session_id, token)
+        )
+
+    def count(self) -> int:
+        return self._execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def idle_sessions(self, before: float, limit: int) -> List[str]:
+        rows = self._execute(
+            "SELECT session_id FROM sessions WHERE last_active < ? ORDER BY last_active LIMIT ?",
+            (before, limit)
+        ).fetchall()
+        return [session_id for (session_id,) in rows]
+
+    def oldest_sessions(self, limit: int) -> List[str]:
+        rows = self._execute(
+            "SELECT session_id FROM sessions ORDER BY last_active LIMIT ?", (limit,)
+        ).fetchall()
+        return [session_id for (session_id,) in rows]
+
+    def close(self):
+        self.conn.close()
+
+
+class RedisSessionStore(SessionStore):
+    """Redis 协议存储，可部署在多台机器的多个 worker 之间共享。
+
+    client 需兼容 redis-py 的同步接口，测试时可传入 fakeredis 等本地替身。
+    """
+
+    def __init__(self, client=None, url: str = REDIS_URL, prefix: str = REDIS_PREFIX):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.redis = client
+        self.prefix = prefix
+
+    def _state_key(self, session_id: str) -> str:
+        return f"{self.prefix}session:{session_id}"
+
+    def _conversation_key(self, session_id: str) -> str:
+        return f"{self.prefix}conversation:{session_id}"
+
+    def _context_key(self, session_id: str) -> str:
+        return f"{self.prefix}context:{session_id}"
+
+    def _lease_key(self, session_id: str) -> str:
+        return f"{self.prefix}generating:{session_id}"
+
+    @property
+    def _index_key(self) -> str:
+        # 有序集合，score 为会话最后活跃时间
+        return f"{self.prefix}active_sessions"
+
+    def create(self, session_id: str) -> bool:
+        created = self.redis.hsetnx(self._state_key(session_id), "is_responding", "0")
+        if created:
+            self.redis.zadd(self._index_key, {session_id: time.time()})
+        return bool(created)
+
+    def exists(self, session_id: str) -> bool:
+        return bool(self.redis.exists(self._state_key(session_id)))
+
+    def delete(self, session_id: str):
+        pipe = self.redis.pipeline()
+        pipe.delete(
+            self._state_key(session_id),
+            self._conversation_key(session_id),
+            self._context_key(session_id),
+            self._lease_key(session_id)
+        )
+        pipe.zrem(self._index_key, session_id)
+        pipe.execute()
+
+    def get_conversation(self, session_id: str) -> Optional[List[Message]]:
+        pipe = self.redis.pipeline()
+        pipe.exists(self._state_key(session_id))
+        pipe.lrange(self._conversation_key(session_id), 0, -1)
+        exists, items = pipe.execute()
+        if not exists:
+            return None
+        return [Message.from_json(item) for item in items]
+
+    def get_messages(self, session_id: str, since: int = 0,
+                     limit: Optional[int] = None) -> Optional[List[Message]]:
+        pipe = self.redis.pipeline()
+        pipe.exists(self._state_key(session_id))
+        pipe.lrange(self._conversation_key(session_id), since, -1 if limit is None else since + limit - 1)
+        exists, items = pipe.execute()
+        if not exists:
+            return None
+        return [Message.from_json(item) for item in items]
+
+    def message_count(self, session_id: str) -> Optional[int]:
+        pipe = self.redis.pipeline()
+        pipe.exists(self._state_key(session_id))
+        pipe.llen(self._conversation_key(session_id))
+        exists, length = pipe.execute()
+        return length if exists else None
+
+    def _write_if_exists(self, session_id: str, write: Callable) -> bool:
+        """会话存在时在事务中执行 write(pipe)，返回是否写入。
+
+        会话可能已被删除或淘汰，无条件写入会重新创建出只有部分字段的会话。
+        """
+        from redis.exceptions import WatchError
+
+        state_key = self._state_key(session_id)
+        with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(state_key)
+                    if not pipe.exists(state_key):
+                        return False
+                    pipe.multi()
+                    write(pipe)
+                    pipe.execute()
+                    return True
+                except WatchError:
+                    # 会话状态在检查后被修改（并发的状态更新或删除），重新检查
+                    continue
+
+    def append_message(self, session_id: str, message: Message):
+        def write(pipe):
+            pipe.rpush(self._conversation_key(session_id), message.to_json())
+            pipe.zadd(self._index_key, {session_id: time.time()})
+
+        self._write_if_exists(session_id, write)
+
+    def get_context_window(self, session_id: str) -> Optional[ContextWindow]:
+        pipe = self.redis.pipeline()
+        pipe.hmget(self._state_key(session_id), "is_responding", "summary", "folded")
+        pipe.lrange(self._context_key(session_id), 0, -1)
+        (exists, summary, folded), turns = pipe.execute()
+        if exists is None:
+            return None
+        return ContextWindow(summary or "", int(folded or 0), turns)
+
+    def append_context(self, session_id: str, text: str):
+        self.redis.rpush(self._context_key(session_id), text)
+
+    def fold_context(self, session_id: str, expected_folded: int, count: int, summary: str) -> bool:
+        from redis.exceptions import WatchError
+
+        state_key = self._state_key(session_id)
+        with self.redis.pipeline() as pipe:
+            try:
+                pipe.watch(state_key)
+                # 会话可能在摘要生成期间被淘汰，不能重新创建出残缺的会话
+                if not pipe.exists(state_key):
+                    return False
+                if int(pipe.hget(state_key, "folded") or 0) != expected_folded:
+                    return False
+                pipe.multi()
+                pipe.hset(state_key, mapping={"summary": summary, "folded": expected_folded + count})
+                pipe.ltrim(self._context_key(session_id), count, -1)
+                pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    def get_state(self, session_id: str) -> Optional[dict]:
+        state = self.redis.hgetall(self._state_key(session_id))
+        if not state:
+            return None
+        return {
+            "is_responding": state.get("is_responding") == "1",
+            "prompt_to_process": state.get("prompt_to_process") or None
+        }
+
+    def update_state(self, session_id: str, **fields):
+        mapping = {}
+        for name, value in fields.items():
+            if isinstance(value, bool):
+                value = "1" if value else "0"
+            mapping[name] = "" if value is None else value
+
+        def write(pipe):
+            pipe.hset(self._state_key(session_id), mapping=mapping)
+            pipe.zadd(self._index_key, {session_id: time.time()})
+
+        self._write_if_exists(session_id, write)
+
+    def begin_generation(self, session_id: str, lease_seconds: float) -> Optional[str]:
+        if not self.exists(session_id):
+            return None
+        token = uuid.uuid4().hex
+        acquired = self.redis.set(self._lease_key(session_id), token, nx=True, px=int(lease_seconds * 1000))
+        return token if acquired else None
+
+    def end_generation(self, session_id: str, token: str):
+        from redis.exceptions import WatchError
+
+        lease_key = self._lease_key(session_id)
+        with self.redis.pipeline() as pipe:
+            try:
+                pipe.watch(lease_key)
+                if pipe.get(lease_key) != token:
+                    return
+                pipe.multi()
+                pipe.delete(lease_key)
+                pipe.execute()
+            except WatchError:
+                # 检查后租约被修改：只可能是过期后被其他 worker 取得，不能删除
+                pass
+
+    def count(self) -> int:
+        return self.redis.zcard(self._index_key)
+
+    def idle_sessions(self, before: float, limit: int) -> List[str]:
+        return self.redis.zrangebyscore(self._index_key, "-inf", f"({before}", start=0, num=limit)
+
+    def oldest_sessions(self, limit: int) -> List[str]:
+        return self.redis.zrange(self._index_key, 0, limit - 1)
+
+    def close(self):
+        self.redis.close()
+
+
+async def call_store(store: SessionStore, fn: Callable, *args, **kwargs):
+    """在事件循环中执行访问会话存储的调用：进程内存储直接调用，SQLite / Redis 的阻塞 I/O 放到线程中执行。"""
+    if isinstance(store, MemorySessionStore):
+        return fn(*args, **kwargs)
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+
+class AsyncSessionStore:
+    """SessionStore 的协程接口，方法与 SessionStore 相同，供请求处理函数在事件循环中使用。"""
+
+    def __init__(self, store: SessionStore):
+        self.store = store
+
+    def __getattr__(self, name: str):
+        method = getattr(self.store, name)
+
+        async def call(*args, **kwargs):
+            return await call_store(self.store, method, *args, **kwargs)
+
+        # 只在第一次访问时生成包装函数
+        setattr(self, name, call)
+        return call
+
+
+def create_session_store(kind: str = SESSION_STORE) -> SessionStore:
+    if kind == "memory":
+        if SESSION_JOURNAL_DIR:
+            return JournaledSessionStore(SessionJournal())
+        return MemorySessionStore()
+    if kind == "sqlite":
+        return SQLiteSessionStore()
+    if kind == "redis":
+        return RedisSessionStore()
+    raise ValueError(f"未知的会话存储类型: {kind}")
@@ -0,0 +1,264 @@
+"""增量式 SSE（text/event-stream）解析，后端、独立版 Xiaowen 和前端共用。
+
+直接处理网络读到的字节块，支持多行 data、event/id/retry 字段和注释行，一个空行结束一个事件。
+一行 data 本身就是完整的 JSON 对象或 [DONE] 时立即分发，不等空行，兼容事件之间只用一个换行分隔的上游。
+全程按字节切行（换行符是单字节 ASCII），多字节字符被拆在两个块之间时留在缓冲中，
+直到整行到齐才解析，data 不解码成 str，直接交给 JSON 解码器（已安装时使用 orjson）。
+本模块不依赖同目录下的其他模块，可以作为 Front_back_Net.sse 导入。
+"""
+import json
+from typing import AsyncIterable, AsyncIterator, Callable, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_scan_once = json.JSONDecoder().scan_once
+
+
+def stdlib_loads(data: bytes):
+    """没有 orjson 时的 JSON 解码：直接调用标准库 C 实现的扫描器。
+
+    省去 json.loads 对 bytes 的编码探测、两次空白正则匹配和几层 Python 调用，每个 token 都会调用一次。
+    前后有空白或不是合法 JSON 等少见情况交给 json.loads，由它处理并抛出同样的异常。
+    """
+    text = data.decode("utf-8")
+    try:
+        value, end = _scan_once(text, 0)
+    except StopIteration:
+        return json.loads(text)
+    if end != len(text):
+        return json.loads(text)
+    return value
+
+
+if orjson is not None:
+    loads = orjson.loads
+    JSON_ERRORS = (orjson.JSONDecodeError, UnicodeDecodeError)
+else:
+    loads = stdlib_loads
+    JSON_ERRORS = (json.JSONDecodeError, UnicodeDecodeError)
+
+# 上游在流结束时发送的标记
+DONE = b"[DONE]"
+
+# SSEEvent 还没有解析过 JSON
+_UNPARSED = object()
+
+
+class SSEEvent:
+    """一个完整的事件，data 为原始字节（多行 data 以 \\n 连接）。"""
+
+    __slots__ = ("event", "data", "id", "lines", "_value")
+
+    def __init__(self, event: str, data: bytes, id: Optional[str], lines: int = 1, value=_UNPARSED):
+        self.event = event
+        self.data = data
+        self.id = id
+        # data 行数，用于兼容事件之间不加空行的上游
+        self.lines = lines
+        # 解析器判断事件是否完整时已经解析过的 JSON
+        self._value = value
+
+    @property
+    def text(self) -> str:
+        return self.data.decode("utf-8", errors="replace")
+
+    def json(self):
+        if self._value is _UNPARSED:
+            return loads(self.data)
+        return self._value
+
+    def __repr__(self) -> str:
+        return f"SSEEvent({self.event!r}, {self.data!r}, id={self.id!r})"
+
+
+class SSEParser:
+    """按 SSE 规范增量解析字节流，feed 返回本块中已完整的事件。"""
+
+    def __init__(self):
+        self._pending = b""
+        self._data: List[bytes] = []
+        self._event = ""
+        self.last_id: Optional[str] = None
+        self.retry: Optional[int] = None
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        buffer = self._pending + chunk if self._pending else chunk
+        if b"\r" in buffer:
+            # 块末尾的 \r 可能和下一块开头的 \n 组成 \r\n，留到下一块再处理
+            held = b""
+            if buffer.endswith(b"\r"):
+                buffer, held = buffer[:-1], b"\r"
+            lines = buffer.replace(b"\r\n", b"\n").replace(b"\r", b"\n").split(b"\n")
+            self._pending = lines.pop() + held
+        else:
+            lines = buffer.split(b"\n")
+            self._pending = lines.pop()
+
+        events = []
+        data = self._data
+        for line in lines:
+            if not line:
+                if data:
+                    events.append(self._dispatch())
+                    data = self._data
+                else:
+                    self._event = ""
+            elif line.startswith(b"data:"):
+                value = line[6:] if line[5:6] == b" " else line[5:]
+                # 单独一行就是完整的数据块时立即分发，之前缓冲的行作为上一个事件先分发；
+                # 每行最多尝试解析一次，跨多行的 data 等到空行再整体解析
+                if value[:1] == b"{":
+                    try:
+                        parsed = loads(value)
+                    except JSON_ERRORS:
+                        data.append(value)
+                        continue
+                elif value == DONE:
+                    parsed = _UNPARSED
+                else:
+                    data.append(value)
+                    continue
+                if data:
+                    events.append(self._dispatch())
+                    data = self._data
+                events.append(SSEEvent(self._event or "message", value, self.last_id, 1, parsed))
+                # event 字段只作用于它所在的事件，与空行分发时一样重置
+                self._event = ""
+            elif line[0] != 0x3A:  # 以 ":" 开头的是注释（常用作心跳）
+                self._field(line)
+        return events
+
+    def close(self) -> List[SSEEvent]:
+        """流结束：处理缓冲中最后一行，并把没有以空行结尾的事件也分发出去。"""
+        events = self.feed(b"\n")
+        if self._data:
+            events.append(self._dispatch())
+        return events
+
+    def _field(self, line: bytes):
+        name, _, value = line.partition(b":")
+        if value.startswith(b" "):
+            value = value[1:]
+        if name == b"event":
+            self._event = value.decode("utf-8", errors="replace")
+        elif name == b"id":
+            if b"\0" not in value:
+                self.last_id = value.decode("utf-8", errors="replace")
+        elif name == b"retry":
+            if value.isdigit():
+                self.retry = int(value)
+        # 其他字段按规范忽略
+
+    def _dispatch(self, value=_UNPARSED) -> SSEEvent:
+        data = self._data
+        event = self._event
+        self._data = []
+        self._event = ""
+        return SSEEvent(event or "message", data[0] if len(data) == 1 else b"\n".join(data),
+                        self.last_id, len(data), value)
+
+
+def iter_events(chunks: Iterable[bytes]) -> Iterator[SSEEvent]:
+    parser = SSEParser()
+    for chunk in chunks:
+        if chunk:
+            yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+async def aiter_events(chunks: AsyncIterable[bytes]) -> AsyncIterator[SSEEvent]:
+    parser = SSEParser()
+    async for chunk in chunks:
+        if chunk:
+            for event in parser.feed(chunk):
+                yield event
+    for event in parser.close():
+        yield event
+
+
+def extract_token(chunk: dict) -> str:
+    """从一个 SSE 数据块中取出增量文本，兼容流式 delta 和非流式 message 两种格式。"""
+    try:
+        return chunk["choices"][0]["delta"]["content"] or ""
+    except (KeyError, IndexError, TypeError):
+        pass
+    choices = chunk.get("choices") if isinstance(chunk, dict) else None
+    if not choices:
+        return ""
+    choice = choices[0]
+    delta = choice.get("delta") or choice.get("message") or {}
+    return delta.get("content") or choice.get("text") or ""
+
+
+def _split_tokens(data: bytes, tokens: List[str], on_error: Optional[Callable[[], None]]) -> bool:
+    # 多行 data 拼接后不是合法 JSON 时，按每行一个数据块处理（事件之间不加空行的上游）
+    for line in data.split(b"\n"):
+        if line == DONE:
+            return True
+        try:
+            token = extract_token(loads(line))
+        except JSON_ERRORS:
+            if on_error is not None:
+                on_error()
+            continue
+        if token:
+            tokens.append(token)
+    return False
+
+
+def collect_tokens(events: List[SSEEvent],
+                   on_error: Callable[[], None] = None) -> Tuple[List[str], bool]:
+    """解析一批事件中的 JSON 数据块，返回 (非空 token 列表, 是否遇到了 [DONE])。"""
+    tokens = []
+    for event in events:
+        data = event.data
+        if data == DONE:
+            return tokens, True
+        try:
+            # 解析器已经解析过的数据块直接取结果，省去一次方法调用
+            value = event._value
+            token = extract_token(loads(data) if value is _UNPARSED else value)
+        except JSON_ERRORS:
+            if event.lines > 1:
+                if _split_tokens(data, tokens, on_error):
+                    return tokens, True
+            elif on_error is not None:
+                on_error()
+            continue
+        if token:
+            tokens.append(token)
+    return tokens, False
+
+
+def iter_tokens(chunks: Iterable[bytes], on_error: Callable[[], None] = None) -> Iterator[str]:
+    """从 OpenAI 风格的 SSE 字节流中逐个产出非空 token，遇到 [DONE] 结束。
+
+    on_error 在跳过无法解析的数据块时调用（例如用于计数）。
+    """
+    parser = SSEParser()
+    for chunk in chunks:
+        if chunk:
+            tokens, done = collect_tokens(parser.feed(chunk), on_error)
+            yield from tokens
+            if done:
+                return
+    tokens, _ = collect_tokens(parser.close(), on_error)
+    yield from tokens
+
+
+async def aiter_tokens(chunks: AsyncIterable[bytes],
+                       on_error: Callable[[], None] = None) -> AsyncIterator[str]:
+    parser = SSEParser()
+    async for chunk in chunks:
+        if chunk:
+            tokens, done = collect_tokens(parser.feed(chunk), on_error)
+            for token in tokens:
+                yield token
+            if done:
+                return
+    tokens, _ = collect_tokens(parser.close(), on_error)
+    for token in tokens:
+        yield token
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 后端模块之间使用同级导入，与 benchmarks 相同，把后端目录加入搜索路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,202 @@
+"""三种会话存储的行为一致性测试：memory、sqlite（临时文件）和 redis（fakeredis）。
+
+open_store 每次返回一个指向同一份数据的新句柄，sqlite 和 redis 各自使用独立连接，
+相当于多个 worker 进程同时访问同一个存储；memory 存储只能在单进程内使用，返回同一个实例。
+"""
+import threading
+import time
+
+import pytest
+
+from messages import Message, Sender
+from session_store import MemorySessionStore, RedisSessionStore, SQLiteSessionStore
+
+THREADS = 4
+MESSAGES_PER_THREAD = 50
+
+
+def make_message(sender: str, text: str, offset: int) -> Message:
+    return Message(sender, text, 1_700_000_000 + offset)
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def open_store(request, tmp_path):
+    handles = []
+
+    if request.param == "memory":
+        shared = MemorySessionStore()
+
+        def factory():
+            return shared
+    elif request.param == "sqlite":
+        path = str(tmp_path / "sessions.db")
+
+        def factory():
+            handle = SQLiteSessionStore(path)
+            handles.append(handle)
+            return handle
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        server = fakeredis.FakeServer()
+
+        def factory():
+            handle = RedisSessionStore(fakeredis.FakeRedis(server=server, decode_responses=True))
+            handles.append(handle)
+            return handle
+
+    yield factory
+    for handle in handles:
+        handle.close()
+
+
+@pytest.fixture
+def store(open_store):
+    return open_store()
+
+
+def test_missing_session(store):
+    assert not store.exists("missing")
+    assert store.get_conversation("missing") is None
+    assert store.get_messages("missing") is None
+    assert store.message_count("missing") is None
+    assert store.get_context_window("missing") is None
+    assert store.get_state("missing") is None
+    assert store.begin_generation("missing", 10) is None
+
+
+def test_writes_to_missing_session(store):
+    # 会话可能在生成期间被淘汰，之后的写入不应抛出异常
+    store.append_message("missing", make_message("ai", "迟到的回答", 0))
+    store.update_state("missing", is_responding=False, prompt_to_process=None)
+    # 也不会重新创建出残缺的会话
+    assert not store.exists("missing")
+    assert store.get_state("missing") is None
+    assert store.create("missing")
+    assert store.get_conversation("missing") == []
+
+
+def test_writes_after_delete(open_store):
+    writer, other = open_store(), open_store()
+    writer.create("s1")
+    writer.append_message("s1", make_message("user", "你好", 0))
+    other.delete("s1")
+    writer.update_state("s1", is_responding=True)
+    writer.append_message("s1", make_message("ai", "回答", 1))
+    assert not other.exists("s1")
+    assert other.count() == 0
+
+
+def test_round_trip(store):
+    assert store.create("s1")
+    assert not store.create("s1")
+    assert store.exists("s1")
+    assert store.get_state("s1") == {"is_responding": False, "prompt_to_process": None}
+    assert store.get_conversation("s1") == []
+
+    messages = [make_message("user" if i % 2 == 0 else "ai", f"消息 {i}", i) for i in range(5)]
+    for message in messages:
+        store.append_message("s1", message)
+    assert store.get_conversation("s1") == messages
+    assert store.message_count("s1") == 5
+    assert store.get_messages("s1", since=2) == messages[2:]
+    assert store.get_messages("s1", since=1, limit=2) == messages[1:3]
+    assert store.get_messages("s1", since=5) == []
+    assert store.get_conversation("s1")[1].sender is Sender.AI
+
+    store.update_state("s1", is_responding=True, prompt_to_process="交易时间？")
+    assert store.get_state("s1") == {"is_responding": True, "prompt_to_process": "交易时间？"}
+    store.update_state("s1", is_responding=False, prompt_to_process=None)
+    assert store.get_state("s1") == {"is_responding": False, "prompt_to_process": None}
+
+    for turn in ("问1", "答1", "问2"):
+        store.append_context("s1", turn)
+    window = store.get_context_window("s1")
+    assert (window.summary, window.folded, window.turns) == ("", 0, ["问1", "答1", "问2"])
+    assert store.fold_context("s1", expected_folded=0, count=2, summary="摘要")
+    # 折叠数已变化，基于旧窗口的第二次折叠不生效
+    assert not store.fold_context("s1", expected_folded=0, count=2, summary="旧摘要")
+    window = store.get_context_window("s1")
+    assert (window.summary, window.folded, window.turns) == ("摘要", 2, ["问2"])
+
+    store.delete("s1")
+    assert not store.exists("s1")
+    assert store.get_conversation("s1") is None
+    assert store.get_state("s1") is None
+
+
+def test_data_visible_to_other_handles(open_store):
+    writer, reader = open_store(), open_store()
+    writer.create("s1")
+    writer.append_message("s1", make_message("user", "你好", 0))
+    writer.update_state("s1", prompt_to_process="你好")
+    assert reader.get_conversation("s1") == [make_message("user", "你好", 0)]
+    assert reader.get_state("s1")["prompt_to_process"] == "你好"
+
+
+def test_begin_generation_is_exclusive(open_store):
+    first, second = open_store(), open_store()
+    first.create("s1")
+    lease = first.begin_generation("s1", 10)
+    assert lease is not None
+    assert first.begin_generation("s1", 10) is None
+    assert second.begin_generation("s1", 10) is None
+    first.end_generation("s1", lease)
+    assert second.begin_generation("s1", 10) is not None
+
+
+def test_generation_lease_expires(open_store):
+    first, second = open_store(), open_store()
+    first.create("s1")
+    stale = first.begin_generation("s1", 0.1)
+    assert stale is not None
+    assert second.begin_generation("s1", 0.1) is None
+    # 持有者崩溃、没有调用 end_generation 时，租约到期后其他 worker 可以接手
+    time.sleep(0.25)
+    assert second.begin_generation("s1", 10) is not None
+    assert first.begin_generation("s1", 10) is None
+    # 原持有者迟到的释放不影响新的租约
+    first.end_generation("s1", stale)
+    assert first.begin_generation("s1", 10) is None
+
+
+def test_concurrent_begin_generation(open_store):
+    handles = [open_store() for _ in range(8)]
+    handles[0].create("s1")
+    barrier = threading.Barrier(len(handles))
+    results = []
+
+    def worker(handle):
+        barrier.wait()
+        results.append(handle.begin_generation("s1", 10) is not None)
+
+    threads = [threading.Thread(target=worker, args=(handle,)) for handle in handles]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == [False] * (len(handles) - 1) + [True]
+
+
+def test_concurrent_appends(open_store):
+    handles = [open_store() for _ in range(THREADS)]
+    handles[0].create("s1")
+    barrier = threading.Barrier(THREADS)
+
+    def worker(number, handle):
+        barrier.wait()
+        for i in range(MESSAGES_PER_THREAD):
+            handle.append_message("s1", make_message("user", f"{number}:{i}", i))
+
+    threads = [threading.Thread(target=worker, args=(number, handle)) for number, handle in enumerate(handles)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    conversation = handles[0].get_conversation("s1")
+    assert handles[0].message_count("s1") == THREADS * MESSAGES_PER_THREAD
+    assert len(conversation) == THREADS * MESSAGES_PER_THREAD
+    # 不丢失也不重复，每个线程自己的消息保持写入顺序
+    for number in range(THREADS):
+        own = [m.message for m in conversation if m.message.startswith(f"{number}:")]
+        assert own == [f"{number}:{i}" for i in range(MESSAGES_PER_THREAD)]
@@ -0,0 +1,184 @@
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Tuple
+
+import httpx
+
+from metrics import (
+    SSE_PARSE_ERRORS, UPSTREAM_DURATION, UPSTREAM_ERRORS, UPSTREAM_TOKEN_RATE, UPSTREAM_TTFT
+)
+from resilience import CircuitBreaker, CircuitOpen, LatencyTracker, UpstreamError, resilient_stream
+from sse import aiter_tokens
+
+# 上游大模型接口配置（可通过环境变量覆盖）
+WENHUA_API_URL = os.getenv("WENHUA_API_URL", "Wenhua API")
+# DeepSeek（OpenAI 兼容接口）
+DEEPSEEK_API_URL = os.getenv("DEEPSEEK_API_URL", "https://api.deepseek.com")
+DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "")
+DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
+# 各上游每千 token 的相对成本，供路由选择时参考
+WENHUA_COST = float(os.getenv("WENHUA_COST", "1.0"))
+DEEPSEEK_COST = float(os.getenv("DEEPSEEK_COST", "1.0"))
+# 路由统计的指数滑动平均系数，越大越偏向最近的请求
+PROVIDER_EWMA_ALPHA = float(os.getenv("PROVIDER_EWMA_ALPHA", "0.2"))
+# 建立连接、相邻两次读取（即 token 间隔）和发送请求体的超时；首 token 超时见 resilience.py
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_TOKEN_TIMEOUT = float(os.getenv("UPSTREAM_TOKEN_TIMEOUT", os.getenv("UPSTREAM_TIMEOUT", "30")))
+UPSTREAM_WRITE_TIMEOUT = float(os.getenv("UPSTREAM_WRITE_TIMEOUT", "10"))
+# 连接池配置：单个 worker 可同时进行的上游生成数量由连接数决定，而不是线程池大小
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "200"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "50"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "1") == "1"
+
+
+def _http2_available() -> bool:
+    # httpx 的 HTTP/2 支持依赖可选的 h2 包
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """创建进程级共享的上游连接池，整个应用生命周期内复用 keep-alive 连接。"""
+    limits = httpx.Limits(
+        max_connections=UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncClient(
+        limits=limits,
+        timeout=httpx.Timeout(
+            connect=UPSTREAM_CONNECT_TIMEOUT,
+            read=UPSTREAM_TOKEN_TIMEOUT,
+            write=UPSTREAM_WRITE_TIMEOUT,
+            pool=UPSTREAM_CONNECT_TIMEOUT,
+        ),
+        http2=UPSTREAM_HTTP2 and _http2_available(),
+    )
+
+
+class Provider:
+    """一个上游大模型。子类只需给出请求地址、请求头和请求体，SSE 解析、熔断重试和统计由基类完成。"""
+
+    name = "provider"
+
+    def __init__(self, client: httpx.AsyncClient, cost: float = 1.0,
+                 breaker: CircuitBreaker = None):
+        self.client = client
+        self.cost = cost
+        self.breaker = breaker or CircuitBreaker(self.name)
+        self.latency = LatencyTracker()
+        # 路由使用的滑动统计：首 token 延迟和失败率
+        self.ttft_ewma: Optional[float] = None
+        self.error_ewma = 0.0
+        self.requests = 0
+
+    def build_request(self, content_text: str) -> Tuple[str, dict, dict]:
+        """返回 (url, headers, json 请求体)。"""
+        raise NotImplementedError
+
+    @asynccontextmanager
+    async def generate_response(self, content_text: str) -> AsyncIterator[httpx.Response]:
+        url, headers, payload = self.build_request(content_text)
+        async with self.client.stream("POST", url, headers=headers, json=payload) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise UpstreamError(response.status_code, response.text)
+            yield response
+
+    async def _stream_once(self, content_text: str) -> AsyncIterator[str]:
+        """单次请求上游并增量解析 SSE 字节流，逐个产出增量 token。"""
+        async with self.generate_response(content_text) as response_stream:
+            async for token in aiter_tokens(response_stream.aiter_bytes(), on_error=SSE_PARSE_ERRORS.inc):
+                yield token
+
+    def _record(self, ttft: Optional[float], failed: bool):
+        self.requests += 1
+        self.error_ewma += PROVIDER_EWMA_ALPHA * ((1.0 if failed else 0.0) - self.error_ewma)
+        if ttft is not None:
+            if self.ttft_ewma is None:
+                self.ttft_ewma = ttft
+            else:
+                self.ttft_ewma += PROVIDER_EWMA_ALPHA * (ttft - self.ttft_ewma)
+
+    async def stream_tokens(self, content_text: str) -> AsyncIterator[str]:
+        """逐个产出增量 token（带熔断、重试和对冲），并记录首 token 延迟、总耗时和速率。"""
+        start = time.perf_counter()
+        first_token_at = None
+        token_count = 0
+        try:
+            async for token in resilient_stream(lambda: self._stream_once(content_text),
+                                                self.breaker, self.latency):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    UPSTREAM_TTFT.observe(first_token_at - start)
+                token_count += 1
+                yield token
+        except CircuitOpen:
+            # 熔断时请求没有发往上游，不计入上游错误和失败率
+            raise
+        except Exception:
+            UPSTREAM_ERRORS.inc()
+            self._record(None, failed=True)
+            raise
+
+        end = time.perf_counter()
+        self._record(first_token_at - start if first_token_at is not None else None, failed=False)
+        UPSTREAM_DURATION.observe(end - start)
+        if first_token_at is not None and end > first_token_at:
+            UPSTREAM_TOKEN_RATE.observe(token_count / (end - first_token_at))
+
+    async def complete(self, content_text: str) -> str:
+        """非流式调用，返回完整回复文本。"""
+        return "".join([token async for token in self.stream_tokens(content_text)])
+
+    def stats(self) -> dict:
+        return {
+            "breaker": CircuitBreaker.STATE_NAMES[self.breaker.state],
+            "consecutive_failures": self.breaker.failures,
+            "requests": self.requests,
+            "ttft_ewma": self.ttft_ewma,
+            "error_rate_ewma": self.error_ewma,
+            "cost": self.cost,
+        }
+
+
+class WenHuaAPI(Provider):
+    name = "wenhua"
+
+    def __init__(self, client: httpx.AsyncClient, base_url: str = WENHUA_API_URL,
+                 breaker: CircuitBreaker = None, cost: float = WENHUA_COST):
+        super().__init__(client, cost, breaker)
+        self.base_url = base_url
+        self.headers = {"Content-Type": "application/json"}
+
+    def build_request(self, content_text: str) -> Tuple[str, dict, dict]:
+        return self.base_url, self.headers, {"content": content_text}
+
+
+class DeepSeekAPI(Provider):
+    """DeepSeek 的 OpenAI 兼容 chat/completions 流式接口，提示词整体作为一条用户消息发送。"""
+
+    name = "deepseek"
+
+    def __init__(self, client: httpx.AsyncClient, base_url: str = DEEPSEEK_API_URL,
+                 api_key: str = DEEPSEEK_API_KEY, model: str = DEEPSEEK_MODEL,
+                 breaker: CircuitBreaker = None, cost: float = DEEPSEEK_COST):
+        super().__init__(client, cost, breaker)
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.model = model
+        self.headers = {"Content-Type": "application/json"}
+        if api_key:
+            self.headers["Authorization"] = f"Bearer {api_key}"
+
+    def build_request(self, content_text: str) -> Tuple[str, dict, dict]:
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": content_text}],
+            "stream": True,
+        }
+        return self.url, self.headers, payload
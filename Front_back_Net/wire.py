@@ -0,0 +1,188 @@
+"""后端接口响应的编码：JSON 序列化、MessagePack 内容协商和响应压缩。
+
+- 安装了 orjson 时，接口返回的字典和对话历史都用 orjson 编码
+- 请求头 Accept 显式接受 application/msgpack（q 值不低于 JSON）且安装了 msgpack（pip install msgpack）时，
+  对话历史和同步接口返回 MessagePack
+- CompressionMiddleware 按 Accept-Encoding 压缩不小于 RESPONSE_COMPRESS_MIN_BYTES 的一次性响应体，
+  安装了 brotli（pip install brotli）时优先使用 br，否则 gzip；SSE 等流式响应不压缩
+"""
+import gzip
+import os
+from typing import Dict, Optional
+
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+from starlette.datastructures import MutableHeaders
+
+from metrics import COMPRESSION_SAVED_BYTES, RESPONSE_BYTES
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class OrjsonResponse(JSONResponse):
+    """用 orjson 编码的 JSON 响应。
+
+    新版 FastAPI 已弃用自带的 ORJSONResponse，这里直接覆盖 JSONResponse.render。
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+# 接口返回字典时使用的响应类
+DEFAULT_RESPONSE_CLASS = OrjsonResponse if orjson is not None else JSONResponse
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+_MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, "application/x-msgpack")
+
+# 响应压缩：设为 0 关闭；小于阈值的响应体压缩后收益很小，不值得额外的 CPU
+RESPONSE_COMPRESSION_ENABLED = os.getenv("RESPONSE_COMPRESSION", "1") == "1"
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "1024"))
+# 对话 JSON 重复度很高，低压缩级别的压缩率已接近默认级别，CPU 只需一半左右
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "1"))
+RESPONSE_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "2"))
+
+# 服务端支持的编码，按优先顺序
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def parse_qvalues(header: str) -> Dict[str, float]:
+    """解析 Accept / Accept-Encoding 形式的请求头，返回 {小写的取值: q 值}，没有 q 参数时为 1。"""
+    accepted = {}
+    for part in header.split(","):
+        name, *params = part.split(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+def accepts_msgpack(request: Request) -> bool:
+    """Accept 中显式列出 MessagePack、q 值大于 0 且不低于 JSON 时返回 True。
+
+    通配符 */* 只表示可以接受任意类型，不会选中 MessagePack。
+    """
+    if msgpack is None:
+        return False
+    accepted = parse_qvalues(request.headers.get("accept", ""))
+    msgpack_q = max(accepted.get(media_type, 0.0) for media_type in _MSGPACK_MEDIA_TYPES)
+    if msgpack_q <= 0:
+        return False
+    json_q = accepted.get("application/json", accepted.get("application/*", accepted.get("*/*", 0.0)))
+    return msgpack_q >= json_q
+
+
+def negotiated_response(request: Request, render_json, build, headers: dict) -> Response:
+    """按 Accept 返回 MessagePack 或 JSON。
+
+    render_json 返回 JSON 字节串，build 返回用于 MessagePack 编码的对象，只调用实际需要的那一个。
+    """
+    headers = {**headers, "Vary": "Accept"}
+    if accepts_msgpack(request):
+        return Response(msgpack.packb(build()), media_type=MSGPACK_MEDIA_TYPE, headers=headers)
+    return Response(render_json(), media_type="application/json", headers=headers)
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """从 Accept-Encoding 中选出服务端支持且 q 值大于 0 的编码，没有时返回 None。"""
+    accepted = parse_qvalues(accept_encoding)
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY)
+    return gzip.compress(body, RESPONSE_GZIP_LEVEL, mtime=0)
+
+
+def _compressible(start: dict, headers: MutableHeaders) -> bool:
+    if start["status"] < 200 or start["status"] in (204, 206, 304):
+        return False
+    if "content-encoding" in headers:
+        return False
+    return not headers.get("content-type", "").startswith("text/event-stream")
+
+
+class CompressionMiddleware:
+    """纯 ASGI 中间件，压缩一次性发送的较大响应体。
+
+    分多次发送的流式响应（SSE、StreamingResponse）原样转发，不缓冲也不压缩，token 不会被延迟。
+    """
+
+    def __init__(self, app, minimum_size: int = RESPONSE_COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not RESPONSE_COMPRESSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = choose_encoding(accept_encoding)
+        start = None
+        decided = False
+
+        async def send_wrapper(message):
+            nonlocal start, decided
+            if decided:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                # 等到第一段响应体才能决定是否压缩
+                start = message
+                return
+
+            decided = True
+            body = message.get("body", b"")
+            headers = MutableHeaders(scope=start)
+            if message.get("more_body", False) or not _compressible(start, headers):
+                await send(start)
+                await send(message)
+                return
+
+            headers.add_vary_header("Accept-Encoding")
+            if encoding is None or len(body) < self.minimum_size:
+                RESPONSE_BYTES.inc("identity", amount=len(body))
+                await send(start)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            RESPONSE_BYTES.inc(encoding, amount=len(compressed))
+            COMPRESSION_SAVED_BYTES.inc(amount=len(body) - len(compressed))
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            await send(start)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)